@@ -0,0 +1,134 @@
+"""Compare per-call Bedrock clients with the pooled client, against a local stub.
+
+    python benchmarks/bench_bedrock_client.py --calls 50 --batch 32 --latency-ms 20
+
+The stub serves `converse` and `invoke_model` over plain HTTP on localhost, so
+the numbers include client creation and credential setup but no TLS.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from aiohttp import web
+
+
+def make_stub(latency: float) -> web.Application:
+    async def invoke(request):
+        await request.read()
+        await asyncio.sleep(latency)
+        return web.json_response({"embedding": [0.0] * 1024, "inputTextTokenCount": 1})
+
+    async def converse(request):
+        await request.read()
+        await asyncio.sleep(latency)
+        return web.json_response(
+            {
+                "output": {"message": {"role": "assistant", "content": [{"text": "ok"}]}},
+                "stopReason": "end_turn",
+                "usage": {"inputTokens": 1, "outputTokens": 1, "totalTokens": 2},
+                "metrics": {"latencyMs": int(latency * 1000)},
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/model/{model_id}/invoke", invoke)
+    app.router.add_post("/model/{model_id}/converse", converse)
+    return app
+
+
+async def per_call_complete(session, prompt: str):
+    """The completion path as it was: a fresh client for every request"""
+    async with session.client(
+        "bedrock-runtime", region_name=os.environ["AWS_REGION"]
+    ) as bedrock_runtime:
+        await bedrock_runtime.converse(
+            modelId="stub",
+            messages=[{"role": "user", "content": [{"text": prompt}]}],
+            inferenceConfig={"temperature": 0, "maxTokens": 16},
+        )
+
+
+async def per_call_embedding(session, texts: list[str]):
+    """The embedding path as it was: a fresh client, one text after another"""
+    async with session.client(
+        "bedrock-runtime", region_name=os.environ["AWS_REGION"]
+    ) as bedrock_runtime:
+        for text in texts:
+            response = await bedrock_runtime.invoke_model(
+                modelId="amazon.titan-embed-text-v2:0",
+                body=json.dumps({"inputText": text, "dimensions": 1024}),
+            )
+            await response.get("body").read()
+
+
+async def timed(coro_factory, calls: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(i):
+        async with semaphore:
+            await coro_factory(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_one(i) for i in range(calls)])
+    return time.perf_counter() - start
+
+
+async def main(args):
+    runner = web.AppRunner(make_stub(args.latency_ms / 1000), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    os.environ["AWS_ENDPOINT_URL_BEDROCK_RUNTIME"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+
+    import aioboto3
+    from nano_graphrag._llm import (
+        amazon_bedrock_complete_if_cache,
+        amazon_bedrock_embedding,
+        close_async_clients,
+    )
+
+    session = aioboto3.Session()
+    texts = [f"text {i}" for i in range(args.batch)]
+    results = {
+        "complete per-call": await timed(
+            lambda i: per_call_complete(session, f"prompt {i}"), args.calls, args.concurrency
+        ),
+        "complete pooled": await timed(
+            lambda i: amazon_bedrock_complete_if_cache("stub", f"prompt {i}"),
+            args.calls,
+            args.concurrency,
+        ),
+        "embed per-call": await timed(
+            lambda i: per_call_embedding(session, texts), args.calls, args.concurrency
+        ),
+        "embed pooled": await timed(
+            lambda i: amazon_bedrock_embedding(texts), args.calls, args.concurrency
+        ),
+    }
+    await close_async_clients()
+    await runner.cleanup()
+
+    print(
+        f"{args.calls} calls, concurrency {args.concurrency}, "
+        f"embedding batch {args.batch}, stub latency {args.latency_ms} ms"
+    )
+    for name, seconds in results.items():
+        print(f"{name:>18}: {seconds * 1000:9.1f} ms ({seconds * 1000 / args.calls:.2f} ms/call)")
+    for kind in ["complete", "embed"]:
+        speedup = results[f"{kind} per-call"] / results[f"{kind} pooled"]
+        print(f"{kind:>10} speedup: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,86 @@
+"""Compare NetworkXStorage batch lookups against the per-item asyncio.gather path.
+
+    python benchmarks/bench_networkx_batch.py --working-dir cache --top-k 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from nano_graphrag._storage import NetworkXStorage
+
+
+async def gather_baseline(storage: NetworkXStorage, node_ids, edge_pairs):
+    """The batch APIs as they were: one coroutine per item"""
+    await asyncio.gather(*[storage.get_node(n) for n in node_ids])
+    await asyncio.gather(*[storage.node_degree(n) for n in node_ids])
+    nodes_edges = await asyncio.gather(*[storage.get_node_edges(n) for n in node_ids])
+    await asyncio.gather(*[storage.get_edge(s, t) for s, t in edge_pairs])
+    await asyncio.gather(*[storage.edge_degree(s, t) for s, t in edge_pairs])
+    return nodes_edges
+
+
+async def batched(storage: NetworkXStorage, node_ids, edge_pairs):
+    await storage.get_nodes_batch(node_ids)
+    await storage.node_degrees_batch(node_ids)
+    nodes_edges = await storage.get_nodes_edges_batch(node_ids)
+    await storage.get_edges_batch(edge_pairs)
+    await storage.edge_degrees_batch(edge_pairs)
+    return nodes_edges
+
+
+async def main(args):
+    storage = NetworkXStorage(
+        namespace=args.namespace, global_config={"working_dir": args.working_dir}
+    )
+    all_nodes = list(storage._graph.nodes())
+    if not all_nodes:
+        raise SystemExit(f"No graph found in {args.working_dir}")
+    rng = random.Random(args.seed)
+    workloads = []
+    for _ in range(args.queries):
+        node_ids = rng.sample(all_nodes, min(args.top_k, len(all_nodes)))
+        edge_pairs = sorted(
+            set(tuple(sorted(e)) for n in node_ids for e in storage._graph.edges(n))
+        )
+        workloads.append((node_ids, edge_pairs))
+
+    for node_ids, edge_pairs in workloads[:5]:
+        expected = await gather_baseline(storage, node_ids, edge_pairs)
+        assert expected == await batched(storage, node_ids, edge_pairs)
+        assert await asyncio.gather(
+            *[storage.edge_degree(s, t) for s, t in edge_pairs]
+        ) == await storage.edge_degrees_batch(edge_pairs)
+
+    start = time.perf_counter()
+    storage._adjacency = None
+    await storage.node_degrees_batch(all_nodes[:1])
+    build_seconds = time.perf_counter() - start
+
+    timings = {}
+    for name, func in [("gather", gather_baseline), ("batched", batched)]:
+        start = time.perf_counter()
+        for node_ids, edge_pairs in workloads:
+            await func(storage, node_ids, edge_pairs)
+        timings[name] = time.perf_counter() - start
+
+    print(
+        f"graph: {storage._graph.number_of_nodes()} nodes, {storage._graph.number_of_edges()} edges"
+    )
+    print(f"snapshot build: {build_seconds * 1000:.2f} ms")
+    for name, seconds in timings.items():
+        print(
+            f"{name:>8}: {seconds * 1000:.2f} ms for {args.queries} queries "
+            f"({seconds * 1e6 / args.queries:.1f} us/query)"
+        )
+    print(f" speedup: {timings['gather'] / timings['batched']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--working-dir", default="cache")
+    parser.add_argument("--namespace", default="chunk_entity_relation")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,259 @@
+"""End-to-end timings of the indexing and query pipeline on synthetic corpora.
+
+    python benchmarks/bench_pipeline.py --sizes 20,100,400 --output bench.json
+
+Everything runs offline through the "fake" LLM provider and the hashing
+embedder, so the numbers measure nano-graphrag itself: chunking, extraction
+parsing and merging, clustering, community schema and report packing, query
+context building, and storage flush/load for each backend. Results are
+written as JSON, one record per (size, stage), for trend tracking.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+from nano_graphrag import GraphRAG, QueryParam
+from nano_graphrag._op import (
+    extract_entities,
+    generate_community_report,
+    get_chunks,
+)
+from nano_graphrag._storage import (
+    HNSWVectorStorage,
+    JsonKVStorage,
+    NanoVectorDBStorage,
+    NetworkXStorage,
+    SQLiteKVStorage,
+)
+from nano_graphrag._utils import compute_mdhash_id
+
+SYLLABLES = ["al", "bor", "can", "dri", "el", "fen", "gar", "hol", "is", "jun", "kel", "lor", "mar", "nor", "ost", "par", "quin", "ros", "sel", "tor", "ul", "vin", "wen", "yor", "zan"]
+VERBS = ["met", "wrote to", "worked with", "argued with", "travelled with", "visited", "trusted", "funded"]
+
+
+def synthetic_corpus(num_docs: int, seed: int, sentences_per_doc: int = 40) -> list[str]:
+    """Documents mentioning capitalized names from a pool that grows with the corpus"""
+    rng = random.Random(seed)
+    pool = set()
+    while len(pool) < max(10, num_docs * 3):
+        pool.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize())
+    pool = sorted(pool)
+    docs = []
+    for i in range(num_docs):
+        cast = rng.sample(pool, 8)
+        sentences = [
+            f"{rng.choice(cast)} {rng.choice(VERBS)} {rng.choice(cast)} in chapter {i}."
+            for _ in range(sentences_per_doc)
+        ]
+        docs.append(" ".join(sentences))
+    return docs
+
+
+class Recorder:
+    def __init__(self):
+        self.records = []
+
+    async def time(self, size: int, stage: str, coro_or_func, **extra):
+        start = time.perf_counter()
+        result = coro_or_func()
+        if asyncio.iscoroutine(result):
+            result = await result
+        seconds = time.perf_counter() - start
+        self.records.append({"size": size, "stage": stage, "seconds": seconds, **extra})
+        print(f"  {stage:<32} {seconds * 1000:10.1f} ms", file=sys.stderr)
+        return result
+
+
+async def bench_storages(rec: Recorder, size: int, rag: GraphRAG):
+    config = asdict(rag)
+    chunk_keys = await rag.text_chunks.all_keys()
+    chunks = dict(zip(chunk_keys, await rag.text_chunks.get_by_ids(chunk_keys)))
+
+    for name, cls in [("json", JsonKVStorage), ("sqlite", SQLiteKVStorage)]:
+        kv = cls(namespace=f"bench_{name}", global_config=config)
+        await kv.upsert(chunks)
+        await rec.time(size, f"kv_{name}_flush", kv.index_done_callback, items=len(chunks))
+
+        async def _load():
+            loaded = cls(namespace=f"bench_{name}", global_config=config)
+            await loaded.get_by_ids(list(chunks))
+
+        await rec.time(size, f"kv_{name}_load_get_all", _load, items=len(chunks))
+
+    graph = rag.chunk_entity_relation_graph
+    for storage_format in ["graphml", "binary"]:
+        graph_config = {
+            **config,
+            "addon_params": {"networkx_storage_format": storage_format},
+        }
+        writer = NetworkXStorage(namespace="bench_graph", global_config=graph_config)
+        writer._graph = graph._graph
+        await rec.time(
+            size,
+            f"graph_{storage_format}_flush",
+            writer.index_done_callback,
+            nodes=graph._graph.number_of_nodes(),
+        )
+        await rec.time(
+            size,
+            f"graph_{storage_format}_load",
+            lambda: NetworkXStorage(namespace="bench_graph", global_config=graph_config),
+            nodes=graph._graph.number_of_nodes(),
+        )
+
+    node_ids = list(graph._graph.nodes())
+    nodes = await graph.get_nodes_batch(node_ids)
+    entities = {
+        compute_mdhash_id(k, prefix="ent-"): {
+            "content": k + (v or {}).get("description", ""),
+            "entity_name": k,
+        }
+        for k, v in zip(node_ids, nodes)
+    }
+    for name, cls in [("nanovectordb", NanoVectorDBStorage), ("hnswlib", HNSWVectorStorage)]:
+        vdb = cls(
+            namespace=f"bench_{name}",
+            global_config=config,
+            embedding_func=rag.embedding_func,
+            meta_fields={"entity_name"},
+        )
+        await rec.time(size, f"vdb_{name}_upsert", lambda: vdb.upsert(entities), items=len(entities))
+        await rec.time(size, f"vdb_{name}_flush", vdb.index_done_callback, items=len(entities))
+        await rec.time(
+            size,
+            f"vdb_{name}_load",
+            lambda: cls(
+                namespace=f"bench_{name}",
+                global_config=config,
+                embedding_func=rag.embedding_func,
+                meta_fields={"entity_name"},
+            ),
+            items=len(entities),
+        )
+
+
+async def bench_size(rec: Recorder, size: int, args):
+    print(f"size {size}", file=sys.stderr)
+    with tempfile.TemporaryDirectory() as working_dir:
+        rag = GraphRAG(
+            working_dir=working_dir,
+            llm_provider="fake",
+            llm_provider_kwargs={"latency": args.llm_latency},
+            enable_naive_rag=True,
+            enable_llm_cache=False,
+        )
+        config = asdict(rag)
+        docs = synthetic_corpus(size, args.seed)
+        new_docs = {compute_mdhash_id(d, prefix="doc-"): {"content": d} for d in docs}
+
+        chunks = await rec.time(
+            size,
+            "get_chunks",
+            lambda: get_chunks(
+                new_docs,
+                chunk_func=rag.chunk_func,
+                overlap_token_size=rag.chunk_overlap_token_size,
+                max_token_size=rag.chunk_token_size,
+            ),
+            docs=len(docs),
+        )
+        await rag.text_chunks.upsert(chunks)
+        await rag.chunks_vdb.upsert(chunks)
+        graph = rag.chunk_entity_relation_graph
+        await rec.time(
+            size,
+            "extract_entities",
+            lambda: extract_entities(
+                chunks,
+                knwoledge_graph_inst=graph,
+                entity_vdb=rag.entities_vdb,
+                global_config=config,
+            ),
+            chunks=len(chunks),
+        )
+        await rec.time(
+            size,
+            "clustering",
+            lambda: graph.clustering(rag.graph_cluster_algorithm),
+            nodes=graph._graph.number_of_nodes(),
+            edges=graph._graph.number_of_edges(),
+        )
+        schema = await rec.time(size, "community_schema", graph.community_schema)
+        await rec.time(
+            size,
+            "generate_community_report",
+            lambda: generate_community_report(
+                rag.community_reports,
+                graph,
+                config,
+                community_index_kv=rag.community_index,
+            ),
+            communities=len(schema),
+        )
+        await rag._insert_done()
+
+        names = sorted(set(w for w in docs[0].split() if w.istitle()))
+        queries = [f"What happened between {n} and the others?" for n in names[: args.queries]]
+        for mode in ["local", "global", "naive"]:
+            param = QueryParam(mode=mode, only_need_context=True)
+
+            async def _run_queries():
+                for q in queries:
+                    await rag.aquery(q, param)
+
+            await rec.time(size, f"{mode}_query_context", _run_queries, queries=len(queries))
+
+        await bench_storages(rec, size, rag)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+async def main(args):
+    # graspologic takes seconds to import, keep that out of the clustering stage
+    import graspologic.partition  # noqa: F401
+
+    rec = Recorder()
+    for size in [int(s) for s in args.sizes.split(",")]:
+        await bench_size(rec, size, args)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": rec.records,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="20,100", help="comma-separated document counts")
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    asyncio.run(main(parser.parse_args()))
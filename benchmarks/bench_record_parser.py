@@ -0,0 +1,229 @@
+"""Fuzz and time the extraction record parser against the parsing it replaced.
+
+    python benchmarks/bench_record_parser.py --responses 200 --fuzz 2000
+    python benchmarks/bench_record_parser.py --cache-file ./dickens/kv_store_llm_response_cache.json
+
+Responses come from an LLM response cache if given (entries that look like
+extraction output), otherwise from the offline "fake" provider over a
+synthetic corpus. Every response, and `--fuzz` randomly damaged copies of
+them, must parse to the same records with the old split/search/await path,
+`ExtractionRecordParser.parse` and `ExtractionRecordParser.feed` in random
+pieces; the script exits non-zero otherwise.
+"""
+import argparse
+import asyncio
+import html
+import json
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from typing import Any
+
+from nano_graphrag._llm import _fake_extraction
+from nano_graphrag._op import ExtractionRecordParser
+from nano_graphrag.prompt import PROMPTS
+
+TUPLE = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+RECORD = PROMPTS["DEFAULT_RECORD_DELIMITER"]
+COMPLETE = PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+
+
+# The baseline helpers and record handlers, copied verbatim so the reference
+# does not share any code with the parser under test.
+def is_float_regex(value):
+    return bool(re.match(r"^[-+]?[0-9]*\.?[0-9]+$", value))
+
+
+def split_string_by_multi_markers(content: str, markers: list[str]) -> list[str]:
+    """Split a string by multiple markers"""
+    if not markers:
+        return [content]
+    results = re.split("|".join(re.escape(marker) for marker in markers), content)
+    return [r.strip() for r in results if r.strip()]
+
+
+def clean_str(input: Any) -> str:
+    """Clean an input string by removing HTML escapes, control characters, and other unwanted characters."""
+    if not isinstance(input, str):
+        return input
+
+    result = html.unescape(input.strip())
+    return re.sub(r"[\x00-\x1f\x7f-\x9f]", "", result)
+
+
+async def _handle_single_entity_extraction(
+    record_attributes: list[str],
+    chunk_key: str,
+):
+    if len(record_attributes) < 4 or record_attributes[0] != '"entity"':
+        return None
+    entity_name = clean_str(record_attributes[1].upper())
+    if not entity_name.strip():
+        return None
+    entity_type = clean_str(record_attributes[2].upper())
+    entity_description = clean_str(record_attributes[3])
+    entity_source_id = chunk_key
+    return dict(
+        entity_name=entity_name,
+        entity_type=entity_type,
+        description=entity_description,
+        source_id=entity_source_id,
+    )
+
+
+async def _handle_single_relationship_extraction(
+    record_attributes: list[str],
+    chunk_key: str,
+):
+    if len(record_attributes) < 5 or record_attributes[0] != '"relationship"':
+        return None
+    source = clean_str(record_attributes[1].upper())
+    target = clean_str(record_attributes[2].upper())
+    edge_description = clean_str(record_attributes[3])
+    edge_source_id = chunk_key
+    weight = (
+        float(record_attributes[-1]) if is_float_regex(record_attributes[-1]) else 1.0
+    )
+    return dict(
+        src_id=source,
+        tgt_id=target,
+        weight=weight,
+        description=edge_description,
+        source_id=edge_source_id,
+    )
+
+
+async def legacy_parse(final_result: str, chunk_key: str):
+    """The parsing `_process_single_content` did before the compiled parser"""
+    records = split_string_by_multi_markers(final_result, [RECORD, COMPLETE])
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    for record in records:
+        record = re.search(r"\((.*)\)", record)
+        if record is None:
+            continue
+        record = record.group(1)
+        record_attributes = split_string_by_multi_markers(record, [TUPLE])
+        if_entities = await _handle_single_entity_extraction(record_attributes, chunk_key)
+        if if_entities is not None:
+            maybe_nodes[if_entities["entity_name"]].append(if_entities)
+            continue
+        if_relation = await _handle_single_relationship_extraction(
+            record_attributes, chunk_key
+        )
+        if if_relation is not None:
+            maybe_edges[(if_relation["src_id"], if_relation["tgt_id"])].append(if_relation)
+    return maybe_nodes, maybe_edges
+
+
+def stream_parse(text: str, chunk_key: str, rng: random.Random):
+    parser = ExtractionRecordParser()
+    records = []
+    i = 0
+    while i < len(text):
+        step = rng.randint(1, 24)
+        records.extend(parser.feed(text[i : i + step], chunk_key))
+        i += step
+    records.extend(parser.close(chunk_key))
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    for kind, dp in records:
+        if kind == "entity":
+            maybe_nodes[dp["entity_name"]].append(dp)
+        else:
+            maybe_edges[(dp["src_id"], dp["tgt_id"])].append(dp)
+    return maybe_nodes, maybe_edges
+
+
+def load_responses(args) -> list[str]:
+    if args.cache_file:
+        with open(args.cache_file, encoding="utf-8") as f:
+            cache = json.load(f)
+        responses = [
+            v["return"]
+            for v in cache.values()
+            if isinstance(v.get("return"), str) and TUPLE in v["return"]
+        ]
+        if responses:
+            return responses[: args.responses]
+        print("no extraction responses in the cache file, using fake ones", file=sys.stderr)
+    rng = random.Random(args.seed)
+    names = ["Alex", "Taylor Jordan", "Cruz", "The Device", "Verdantis", "Central Institution"]
+    responses = []
+    for _ in range(args.responses):
+        text = " ".join(
+            f"{rng.choice(names)} met {rng.choice(names)} near {rng.choice(names)}."
+            for _ in range(rng.randint(5, 60))
+        )
+        responses.append(_fake_extraction(f"-Real Data-\nText: {text}\nOutput:"))
+    return responses
+
+
+def damage(text: str, rng: random.Random) -> str:
+    pieces = [TUPLE, RECORD, COMPLETE, "(", ")", '"', "\n", "#", "<|", "|>", " ", "é", "\x07"]
+    text = list(text)
+    for _ in range(rng.randint(1, 8)):
+        op = rng.random()
+        pos = rng.randint(0, len(text))
+        if op < 0.4:
+            text.insert(pos, rng.choice(pieces))
+        elif op < 0.7 and text:
+            del text[min(pos, len(text) - 1) : pos + rng.randint(1, 6)]
+        elif op < 0.85:
+            text = text[:pos]
+        else:
+            text.insert(pos, "".join(rng.choice(pieces) for _ in range(rng.randint(2, 6))))
+    return "".join(text)
+
+
+def as_plain(parsed) -> tuple:
+    nodes, edges = parsed
+    return dict(nodes), dict(edges)
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    responses = load_responses(args)
+    cases = responses + [damage(rng.choice(responses), rng) for _ in range(args.fuzz)]
+    parser = ExtractionRecordParser()
+
+    mismatches = 0
+    for i, text in enumerate(cases):
+        expected = as_plain(await legacy_parse(text, "chunk"))
+        for name, got in [
+            ("parse", as_plain(parser.parse(text, "chunk"))),
+            ("stream", as_plain(stream_parse(text, "chunk", rng))),
+        ]:
+            if got != expected:
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"{name} differs on case {i}: {text[:200]!r}", file=sys.stderr)
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for text in responses:
+            await legacy_parse(text, "chunk")
+    legacy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for text in responses:
+            parser.parse(text, "chunk")
+    compiled_seconds = time.perf_counter() - start
+
+    records = sum(len(parser._record_splitter.split(t)) for t in responses)
+    print(f"{len(responses)} responses (~{records} records), {args.fuzz} fuzzed, {mismatches} mismatches")
+    print(f"  legacy   {legacy_seconds * 1000:9.1f} ms")
+    print(f"  compiled {compiled_seconds * 1000:9.1f} ms ({legacy_seconds / compiled_seconds:.2f}x)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-file", default=None, help="an llm_response_cache JSON file")
+    parser.add_argument("--responses", type=int, default=200)
+    parser.add_argument("--fuzz", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,51 @@
+"""Convert a NetworkXStorage graph between GraphML and the binary snapshot.
+
+    python convert_graph_snapshot.py to-binary cache/graph_chunk_entity_relation.graphml
+    python convert_graph_snapshot.py to-graphml cache/graph_chunk_entity_relation.snapshot.pkl
+
+The target defaults to the same path with the other extension, which is where
+NetworkXStorage looks for it when addon_params["networkx_storage_format"] is
+"binary" or "both".
+"""
+import argparse
+
+from nano_graphrag._storage import NetworkXStorage
+
+GRAPHML_SUFFIX = ".graphml"
+SNAPSHOT_SUFFIX = ".snapshot.pkl"
+
+
+def default_target(source: str, direction: str) -> str:
+    if direction == "to-binary" and source.endswith(GRAPHML_SUFFIX):
+        return source[: -len(GRAPHML_SUFFIX)] + SNAPSHOT_SUFFIX
+    if direction == "to-graphml" and source.endswith(SNAPSHOT_SUFFIX):
+        return source[: -len(SNAPSHOT_SUFFIX)] + GRAPHML_SUFFIX
+    raise SystemExit(f"Can not derive a target path from {source}, please pass one")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert between GraphML and the binary graph snapshot"
+    )
+    parser.add_argument("direction", choices=["to-binary", "to-graphml"])
+    parser.add_argument("source")
+    parser.add_argument("target", nargs="?")
+    args = parser.parse_args()
+    target = args.target or default_target(args.source, args.direction)
+
+    if args.direction == "to-binary":
+        graph = NetworkXStorage.load_nx_graph(args.source)
+    else:
+        graph = NetworkXStorage.load_nx_snapshot(args.source)
+    if graph is None:
+        raise SystemExit(f"Can not load a graph from {args.source}")
+
+    if args.direction == "to-binary":
+        NetworkXStorage.write_nx_snapshot(graph, target)
+    else:
+        NetworkXStorage.write_nx_graph(graph, target)
+    print(f"Wrote {target}")
+
+
+if __name__ == "__main__":
+    main()
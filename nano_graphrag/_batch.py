@@ -0,0 +1,272 @@
+"""Offline indexing through a provider batch API.
+
+Inside `collect_batch_requests`, a model function that misses the LLM cache
+on a call of one of the collected `llm_priority` classes doesn't call the
+model: `defer_to_batch` records the request, keyed on its cache key, and
+raises `BatchPending`. The caller drops the unfinished work and the requests
+are written to a JSONL file in the OpenAI batch format, submitted to a
+`BaseBatchBackend` and polled until the results come back. Once they are in
+the LLM cache, running the same work again gets past the calls that were
+pending, up to the next ones that depend on their answers (a gleaning round,
+the reports of the next community level).
+
+The submitted batch is recorded in `batch_state.json` in the working
+directory, so a process that dies while waiting picks up the same batch on
+the next run instead of paying for it twice.
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from ._utils import (
+    _llm_priority,
+    compute_args_hash,
+    load_json,
+    logger,
+    skip_call_tokens,
+    write_json,
+)
+
+BATCH_REQUESTS_FILE = "batch_requests.jsonl"
+BATCH_RESULTS_FILE = "batch_results.jsonl"
+BATCH_STATE_FILE = "batch_state.json"
+
+
+class BatchPending(Exception):
+    """The model call was added to the batch being collected"""
+
+
+@dataclass
+class BatchCollector:
+    priority_classes: tuple[str, ...] = ("extraction", "community_report")
+    # cache key -> request line
+    requests: dict[str, dict] = field(default_factory=dict)
+
+    def add(self, custom_id: str, model: str, messages: list[dict], **kwargs):
+        self.requests[custom_id] = {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": model, "messages": messages, **kwargs},
+        }
+
+
+_current_collector: ContextVar[Optional[BatchCollector]] = ContextVar(
+    "_current_collector", default=None
+)
+
+
+@contextmanager
+def collect_batch_requests(priority_classes: tuple[str, ...] = None):
+    """Collect the uncached calls of `priority_classes` made inside the block
+    instead of making them
+    """
+    collector = BatchCollector()
+    if priority_classes is not None:
+        collector.priority_classes = tuple(priority_classes)
+    token = _current_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _current_collector.reset(token)
+
+
+def defer_to_batch(custom_id: str, model: str, messages: list[dict], **kwargs):
+    """Called by a model function after a cache miss on `custom_id` (its cache
+    key): raises `BatchPending` if the call is to be collected for a batch.
+    """
+    collector = _current_collector.get()
+    if collector is None or _llm_priority.get()[0] not in collector.priority_classes:
+        return
+    collector.add(custom_id, model, messages, **kwargs)
+    skip_call_tokens()
+    raise BatchPending(custom_id)
+
+
+@dataclass
+class BaseBatchBackend:
+    poll_interval: float = 60.0
+
+    async def submit(self, requests_path: str) -> str:
+        """Submit the JSONL request file, return the batch id"""
+        raise NotImplementedError
+
+    async def poll(self, batch_id: str, results_path: str) -> bool:
+        """Write the JSONL results to `results_path` and return True once the
+        batch is done, return False while it is still running
+        """
+        raise NotImplementedError
+
+
+@dataclass
+class OpenAIBatchBackend(BaseBatchBackend):
+    completion_window: str = "24h"
+
+    async def submit(self, requests_path: str) -> str:
+        from ._llm import get_openai_async_client_instance
+
+        client = get_openai_async_client_instance()
+        with open(requests_path, "rb") as f:
+            input_file = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str, results_path: str) -> bool:
+        from ._llm import get_openai_async_client_instance
+
+        client = get_openai_async_client_instance()
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} {batch.status}: {batch.errors}")
+        if batch.status != "completed":
+            return False
+        contents = []
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id:
+                contents.append((await client.files.content(file_id)).text.strip())
+        with open(results_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(c for c in contents if c) + "\n")
+        return True
+
+
+@dataclass
+class LocalBatchBackend(BaseBatchBackend):
+    """Stand-in for a provider batch API that answers the request file with
+    `complete_func` (a `*_complete` function) when polled. The batch id is the
+    request file path. Results are written in the OpenAI batch output format.
+    """
+
+    complete_func: Callable = None
+    max_async: int = 16
+    poll_interval: float = 0.0
+
+    async def submit(self, requests_path: str) -> str:
+        return requests_path
+
+    async def poll(self, batch_id: str, results_path: str) -> bool:
+        with open(batch_id, encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        semaphore = asyncio.Semaphore(self.max_async)
+
+        async def _answer(request: dict) -> dict:
+            body = dict(request["body"])
+            body.pop("model")
+            messages = body.pop("messages")
+            system_prompt = None
+            if messages[0]["role"] == "system":
+                system_prompt = messages[0]["content"]
+                messages = messages[1:]
+            async with semaphore:
+                try:
+                    content = await self.complete_func(
+                        messages[-1]["content"],
+                        system_prompt=system_prompt,
+                        history_messages=messages[:-1],
+                        **body,
+                    )
+                except Exception as e:
+                    return {
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"message": repr(e)},
+                    }
+            return {
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {
+                        "choices": [
+                            {"message": {"role": "assistant", "content": content}}
+                        ]
+                    },
+                },
+                "error": None,
+            }
+
+        results = await asyncio.gather(*[_answer(r) for r in requests])
+        with open(results_path, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        return True
+
+
+def _read_batch_results(results_path: str) -> dict[str, str]:
+    responses = {}
+    failed = 0
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                failed += 1
+                logger.warning(
+                    f"Batch request {result.get('custom_id')} failed: "
+                    f"{result.get('error') or response.get('body')}"
+                )
+                continue
+            responses[result["custom_id"]] = response["body"]["choices"][0][
+                "message"
+            ]["content"]
+    if failed:
+        logger.warning(f"{failed} batch requests failed, they will be collected again")
+    return responses
+
+
+async def run_batch(
+    backend: BaseBatchBackend, requests: list[dict], working_dir: str
+) -> dict[str, str]:
+    """Submit `requests` (or resume the same batch submitted by an earlier run)
+    and wait for it. Returns custom id -> response content of the successful
+    requests; call `clear_batch_state` once they are stored.
+    """
+    requests = sorted(requests, key=lambda r: r["custom_id"])
+    requests_hash = compute_args_hash([r["custom_id"] for r in requests])
+    requests_path = os.path.join(working_dir, BATCH_REQUESTS_FILE)
+    results_path = os.path.join(working_dir, BATCH_RESULTS_FILE)
+    state_path = os.path.join(working_dir, BATCH_STATE_FILE)
+
+    state = load_json(state_path)
+    if state is not None and state["requests_hash"] == requests_hash:
+        logger.info(f"Resuming batch {state['batch_id']} ({state['status']})")
+    else:
+        if state is not None:
+            logger.warning(
+                f"Ignoring batch {state['batch_id']}, it was submitted for other requests"
+            )
+        with open(requests_path, "w", encoding="utf-8") as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        state = {
+            "batch_id": await backend.submit(requests_path),
+            "requests_hash": requests_hash,
+            "requests": len(requests),
+            "submitted_at": time.time(),
+            "status": "submitted",
+        }
+        write_json(state, state_path)
+        logger.info(f"Submitted batch {state['batch_id']} of {len(requests)} requests")
+
+    if state["status"] != "completed" or not os.path.exists(results_path):
+        while not await backend.poll(state["batch_id"], results_path):
+            await asyncio.sleep(backend.poll_interval)
+        state["status"] = "completed"
+        write_json(state, state_path)
+    return _read_batch_results(results_path)
+
+
+def clear_batch_state(working_dir: str):
+    for name in [BATCH_STATE_FILE, BATCH_REQUESTS_FILE, BATCH_RESULTS_FILE]:
+        path = os.path.join(working_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,98 @@
+"""Progress of the running insert, so an interrupted one can be finished.
+
+An insert goes through the stages
+
+    extracting -> merged -> clustered -> reporting -> (file removed)
+
+and `IngestCheckpoint` keeps the current one in `ingest_checkpoint.json` in
+the working directory. Each stage is recorded only after the storages it
+produced are persisted:
+
+- extracting: chunk extractions are saved one by one in the extraction cache
+  (and the LLM cache), a rerun of the same documents re-extracts nothing;
+- merged: the graph, vector DBs, docs and chunks are on disk, a rerun finds
+  the documents inserted and only clusters and reports (streamed inserts
+  reach it after every window, and later windows remember it);
+- clustered: the clustering is on disk, a rerun goes straight to reports;
+- reporting: the reports of `report_levels_done` are on disk, a rerun keeps
+  them as long as their communities are unchanged.
+"""
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from ._utils import compute_args_hash, load_json, logger, write_json
+
+INGEST_STAGES = ["extracting", "merged", "clustered", "reporting"]
+
+
+@dataclass
+class IngestCheckpoint:
+    file_name: str
+
+    def __post_init__(self):
+        self.state: Optional[dict] = load_json(self.file_name)
+        if self.state is not None:
+            logger.info(
+                f"Found an interrupted insert of {self.state['chunks']} chunks at stage "
+                f"{self.state['stage']}"
+            )
+
+    @property
+    def stage(self) -> Optional[str]:
+        return None if self.state is None else self.state["stage"]
+
+    def reached(self, stage: str) -> bool:
+        """Whether the interrupted or running insert got past `stage`"""
+        return self.stage is not None and INGEST_STAGES.index(
+            self.stage
+        ) >= INGEST_STAGES.index(stage)
+
+    @property
+    def reports_pending(self) -> bool:
+        """Whether merged documents are still waiting for community reports"""
+        return self.reached("merged") or (
+            self.state is not None and self.state.get("earlier_merged", False)
+        )
+
+    def start(self, chunk_keys: list[str]):
+        insert_id = compute_args_hash(sorted(chunk_keys))
+        if self.state is not None and self.state["insert_id"] == insert_id:
+            logger.info("[Resume] extracting the chunks of the interrupted insert again")
+        self.state = {
+            "insert_id": insert_id,
+            "chunks": len(chunk_keys),
+            "stage": "extracting",
+            # an unfinished insert (or streamed window) merged before this one
+            "earlier_merged": self.reports_pending,
+            "report_levels_done": [],
+            "started_at": time.time(),
+        }
+        self._save()
+
+    def advance(self, stage: str):
+        """Record that the insert is at `stage`, its earlier output persisted"""
+        if self.state is None:
+            self.state = {
+                "insert_id": None,
+                "chunks": 0,
+                "earlier_merged": False,
+                "report_levels_done": [],
+                "started_at": time.time(),
+            }
+        self.state["stage"] = stage
+        self._save()
+
+    def report_level_done(self, level: int):
+        self.state["report_levels_done"].append(level)
+        self._save()
+
+    def finish(self):
+        self.state = None
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+    def _save(self):
+        self.state["updated_at"] = time.time()
+        write_json(self.state, self.file_name)
@@ -0,0 +1,155 @@
+"""Per-chunk gleaning decisions learned from the corpus.
+
+The fixed schedule runs `entity_extract_max_gleaning` continuation calls plus
+an "anything missed?" call between them for every chunk. `AdaptiveGleaning`
+replaces the yes/no call with an estimate: round r of a chunk is run when
+
+    ratio[r] * max(records found so far, density * chunk tokens)
+
+reaches `min_expected_records`, where `density` is the average number of
+records the first pass finds per chunk token and `ratio[r]` the average share
+of new records round r added on top of the earlier ones. A sample of chunks
+(the first `warmup_chunks`, then `sample_rate` of them, picked by chunk id)
+runs every round; only those train `ratio`, and comparing them with what the
+policy would have done gives the records the policy loses.
+"""
+from dataclasses import dataclass
+
+from ._utils import logger
+from .base import BaseKVStorage
+
+
+@dataclass
+class AdaptiveGleaning:
+    storage: BaseKVStorage = None
+    max_rounds: int = 2
+    min_expected_records: float = 1.0
+    sample_rate: float = 0.1
+    warmup_chunks: int = 8
+    smoothing: float = 0.1
+
+    def __post_init__(self):
+        self._version = None
+        self._state = None
+        self._dirty = False
+        self._decisions = 0
+        # totals since the policy was created, a batch insert loads it every round
+        self.stats = {
+            "chunks": 0,
+            "sampled_chunks": 0,
+            "gleaning_calls": 0,
+            "fixed_schedule_calls": 0,
+            "sampled_entities": 0,
+            "sampled_relations": 0,
+            "sampled_entities_lost": 0,
+            "sampled_relations_lost": 0,
+        }
+
+    @staticmethod
+    def _empty_state() -> dict:
+        return {"density": 0.0, "density_samples": 0, "ratios": [], "ratios_samples": []}
+
+    async def load(self, version: str):
+        """Start an extraction run with the curve learned for this prompt version"""
+        self._decisions = 0
+        if self._version == version:
+            self._learned_before = min(self._state["ratios_samples"], default=0)
+            return
+        self._version = version
+        self._state = None
+        if self.storage is not None:
+            self._state = await self.storage.get_by_id(version)
+        if self._state is None:
+            self._state = self._empty_state()
+        missing_rounds = self.max_rounds - len(self._state["ratios"])
+        self._state["ratios"].extend([None] * missing_rounds)
+        self._state["ratios_samples"].extend([0] * missing_rounds)
+        self._learned_before = min(self._state["ratios_samples"], default=0)
+
+    def _update(self, key: str, index: int, value: float):
+        samples_key = f"{key}_samples"
+        if index is None:
+            n = self._state[samples_key] = self._state[samples_key] + 1
+            old = self._state[key]
+        else:
+            n = self._state[samples_key][index] = self._state[samples_key][index] + 1
+            old = self._state[key][index] or 0.0
+        alpha = max(1 / n, self.smoothing)
+        new = old + alpha * (value - old)
+        if index is None:
+            self._state[key] = new
+        else:
+            self._state[key][index] = new
+        self._dirty = True
+
+    def should_sample(self, chunk_key: str) -> bool:
+        self._decisions += 1
+        if self._decisions + self._learned_before <= self.warmup_chunks:
+            return True
+        return int(chunk_key[-8:], 16) % 10000 < self.sample_rate * 10000
+
+    def should_glean(self, round_index: int, chunk_tokens: int, records: int) -> bool:
+        ratio = self._state["ratios"][round_index]
+        if ratio is None:
+            return True
+        expected_base = max(records, self._state["density"] * chunk_tokens)
+        return ratio * expected_base >= self.min_expected_records
+
+    def _policy_rounds(self, chunk_tokens: int, first_records: int, gains: list[int]) -> int:
+        """Rounds the policy would have run, given what every round found"""
+        records = first_records
+        for round_index, gain in enumerate(gains):
+            if not self.should_glean(round_index, chunk_tokens, records) or (
+                round_index and not gains[round_index - 1]
+            ):
+                return round_index
+            records += gain
+        return len(gains)
+
+    def observe(
+        self,
+        chunk_tokens: int,
+        first_records: int,
+        gains: list[tuple[int, int]],
+        sampled: bool,
+        fixed_schedule_calls: int,
+    ):
+        """Record one chunk: records of the first pass, (new entities, new
+        relations) of every gleaning round that ran, and whether it was sampled
+        """
+        self.stats["chunks"] += 1
+        self.stats["gleaning_calls"] += len(gains)
+        self.stats["fixed_schedule_calls"] += fixed_schedule_calls
+        if chunk_tokens:
+            self._update("density", None, first_records / chunk_tokens)
+        if not sampled:
+            return
+        totals = [e + r for e, r in gains]
+        policy_rounds = self._policy_rounds(chunk_tokens, first_records, totals)
+        self.stats["sampled_chunks"] += 1
+        self.stats["sampled_entities"] += sum(e for e, _ in gains)
+        self.stats["sampled_relations"] += sum(r for _, r in gains)
+        self.stats["sampled_entities_lost"] += sum(e for e, _ in gains[policy_rounds:])
+        self.stats["sampled_relations_lost"] += sum(r for _, r in gains[policy_rounds:])
+        records = first_records
+        for round_index, gain in enumerate(totals):
+            self._update("ratios", round_index, gain / max(records, 1))
+            records += gain
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"Adaptive gleaning: {s['gleaning_calls']} gleaning calls for {s['chunks']} chunks "
+            f"(fixed schedule: up to {s['fixed_schedule_calls']}); on {s['sampled_chunks']} sampled "
+            f"chunks it would have lost {s['sampled_entities_lost']}/{s['sampled_entities']} "
+            f"entities and {s['sampled_relations_lost']}/{s['sampled_relations']} relations "
+            f"found by gleaning"
+        )
+
+    async def index_done_callback(self):
+        if not self._dirty or self.storage is None:
+            return
+        await self.storage.upsert({self._version: self._state})
+        await self.storage.index_done_callback()
+        self._dirty = False
+        logger.debug(f"Saved gleaning yield curve {self._state['ratios']}")
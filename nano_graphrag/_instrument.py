@@ -0,0 +1,157 @@
+"""Per-run timing and token accounting.
+
+`track_run` installs a `RunStats` in a context variable for the duration of an
+insert or query. `span` and the `record_*` helpers add to the run active in the
+current task and do nothing outside of one, so library code can be
+instrumented unconditionally. Tasks started with `asyncio.gather` inherit the
+run, which means concurrent spans of the same name add up their wall times.
+"""
+import json
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+from typing import Callable, Optional
+
+from ._utils import (
+    count_embedding_call_tokens,
+    count_llm_call_tokens,
+    logger,
+    skip_call_tokens,
+)
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    seconds: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+@dataclass
+class RunStats:
+    kind: str
+    started_at: float = field(default_factory=time.time)
+    wall_time: float = 0.0
+    spans: dict[str, SpanStats] = field(default_factory=dict)
+    llm_calls: int = 0
+    llm_cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedding_calls: int = 0
+    embedding_texts: int = 0
+    embedding_tokens: int = 0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return self.llm_cache_hits / self.llm_calls if self.llm_calls else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "cache_hit_ratio": self.cache_hit_ratio}
+
+
+_current_run: ContextVar[Optional[RunStats]] = ContextVar("_current_run", default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar("_current_span", default=None)
+
+
+def current_run() -> Optional[RunStats]:
+    return _current_run.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time the block as `name`; LLM calls made inside are attributed to it"""
+    stats = _current_run.get()
+    if stats is None:
+        yield
+        return
+    token = _current_span.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        span_stats = stats.spans.setdefault(name, SpanStats())
+        span_stats.count += 1
+        span_stats.seconds += time.perf_counter() - start
+
+
+def record_llm_call(prompt_tokens: int, completion_tokens: int):
+    stats = _current_run.get()
+    if stats is None:
+        return
+    stats.llm_calls += 1
+    stats.prompt_tokens += prompt_tokens
+    stats.completion_tokens += completion_tokens
+    span_name = _current_span.get()
+    if span_name is not None:
+        span_stats = stats.spans.setdefault(span_name, SpanStats())
+        span_stats.llm_calls += 1
+        span_stats.prompt_tokens += prompt_tokens
+        span_stats.completion_tokens += completion_tokens
+
+
+def record_llm_cache_hit():
+    skip_call_tokens()
+    stats = _current_run.get()
+    if stats is not None:
+        stats.llm_cache_hits += 1
+
+
+def instrument_model_func(func: Callable) -> Callable:
+    """Count calls and prompt/completion tokens of a `*_complete` func"""
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        response = await func(*args, **kwargs)
+        if _current_run.get() is not None:
+            record_llm_call(
+                count_llm_call_tokens(*args, **kwargs),
+                count_llm_call_tokens(response) if isinstance(response, str) else 0,
+            )
+        return response
+
+    return wrapper
+
+
+def instrument_embedding_func(func: Callable) -> Callable:
+    @wraps(func)
+    async def wrapper(texts, *args, **kwargs):
+        stats = _current_run.get()
+        if stats is not None:
+            stats.embedding_calls += 1
+            stats.embedding_texts += len(texts)
+            stats.embedding_tokens += count_embedding_call_tokens(texts)
+        return await func(texts, *args, **kwargs)
+
+    return wrapper
+
+
+@asynccontextmanager
+async def track_run(
+    kind: str,
+    callbacks: list[Callable[[RunStats], None]] = [],
+    jsonl_path: Optional[str] = None,
+):
+    """Collect the stats of one insert or query, then hand them to `callbacks`
+    and append them to `jsonl_path` if given.
+    """
+    stats = RunStats(kind=kind)
+    token = _current_run.set(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall_time = time.perf_counter() - start
+        _current_run.reset(token)
+        for callback in callbacks:
+            try:
+                callback(stats)
+            except Exception as e:
+                logger.warning(f"Stats callback failed: {e!r}")
+        if jsonl_path is not None:
+            with open(jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(stats.to_dict(), ensure_ascii=False) + "\n")
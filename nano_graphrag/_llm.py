@@ -1,8 +1,12 @@
+import asyncio
 import json
+import re
 import numpy as np
+from dataclasses import dataclass
 from typing import Optional, List, Any, Callable
 
 import aioboto3
+from botocore.config import Config
 from openai import AsyncOpenAI, AsyncAzureOpenAI, APIConnectionError, RateLimitError
 
 from tenacity import (
@@ -13,12 +17,24 @@ from tenacity import (
 )
 import os
 
-from ._utils import compute_args_hash, wrap_embedding_func_with_attrs
+from ._batch import defer_to_batch
+from ._instrument import record_llm_cache_hit
+from ._utils import (
+    EmbeddingFunc,
+    compute_args_hash,
+    reserve_call_tokens,
+    wrap_embedding_func_with_attrs,
+)
 from .base import BaseKVStorage
+from .prompt import PROMPTS
 
 global_openai_async_client = None
 global_azure_openai_async_client = None
 global_amazon_bedrock_async_client = None
+# (event loop, region) -> task opening a long-lived bedrock-runtime client
+global_amazon_bedrock_runtime_clients = {}
+# concurrent HTTP connections of each pooled bedrock-runtime client
+BEDROCK_MAX_POOL_CONNECTIONS = 64
 
 
 def get_openai_async_client_instance():
@@ -52,6 +68,75 @@ def get_amazon_bedrock_async_client_instance():
     return global_amazon_bedrock_async_client
 
 
+async def _open_amazon_bedrock_runtime_client(region_name: str):
+    client_context = get_amazon_bedrock_async_client_instance().client(
+        "bedrock-runtime",
+        region_name=region_name,
+        config=Config(max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS),
+    )
+    return await client_context.__aenter__(), client_context
+
+
+async def get_amazon_bedrock_runtime_client(region_name: Optional[str] = None):
+    """Return the bedrock-runtime client shared by the running event loop.
+    It is opened on first use and kept until `close_async_clients`, so calls
+    don't pay for client creation, credential resolution and TLS each time.
+    """
+    region_name = region_name or os.getenv("AWS_REGION", "us-east-1")
+    loop = asyncio.get_running_loop()
+    for key in [k for k in global_amazon_bedrock_runtime_clients if k[0].is_closed()]:
+        global_amazon_bedrock_runtime_clients.pop(key)
+    key = (loop, region_name)
+    opening = global_amazon_bedrock_runtime_clients.get(key)
+    if opening is None:
+        opening = loop.create_task(_open_amazon_bedrock_runtime_client(region_name))
+        global_amazon_bedrock_runtime_clients[key] = opening
+    try:
+        client, _ = await asyncio.shield(opening)
+    except Exception:
+        if global_amazon_bedrock_runtime_clients.get(key) is opening:
+            global_amazon_bedrock_runtime_clients.pop(key)
+        raise
+    return client
+
+
+async def close_async_clients():
+    """Close the long-lived LLM clients opened from the running event loop"""
+    global global_openai_async_client, global_azure_openai_async_client
+    loop = asyncio.get_running_loop()
+    for key in [k for k in global_amazon_bedrock_runtime_clients if k[0] is loop]:
+        opening = global_amazon_bedrock_runtime_clients.pop(key)
+        if opening.done() and opening.exception() is None:
+            _, client_context = opening.result()
+            await client_context.__aexit__(None, None, None)
+        else:
+            opening.cancel()
+    for client in [global_openai_async_client, global_azure_openai_async_client]:
+        if client is not None:
+            await client.close()
+    global_openai_async_client = None
+    global_azure_openai_async_client = None
+
+
+async def _stream_chat_completion(
+    client, stream_handler: Callable[[str], None], **kwargs
+) -> str:
+    # every retried attempt streams from the start
+    restart = getattr(stream_handler, "restart", None)
+    if restart is not None:
+        restart()
+    response = await client.chat.completions.create(stream=True, **kwargs)
+    pieces = []
+    async for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            pieces.append(delta)
+            stream_handler(delta)
+    return "".join(pieces)
+
+
 @retry(
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -60,8 +145,15 @@ def get_amazon_bedrock_async_client_instance():
 async def openai_complete_if_cache(
     model, prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
+    """Chat completion through the response cache. With a `stream_handler`
+    callable, an uncached completion is streamed and every content delta is
+    passed to it as it arrives; the full text is still returned and cached.
+    A `restart` attribute of the handler is called before every attempt.
+    Inside `collect_batch_requests`, an uncached call may be deferred to a batch.
+    """
     openai_async_client = get_openai_async_client_instance()
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+    stream_handler: Callable[[str], None] = kwargs.pop("stream_handler", None)
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -71,18 +163,24 @@ async def openai_complete_if_cache(
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
         if if_cache_return is not None:
+            record_llm_cache_hit()
             return if_cache_return["return"]
+        defer_to_batch(args_hash, model, messages, **kwargs)
+    await reserve_call_tokens()
 
-    response = await openai_async_client.chat.completions.create(
-        model=model, messages=messages, **kwargs
-    )
+    if stream_handler is not None:
+        content = await _stream_chat_completion(
+            openai_async_client, stream_handler, model=model, messages=messages, **kwargs
+        )
+    else:
+        response = await openai_async_client.chat.completions.create(
+            model=model, messages=messages, **kwargs
+        )
+        content = response.choices[0].message.content
 
     if hashing_kv is not None:
-        await hashing_kv.upsert(
-            {args_hash: {"return": response.choices[0].message.content, "model": model}}
-        )
-        await hashing_kv.index_done_callback()
-    return response.choices[0].message.content
+        await hashing_kv.upsert({args_hash: {"return": content, "model": model}})
+    return content
 
 
 @retry(
@@ -93,8 +191,9 @@ async def openai_complete_if_cache(
 async def amazon_bedrock_complete_if_cache(
     model, prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
-    amazon_bedrock_async_client = get_amazon_bedrock_async_client_instance()
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+    # not streamed: callers get the full text as the return value
+    kwargs.pop("stream_handler", None)
     messages = []
     messages.extend(history_messages)
     messages.append({"role": "user", "content": [{"text": prompt}]})
@@ -102,32 +201,30 @@ async def amazon_bedrock_complete_if_cache(
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
         if if_cache_return is not None:
+            record_llm_cache_hit()
             return if_cache_return["return"]
+    await reserve_call_tokens()
 
     inference_config = {
         "temperature": 0,
         "maxTokens": 4096 if "max_tokens" not in kwargs else kwargs["max_tokens"],
     }
 
-    async with amazon_bedrock_async_client.client(
-        "bedrock-runtime",
-        region_name=os.getenv("AWS_REGION", "us-east-1")
-    ) as bedrock_runtime:
-        if system_prompt:
-            response = await bedrock_runtime.converse(
-                modelId=model, messages=messages, inferenceConfig=inference_config,
-                system=[{"text": system_prompt}]
-            )
-        else:
-            response = await bedrock_runtime.converse(
-                modelId=model, messages=messages, inferenceConfig=inference_config,
-            )
+    bedrock_runtime = await get_amazon_bedrock_runtime_client()
+    if system_prompt:
+        response = await bedrock_runtime.converse(
+            modelId=model, messages=messages, inferenceConfig=inference_config,
+            system=[{"text": system_prompt}]
+        )
+    else:
+        response = await bedrock_runtime.converse(
+            modelId=model, messages=messages, inferenceConfig=inference_config,
+        )
 
     if hashing_kv is not None:
         await hashing_kv.upsert(
             {args_hash: {"return": response["output"]["message"]["content"][0]["text"], "model": model}}
         )
-        await hashing_kv.index_done_callback()
     return response["output"]["message"]["content"][0]["text"]
 
 
@@ -191,25 +288,23 @@ async def gpt_4o_mini_complete(
     retry=retry_if_exception_type((RateLimitError, APIConnectionError)),
 )
 async def amazon_bedrock_embedding(texts: list[str]) -> np.ndarray:
-    amazon_bedrock_async_client = get_amazon_bedrock_async_client_instance()
+    bedrock_runtime = await get_amazon_bedrock_runtime_client()
 
-    async with amazon_bedrock_async_client.client(
-        "bedrock-runtime",
-        region_name=os.getenv("AWS_REGION", "us-east-1")
-    ) as bedrock_runtime:
-        embeddings = []
-        for text in texts:
-            body = json.dumps(
-                {
-                    "inputText": text,
-                    "dimensions": 1024,
-                }
-            )
-            response = await bedrock_runtime.invoke_model(
-                modelId="amazon.titan-embed-text-v2:0", body=body,
-            )
-            response_body = await response.get("body").read()
-            embeddings.append(json.loads(response_body))
+    # titan embeds one text per request, so fan the batch out concurrently
+    async def _embed(text: str) -> dict:
+        body = json.dumps(
+            {
+                "inputText": text,
+                "dimensions": 1024,
+            }
+        )
+        response = await bedrock_runtime.invoke_model(
+            modelId="amazon.titan-embed-text-v2:0", body=body,
+        )
+        response_body = await response.get("body").read()
+        return json.loads(response_body)
+
+    embeddings = await asyncio.gather(*[_embed(text) for text in texts])
     return np.array([dp["embedding"] for dp in embeddings])
 
 
@@ -237,6 +332,7 @@ async def azure_openai_complete_if_cache(
 ) -> str:
     azure_openai_client = get_azure_openai_async_client_instance()
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+    stream_handler: Callable[[str], None] = kwargs.pop("stream_handler", None)
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -246,23 +342,34 @@ async def azure_openai_complete_if_cache(
         args_hash = compute_args_hash(deployment_name, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
         if if_cache_return is not None:
+            record_llm_cache_hit()
             return if_cache_return["return"]
-
-    response = await azure_openai_client.chat.completions.create(
-        model=deployment_name, messages=messages, **kwargs
-    )
+    await reserve_call_tokens()
+
+    if stream_handler is not None:
+        content = await _stream_chat_completion(
+            azure_openai_client,
+            stream_handler,
+            model=deployment_name,
+            messages=messages,
+            **kwargs,
+        )
+    else:
+        response = await azure_openai_client.chat.completions.create(
+            model=deployment_name, messages=messages, **kwargs
+        )
+        content = response.choices[0].message.content
 
     if hashing_kv is not None:
         await hashing_kv.upsert(
             {
                 args_hash: {
-                    "return": response.choices[0].message.content,
+                    "return": content,
                     "model": deployment_name,
                 }
             }
         )
-        await hashing_kv.index_done_callback()
-    return response.choices[0].message.content
+    return content
 
 
 async def azure_gpt_4o_complete(
@@ -301,3 +408,326 @@ async def azure_openai_embedding(texts: list[str]) -> np.ndarray:
         model="text-embedding-3-small", input=texts, encoding_format="float"
     )
     return np.array([dp.embedding for dp in response.data])
+
+
+# ---------------------------------------------------------------------------
+# Offline providers: a deterministic fake LLM and a hashing embedder, so the
+# whole insert/query pipeline can run (and be load-tested) without an API.
+# ---------------------------------------------------------------------------
+
+_FAKE_PROMPT_KINDS = [
+    "entity_extraction",
+    "entiti_continue_extraction",
+    "entiti_if_loop_extraction",
+    "summarize_entity_descriptions",
+    "summarize_entity_descriptions_batch",
+    "community_report",
+    "global_map_rag_points",
+    "global_reduce_rag_response",
+    "local_rag_response",
+    "naive_rag_response",
+]
+_fake_prompt_markers = None
+
+
+def _stable_hash(*parts) -> int:
+    return int(compute_args_hash(*parts)[:8], 16)
+
+
+def _get_fake_prompt_markers() -> list[tuple[str, str]]:
+    """The longest literal part of each template that no other template has"""
+    global _fake_prompt_markers
+    if _fake_prompt_markers is None:
+        templates = {k: PROMPTS[k] for k in _FAKE_PROMPT_KINDS}
+        _fake_prompt_markers = []
+        for kind, template in templates.items():
+            segments = [
+                seg.replace("{{", "{").replace("}}", "}")
+                for seg in re.split(r"(?<!\{)\{\w+\}(?!\})", template)
+            ]
+            unique = [
+                seg.strip()
+                for seg in segments
+                if seg.strip()
+                and not any(seg.strip() in t for k, t in templates.items() if k != kind)
+            ]
+            _fake_prompt_markers.append((kind, max(unique, key=len)))
+    return _fake_prompt_markers
+
+
+def _fake_prompt_kind(*texts: Optional[str]) -> Optional[str]:
+    for kind, marker in _get_fake_prompt_markers():
+        if any(t and marker in t for t in texts):
+            return kind
+    return None
+
+
+def _fake_entity_names(text: str, limit: int) -> list[str]:
+    names = []
+    for name in re.findall(r"\b[A-Z][A-Za-z]{2,}(?:\s+[A-Z][A-Za-z]{2,})*", text):
+        if name.upper() not in names:
+            names.append(name.upper())
+    return names[:limit]
+
+
+def _fake_extraction(prompt: str) -> str:
+    real_data = prompt.split("-Real Data-")[-1]
+    entity_types = re.search(r"Entity_types:\s*(.*)", real_data)
+    entity_types = (
+        [t.strip() for t in entity_types.group(1).split(",") if t.strip()]
+        if entity_types
+        else PROMPTS["DEFAULT_ENTITY_TYPES"]
+    )
+    text = real_data.split("Text:", 1)[-1].rsplit("Output:", 1)[0]
+    names = _fake_entity_names(text, limit=12)
+    tuple_delimiter = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+    records = []
+    for name in names:
+        entity_type = entity_types[_stable_hash(name) % len(entity_types)].upper()
+        records.append(
+            tuple_delimiter.join(
+                ['("entity"', f'"{name}"', f'"{entity_type}"', f'"{name} is a {entity_type.lower()} mentioned in the text.")']
+            )
+        )
+    for source, target in zip(names, names[1:]):
+        records.append(
+            tuple_delimiter.join(
+                [
+                    '("relationship"',
+                    f'"{source}"',
+                    f'"{target}"',
+                    f'"{source} appears together with {target}."',
+                    f"{1 + _stable_hash(source, target) % 9})",
+                ]
+            )
+        )
+    return (
+        PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+        + PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+    )
+
+
+def _fake_summary(prompt: str) -> str:
+    entity = re.search(r"Entities:\s*(.*)", prompt)
+    descriptions = prompt.split("Description List:", 1)[-1].rsplit("#######", 1)[0]
+    words = descriptions.split()
+    return f"{entity.group(1).strip() if entity else 'The entity'}: {' '.join(words[:80])}"
+
+
+def _fake_summary_batch(prompt: str) -> str:
+    items = prompt.split("-Data-", 1)[-1].rsplit("#######", 1)[0]
+    return json.dumps(
+        {
+            item_id: _fake_summary(body)
+            for item_id, body in re.findall(
+                r"^Item (\d+)\n(.*?)(?=^Item \d+\n|\Z)", items, flags=re.M | re.S
+            )
+        }
+    )
+
+
+def _fake_context_entities(context: str, limit: int) -> list[str]:
+    """Entity names from the id-first csv rows that the context builders emit"""
+    if "-----Entities-----" in context:
+        context = context.split("-----Entities-----", 1)[1].split("-----", 1)[0]
+    names = []
+    for name in re.findall(r'^\d+,\s*"([^"]+)"', context, flags=re.MULTILINE):
+        if name not in names:
+            names.append(name)
+    return names[:limit]
+
+
+def _fake_community_report(prompt: str) -> str:
+    text = prompt.split("# Real Data", 1)[-1]
+    names = _fake_context_entities(text, limit=5)
+    title = " and ".join(names[:2]) or "Unnamed community"
+    rating = float(_stable_hash(text) % 10)
+    return json.dumps(
+        {
+            "title": title,
+            "summary": f"The community around {title} includes {', '.join(names) or 'no named entities'}.",
+            "rating": rating,
+            "rating_explanation": f"A deterministic rating of {rating} for offline runs.",
+            "findings": [
+                {
+                    "summary": f"{name} is part of the community",
+                    "explanation": f"{name} is connected to the other members of {title}.",
+                }
+                for name in names
+            ],
+        }
+    )
+
+
+def _fake_map_points(query: str, system_prompt: str) -> str:
+    score = _stable_hash(query, system_prompt) % 100
+    names = _fake_entity_names(system_prompt.split("---Data tables---")[-1], limit=3)
+    return json.dumps(
+        {
+            "points": [
+                {
+                    "description": f"{name} is relevant to the question: {query}",
+                    "score": max(0, score - 10 * i),
+                }
+                for i, name in enumerate(names or ["The data"])
+            ]
+        }
+    )
+
+
+def create_fake_complete_function(latency: float = 0.0) -> Callable:
+    """Deterministic stand-in for a chat model that recognizes the nano-graphrag
+    prompts and answers each in the expected format: extraction records,
+    summaries, community report JSON, map-stage points and plain answers.
+    `latency` seconds are awaited per uncached call, to mimic a remote model;
+    with a `stream_handler` the answer is handed to it in pieces over that time.
+    """
+
+    async def fake_complete(
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        history_messages: List[Any] = [],
+        **kwargs,
+    ) -> str:
+        hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+        stream_handler: Callable[[str], None] = kwargs.pop("stream_handler", None)
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": prompt})
+        if hashing_kv is not None:
+            args_hash = compute_args_hash("fake", messages)
+            if_cache_return = await hashing_kv.get_by_id(args_hash)
+            if if_cache_return is not None:
+                record_llm_cache_hit()
+                return if_cache_return["return"]
+            defer_to_batch(args_hash, "fake", messages, **kwargs)
+        await reserve_call_tokens()
+
+        if latency and stream_handler is None:
+            await asyncio.sleep(latency)
+        kind = _fake_prompt_kind(prompt, system_prompt)
+        if kind == "entity_extraction":
+            response = _fake_extraction(prompt)
+        elif kind == "entiti_continue_extraction":
+            response = PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+        elif kind == "entiti_if_loop_extraction":
+            response = "no"
+        elif kind == "summarize_entity_descriptions":
+            response = _fake_summary(prompt)
+        elif kind == "summarize_entity_descriptions_batch":
+            response = _fake_summary_batch(prompt)
+        elif kind == "community_report":
+            response = _fake_community_report(prompt)
+        elif kind == "global_map_rag_points":
+            response = _fake_map_points(prompt, system_prompt)
+        else:
+            names = _fake_context_entities(system_prompt or "", limit=5)
+            response = f"Answer to: {prompt}\n\nRelated entities: {', '.join(names) or 'none'}"
+        if stream_handler is not None:
+            pieces = [response[i : i + 16] for i in range(0, len(response), 16)]
+            for piece in pieces:
+                if latency:
+                    await asyncio.sleep(latency / len(pieces))
+                stream_handler(piece)
+
+        if hashing_kv is not None:
+            await hashing_kv.upsert({args_hash: {"return": response, "model": "fake"}})
+        return response
+
+    fake_complete.__name__ = "fake_complete"
+    return fake_complete
+
+
+fake_complete = create_fake_complete_function()
+
+
+def create_hashing_embedding_function(
+    embedding_dim: int = 256, latency: float = 0.0
+) -> EmbeddingFunc:
+    """Bag-of-words embedder using signed feature hashing: deterministic across
+    runs and machines, and texts sharing words end up close to each other.
+    """
+
+    async def hashing_embedding(texts: list[str]) -> np.ndarray:
+        if latency:
+            await asyncio.sleep(latency)
+        embeddings = np.zeros((len(texts), embedding_dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                h = _stable_hash(word)
+                embeddings[i, h % embedding_dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    return EmbeddingFunc(
+        embedding_dim=embedding_dim, max_token_size=8192, func=hashing_embedding
+    )
+
+
+hashing_embedding = create_hashing_embedding_function()
+
+
+# ---------------------------------------------------------------------------
+# Provider registry
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class LLMProvider:
+    best_model_func: Callable
+    cheap_model_func: Callable
+    embedding_func: EmbeddingFunc
+
+
+# name -> factory(global_config, **provider_kwargs) -> LLMProvider
+LLM_PROVIDERS: dict[str, Callable[..., LLMProvider]] = {}
+
+
+def register_llm_provider(name: str, factory: Callable[..., LLMProvider]):
+    LLM_PROVIDERS[name] = factory
+
+
+def get_llm_provider(name: str, global_config: dict, **kwargs) -> LLMProvider:
+    if name not in LLM_PROVIDERS:
+        raise ValueError(
+            f"Unknown llm provider {name}, registered: {sorted(LLM_PROVIDERS)}"
+        )
+    return LLM_PROVIDERS[name](global_config, **kwargs)
+
+
+register_llm_provider(
+    "openai",
+    lambda global_config: LLMProvider(
+        gpt_4o_complete, gpt_4o_mini_complete, openai_embedding
+    ),
+)
+register_llm_provider(
+    "deepseek",
+    lambda global_config: LLMProvider(
+        deepseek_v3_complete, deepseek_v3_complete, openai_embedding
+    ),
+)
+register_llm_provider(
+    "azure",
+    lambda global_config: LLMProvider(
+        azure_gpt_4o_complete, azure_gpt_4o_mini_complete, azure_openai_embedding
+    ),
+)
+register_llm_provider(
+    "bedrock",
+    lambda global_config: LLMProvider(
+        create_amazon_bedrock_complete_function(global_config["best_model_id"]),
+        create_amazon_bedrock_complete_function(global_config["cheap_model_id"]),
+        amazon_bedrock_embedding,
+    ),
+)
+register_llm_provider(
+    "fake",
+    lambda global_config, latency=0.0, embedding_dim=256, embedding_latency=0.0: LLMProvider(
+        create_fake_complete_function(latency),
+        create_fake_complete_function(latency),
+        create_hashing_embedding_function(embedding_dim, embedding_latency),
+    ),
+)
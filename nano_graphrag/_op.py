@@ -1,18 +1,28 @@
 import re
 import json
 import asyncio
+import functools
+import heapq
+import itertools
 import tiktoken
-from typing import Union
+from typing import Awaitable, Callable, Union
 from collections import Counter, defaultdict
+from ._batch import BatchPending
+from ._gleaning import AdaptiveGleaning
+from ._instrument import span
 from ._splitter import SeparatorSplitter
 from ._utils import (
     logger,
     clean_str,
+    compute_args_hash,
     compute_mdhash_id,
+    count_tokens_batch_by_tiktoken,
+    count_tokens_by_tiktoken,
     decode_tokens_by_tiktoken,
     encode_string_by_tiktoken,
     is_float_regex,
     list_of_list_to_csv,
+    llm_priority,
     pack_user_ass_to_openai_messages,
     split_string_by_multi_markers,
     truncate_list_by_token_size,
@@ -23,6 +33,7 @@ from .base import (
     BaseVectorStorage,
     SingleCommunitySchema,
     CommunitySchema,
+    CommunityLevelIndexSchema,
     TextChunkSchema,
     QueryParam,
 )
@@ -140,14 +151,104 @@ async def _handle_entity_relation_summary(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {entity_or_relation_name}")
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    with span("summarization"), llm_priority("summarization"):
+        summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
     return summary
 
 
-async def _handle_single_entity_extraction(
-    record_attributes: list[str],
-    chunk_key: str,
-):
+async def _handle_entity_relation_summary_batch(
+    items: list[tuple[Union[str, tuple[str, str]], str]],
+    global_config: dict,
+) -> list[str]:
+    """`_handle_entity_relation_summary` for many (name, description) items.
+
+    Descriptions over `entity_summary_to_max_tokens` are packed, up to
+    `entity_summary_batch_size` per prompt and `cheap_model_max_token_size`
+    description tokens, into one JSON-returning prompt. Items missing from a
+    reply that cannot be parsed are summarized one call each.
+    """
+    use_llm_func: callable = global_config["cheap_model_func"]
+    llm_max_tokens = global_config["cheap_model_max_token_size"]
+    tiktoken_model_name = global_config["tiktoken_model_name"]
+    summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+    batch_size = global_config.get("entity_summary_batch_size", 1)
+    use_string_json_convert_func: callable = global_config[
+        "convert_response_to_json_func"
+    ]
+
+    results = [description for _, description in items]
+    pending = []
+    for i, (name, description) in enumerate(items):
+        tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
+        if len(tokens) < summary_max_tokens:
+            continue
+        tokens = tokens[:llm_max_tokens]
+        use_description = decode_tokens_by_tiktoken(
+            tokens, model_name=tiktoken_model_name
+        )
+        pending.append((i, name, use_description, len(tokens)))
+    if not pending:
+        return results
+
+    budget = llm_max_tokens - count_tokens_by_tiktoken(
+        PROMPTS["summarize_entity_descriptions_batch"]
+    )
+    groups, group_tokens = [[]], 0
+    for item in pending:
+        if groups[-1] and (
+            len(groups[-1]) >= batch_size or group_tokens + item[3] > budget
+        ):
+            groups.append([])
+            group_tokens = 0
+        groups[-1].append(item)
+        group_tokens += item[3]
+
+    async def _summarize_one(i, name):
+        results[i] = await _handle_entity_relation_summary(
+            name, items[i][1], global_config
+        )
+
+    async def _summarize_group(group):
+        if len(group) == 1:
+            return await _summarize_one(group[0][0], group[0][1])
+        item_template = PROMPTS["summarize_entity_descriptions_batch_item"]
+        use_prompt = PROMPTS["summarize_entity_descriptions_batch"].format(
+            items="\n".join(
+                item_template.format(
+                    item_id=item_id,
+                    entity_name=name,
+                    description_list=use_description.split(GRAPH_FIELD_SEP),
+                )
+                for item_id, (_, name, use_description, _) in enumerate(group, 1)
+            )
+        )
+        logger.debug(f"Trigger batched summary of {len(group)} items")
+        with span("summarization"), llm_priority("summarization"):
+            response = await use_llm_func(
+                use_prompt, max_tokens=summary_max_tokens * len(group)
+            )
+        summaries = use_string_json_convert_func(response) or {}
+        failed = []
+        for item_id, (i, name, _, _) in enumerate(group, 1):
+            summary = summaries.get(str(item_id))
+            if isinstance(summary, str) and summary.strip():
+                results[i] = summary.strip()
+            else:
+                failed.append((i, name))
+        if failed:
+            logger.warning(
+                f"Batched summary missed {len(failed)}/{len(group)} items, summarizing them one by one"
+            )
+            await asyncio.gather(*[_summarize_one(i, name) for i, name in failed])
+
+    await asyncio.gather(*[_summarize_group(group) for group in groups])
+    logger.info(f"Summarized {len(pending)} descriptions in {len(groups)} batches")
+    return results
+
+
+def _entity_from_attributes(
+    record_attributes: list[str], chunk_key: str
+) -> Union[dict, None]:
     if len(record_attributes) < 4 or record_attributes[0] != '"entity"':
         return None
     entity_name = clean_str(record_attributes[1].upper())
@@ -164,10 +265,9 @@ async def _handle_single_entity_extraction(
     )
 
 
-async def _handle_single_relationship_extraction(
-    record_attributes: list[str],
-    chunk_key: str,
-):
+def _relationship_from_attributes(
+    record_attributes: list[str], chunk_key: str
+) -> Union[dict, None]:
     if len(record_attributes) < 5 or record_attributes[0] != '"relationship"':
         return None
     source = clean_str(record_attributes[1].upper())
@@ -186,23 +286,116 @@ async def _handle_single_relationship_extraction(
     )
 
 
-async def _merge_nodes_then_upsert(
-    entity_name: str,
-    nodes_data: list[dict],
-    knwoledge_graph_inst: BaseGraphStorage,
-    global_config: dict,
-):
+@functools.lru_cache(maxsize=None)
+def _compile_markers(*markers: str) -> re.Pattern:
+    return re.compile("|".join(re.escape(marker) for marker in markers))
+
+
+_RECORD_BODY = re.compile(r"\((.*)\)")
+
+
+class ExtractionRecordParser:
+    """Parse the tuple/record/completion delimited extraction format into
+    ("entity", node) and ("relationship", edge) records.
+
+    `parse` handles a whole response. `feed`/`close` handle one response that
+    arrives in pieces: `feed` returns the records completed so far and keeps
+    the unterminated tail for the next piece. Both give the same records as
+    splitting the full text at once.
+    """
+
+    def __init__(
+        self,
+        tuple_delimiter: str = PROMPTS["DEFAULT_TUPLE_DELIMITER"],
+        record_delimiter: str = PROMPTS["DEFAULT_RECORD_DELIMITER"],
+        completion_delimiter: str = PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
+    ):
+        self._record_splitter = _compile_markers(record_delimiter, completion_delimiter)
+        self._tuple_delimiter = tuple_delimiter
+        self._buffer = ""
+
+    def parse_record(self, record: str, chunk_key: str) -> Union[tuple[str, dict], None]:
+        body = _RECORD_BODY.search(record)
+        if body is None:
+            return None
+        record_attributes = [
+            a.strip() for a in body.group(1).split(self._tuple_delimiter) if a.strip()
+        ]
+        if_entities = _entity_from_attributes(record_attributes, chunk_key)
+        if if_entities is not None:
+            return "entity", if_entities
+        if_relation = _relationship_from_attributes(record_attributes, chunk_key)
+        if if_relation is not None:
+            return "relationship", if_relation
+        return None
+
+    def iter_records(self, text: str, chunk_key: str):
+        for record in self._record_splitter.split(text):
+            if not record.strip():
+                continue
+            parsed = self.parse_record(record, chunk_key)
+            if parsed is not None:
+                yield parsed
+
+    def parse(self, text: str, chunk_key: str) -> tuple[dict, dict]:
+        """Nodes grouped by entity name and edges grouped by (src, tgt)"""
+        maybe_nodes = defaultdict(list)
+        maybe_edges = defaultdict(list)
+        for kind, dp in self.iter_records(text, chunk_key):
+            if kind == "entity":
+                maybe_nodes[dp["entity_name"]].append(dp)
+            else:
+                maybe_edges[(dp["src_id"], dp["tgt_id"])].append(dp)
+        return maybe_nodes, maybe_edges
+
+    def feed(self, text: str, chunk_key: str) -> list[tuple[str, dict]]:
+        self._buffer += text
+        last = None
+        for last in self._record_splitter.finditer(self._buffer):
+            pass
+        if last is None:
+            return []
+        complete, self._buffer = self._buffer[: last.start()], self._buffer[last.end() :]
+        return list(self.iter_records(complete, chunk_key))
+
+    def close(self, chunk_key: str) -> list[tuple[str, dict]]:
+        rest, self._buffer = self._buffer, ""
+        return list(self.iter_records(rest, chunk_key))
+
+
+def _split_stored_description(already: Union[dict, None]) -> tuple[str, list[str]]:
+    """The last summary of a stored node or edge and the fragments added since.
+    Both are read from `description`, whose first fragment is the summary when
+    `description_summarized` is set, so an edited description is never undone.
+    """
+    if already is None:
+        return "", []
+    fragments = split_string_by_multi_markers(already["description"], [GRAPH_FIELD_SEP])
+    if already.get("description_summarized") and fragments:
+        return fragments[0], fragments[1:]
+    return "", fragments
+
+
+def _merge_descriptions(
+    new_descriptions: list[str], already: Union[dict, None]
+) -> tuple[str, bool]:
+    """The merged description and whether it starts with a summary"""
+    summary, delta = _split_stored_description(already)
+    delta = sorted(set(new_descriptions + delta) - {summary})
+    return GRAPH_FIELD_SEP.join(([summary] if summary else []) + delta), bool(summary)
+
+
+def _merge_node_records(nodes_data: list[dict], already_node: Union[dict, None]) -> dict:
+    """Fold the extracted records of one entity into its stored node, if any.
+    The description is not summarized yet.
+    """
     already_entitiy_types = []
     already_source_ids = []
-    already_description = []
-
-    already_node = await knwoledge_graph_inst.get_node(entity_name)
     if already_node is not None:
         already_entitiy_types.append(already_node["entity_type"])
         already_source_ids.extend(
             split_string_by_multi_markers(already_node["source_id"], [GRAPH_FIELD_SEP])
         )
-        already_description.append(already_node["description"])
 
     entity_type = sorted(
         Counter(
@@ -211,77 +404,187 @@ async def _merge_nodes_then_upsert(
         key=lambda x: x[1],
         reverse=True,
     )[0][0]
-    description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in nodes_data] + already_description))
+    description, summarized = _merge_descriptions(
+        [dp["description"] for dp in nodes_data], already_node
     )
     source_id = GRAPH_FIELD_SEP.join(
         set([dp["source_id"] for dp in nodes_data] + already_source_ids)
     )
-    description = await _handle_entity_relation_summary(
-        entity_name, description, global_config
-    )
-    node_data = dict(
+    return dict(
         entity_type=entity_type,
         description=description,
         source_id=source_id,
+        description_summarized=summarized,
     )
-    await knwoledge_graph_inst.upsert_node(
-        entity_name,
-        node_data=node_data,
-    )
-    node_data["entity_name"] = entity_name
-    return node_data
 
 
-async def _merge_edges_then_upsert(
-    src_id: str,
-    tgt_id: str,
-    edges_data: list[dict],
-    knwoledge_graph_inst: BaseGraphStorage,
-    global_config: dict,
-):
+def _merge_edge_records(edges_data: list[dict], already_edge: Union[dict, None]) -> dict:
     already_weights = []
     already_source_ids = []
-    already_description = []
     already_order = []
-    if await knwoledge_graph_inst.has_edge(src_id, tgt_id):
-        already_edge = await knwoledge_graph_inst.get_edge(src_id, tgt_id)
+    if already_edge is not None:
         already_weights.append(already_edge["weight"])
         already_source_ids.extend(
             split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
         )
-        already_description.append(already_edge["description"])
         already_order.append(already_edge.get("order", 1))
 
     order = min([dp.get("order", 1) for dp in edges_data] + already_order)
     weight = sum([dp["weight"] for dp in edges_data] + already_weights)
-    description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in edges_data] + already_description))
+    description, summarized = _merge_descriptions(
+        [dp["description"] for dp in edges_data], already_edge
     )
     source_id = GRAPH_FIELD_SEP.join(
         set([dp["source_id"] for dp in edges_data] + already_source_ids)
     )
+    return dict(
+        weight=weight,
+        description=description,
+        source_id=source_id,
+        order=order,
+        description_summarized=summarized,
+    )
+
+
+def _placeholder_node(edge: dict) -> dict:
+    """Node for an edge endpoint that was never extracted as an entity"""
+    return {
+        "source_id": edge["source_id"],
+        "description": edge["description"],
+        "entity_type": '"UNKNOWN"',
+        "description_summarized": False,
+    }
+
+
+async def _summarize_merged_records(
+    records: list[tuple[Union[str, tuple[str, str]], dict]], global_config: dict
+):
+    """Summarize merged descriptions in place.
+
+    A description over `entity_summary_to_max_tokens` is only summarized once
+    the fragments added since its last summary reach
+    `entity_summary_delta_max_tokens`; the prompt then holds the previous
+    summary plus those fragments, not the whole history.
+    """
+    summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+    delta_max_tokens = global_config.get("entity_summary_delta_max_tokens", 0)
+    description_tokens = count_tokens_batch_by_tiktoken(
+        [data["description"] for _, data in records]
+    )
+    need_summary = []
+    for (name, data), tokens in zip(records, description_tokens):
+        if tokens < summary_max_tokens:
+            continue
+        summary, delta = _split_stored_description(data)
+        if (
+            summary
+            and count_tokens_by_tiktoken(GRAPH_FIELD_SEP.join(delta)) < delta_max_tokens
+        ):
+            continue
+        need_summary.append((name, data))
+    summaries = await _handle_entity_relation_summary_batch(
+        [(name, data["description"]) for name, data in need_summary], global_config
+    )
+    for (_, data), summary in zip(need_summary, summaries):
+        data["description"] = summary
+        data["description_summarized"] = True
+
+
+async def _merge_nodes_then_upsert(
+    entity_name: str,
+    nodes_data: list[dict],
+    knwoledge_graph_inst: BaseGraphStorage,
+    global_config: dict,
+):
+    already_node = await knwoledge_graph_inst.get_node(entity_name)
+    node_data = _merge_node_records(nodes_data, already_node)
+    await _summarize_merged_records([(entity_name, node_data)], global_config)
+    await knwoledge_graph_inst.upsert_node(
+        entity_name,
+        node_data=node_data,
+    )
+    node_data["entity_name"] = entity_name
+    return node_data
+
+
+async def _merge_edges_then_upsert(
+    src_id: str,
+    tgt_id: str,
+    edges_data: list[dict],
+    knwoledge_graph_inst: BaseGraphStorage,
+    global_config: dict,
+):
+    already_edge = None
+    if await knwoledge_graph_inst.has_edge(src_id, tgt_id):
+        already_edge = await knwoledge_graph_inst.get_edge(src_id, tgt_id)
+    edge_data = _merge_edge_records(edges_data, already_edge)
     for need_insert_id in [src_id, tgt_id]:
         if not (await knwoledge_graph_inst.has_node(need_insert_id)):
             await knwoledge_graph_inst.upsert_node(
-                need_insert_id,
-                node_data={
-                    "source_id": source_id,
-                    "description": description,
-                    "entity_type": '"UNKNOWN"',
-                },
+                need_insert_id, node_data=_placeholder_node(edge_data)
             )
-    description = await _handle_entity_relation_summary(
-        (src_id, tgt_id), description, global_config
+    await _summarize_merged_records([((src_id, tgt_id), edge_data)], global_config)
+    await knwoledge_graph_inst.upsert_edge(src_id, tgt_id, edge_data=edge_data)
+
+
+async def _merge_nodes_and_edges_then_upsert(
+    maybe_nodes: dict[str, list[dict]],
+    maybe_edges: dict[tuple[str, str], list[dict]],
+    knwoledge_graph_inst: BaseGraphStorage,
+    global_config: dict,
+) -> list[dict]:
+    """Batched form of `_merge_nodes_then_upsert` + `_merge_edges_then_upsert`.
+
+    Existing nodes and edges are prefetched with one `*_batch` call each,
+    merged in memory, summarized, then written back with the `upsert_*_batch`
+    APIs, `graph_upsert_batch_size` items per call: nodes (including
+    placeholders for unseen edge endpoints) first, then edges.
+    """
+    batch_size = global_config.get("graph_upsert_batch_size", 1000)
+    node_ids = list(maybe_nodes.keys())
+    edge_keys = list(maybe_edges.keys())
+    endpoint_ids = list(
+        dict.fromkeys(n for k in edge_keys for n in k if n not in maybe_nodes)
     )
-    await knwoledge_graph_inst.upsert_edge(
-        src_id,
-        tgt_id,
-        edge_data=dict(
-            weight=weight, description=description, source_id=source_id, order=order
-        ),
+    with span("merge_prefetch"):
+        already_nodes = await knwoledge_graph_inst.get_nodes_batch(
+            node_ids + endpoint_ids
+        )
+        already_edges = await knwoledge_graph_inst.get_edges_batch(edge_keys)
+    already_nodes = dict(zip(node_ids + endpoint_ids, already_nodes))
+
+    nodes = {k: _merge_node_records(maybe_nodes[k], already_nodes[k]) for k in node_ids}
+    edges = {
+        k: _merge_edge_records(maybe_edges[k], already_edge)
+        for k, already_edge in zip(edge_keys, already_edges)
+    }
+    placeholder_nodes = {}
+    for k, edge in edges.items():
+        for need_insert_id in k:
+            if (
+                need_insert_id not in nodes
+                and need_insert_id not in placeholder_nodes
+                and already_nodes[need_insert_id] is None
+            ):
+                placeholder_nodes[need_insert_id] = _placeholder_node(edge)
+
+    await _summarize_merged_records(
+        list(itertools.chain(nodes.items(), edges.items())), global_config
     )
 
+    with span("merge_upsert"):
+        nodes_to_upsert = list(nodes.items()) + list(placeholder_nodes.items())
+        for i in range(0, len(nodes_to_upsert), batch_size):
+            await knwoledge_graph_inst.upsert_nodes_batch(
+                nodes_to_upsert[i : i + batch_size]
+            )
+        edges_to_upsert = [(k[0], k[1], v) for k, v in edges.items()]
+        for i in range(0, len(edges_to_upsert), batch_size):
+            await knwoledge_graph_inst.upsert_edges_batch(
+                edges_to_upsert[i : i + batch_size]
+            )
+    return [{**v, "entity_name": k} for k, v in nodes.items()]
+
 
 async def extract_entities(
     chunks: dict[str, TextChunkSchema],
@@ -289,9 +592,24 @@ async def extract_entities(
     entity_vdb: BaseVectorStorage,
     global_config: dict,
     using_amazon_bedrock: bool=False,
+    extraction_cache: BaseKVStorage = None,
+    gleaning_policy: AdaptiveGleaning = None,
 ) -> Union[BaseGraphStorage, None]:
+    """Extract entities and relations from `chunks` and merge them into the graph.
+
+    With an `extraction_cache`, the parsed records of every chunk are stored
+    under its (content-addressed) chunk id along with a hash of the extraction
+    prompts, so re-extracting the same chunks makes no LLM calls at all.
+    With a `gleaning_policy`, the number of gleaning rounds is decided per
+    chunk by the policy instead of the "if loop" prompt. With
+    `enable_llm_streaming`, extraction calls pass a `stream_handler` to the
+    model function and records are parsed while the model is generating.
+    If some extraction calls were deferred to a batch (`collect_batch_requests`),
+    nothing is merged and None is returned; the finished chunks are cached.
+    """
     use_llm_func: callable = global_config["best_model_func"]
     entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
+    enable_streaming = global_config.get("enable_llm_streaming", False)
 
     ordered_chunks = list(chunks.items())
 
@@ -304,83 +622,225 @@ async def extract_entities(
     )
     continue_prompt = PROMPTS["entiti_continue_extraction"]
     if_loop_prompt = PROMPTS["entiti_if_loop_extraction"]
+    record_parser = ExtractionRecordParser(
+        context_base["tuple_delimiter"],
+        context_base["record_delimiter"],
+        context_base["completion_delimiter"],
+    )
+
+    extraction_version = compute_args_hash(
+        entity_extract_prompt,
+        continue_prompt,
+        if_loop_prompt,
+        context_base,
+        entity_extract_max_gleaning,
+        gleaning_policy and gleaning_policy.max_rounds,
+    )
+    if gleaning_policy is not None:
+        await gleaning_policy.load(extraction_version)
 
     already_processed = 0
     already_entities = 0
     already_relations = 0
+    already_cached = 0
+    already_streamed = 0
+    already_pending = 0
 
-    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]):
-        nonlocal already_processed, already_entities, already_relations
-        chunk_key = chunk_key_dp[0]
-        chunk_dp = chunk_key_dp[1]
-        content = chunk_dp["content"]
-        hint_prompt = entity_extract_prompt.format(**context_base, input_text=content)
-        final_result = await use_llm_func(hint_prompt)
-        if isinstance(final_result, list):
-            final_result = final_result[0]["text"]
+    def _print_progress():
+        now_ticks = PROMPTS["process_tickers"][
+            already_processed % len(PROMPTS["process_tickers"])
+        ]
+        streamed = f", {already_streamed} records streamed" if enable_streaming else ""
+        print(
+            f"{now_ticks} Processed {already_processed}({already_processed*100//len(ordered_chunks)}%) chunks,  {already_entities} entities(duplicated), {already_relations} relations(duplicated){streamed}\r",
+            end="",
+            flush=True,
+        )
+
+    async def _extract_round(span_name: str, chunk_key: str, prompt: str, **kwargs):
+        """One extraction call and its parsed records. When streaming, records
+        are parsed as soon as their delimiter arrives, and the handler's
+        `restart` starts over when the model function retries; if the returned
+        text is not what was streamed (e.g. a cache hit), it is reparsed.
+        """
+        if not enable_streaming:
+            with span(span_name):
+                result = await use_llm_func(prompt, **kwargs)
+            if isinstance(result, list):
+                result = result[0]["text"]
+            return (result, *record_parser.parse(result, chunk_key))
+
+        attempt = {}
+
+        def _restart():
+            # the model function retries the call: drop what the failed attempt streamed
+            nonlocal already_streamed
+            already_streamed -= attempt.get("streamed", 0)
+            attempt.update(
+                parser=ExtractionRecordParser(
+                    context_base["tuple_delimiter"],
+                    context_base["record_delimiter"],
+                    context_base["completion_delimiter"],
+                ),
+                pieces=[],
+                nodes=defaultdict(list),
+                edges=defaultdict(list),
+                streamed=0,
+            )
+
+        def _add_records(records: list[tuple[str, dict]]):
+            nonlocal already_streamed
+            for kind, dp in records:
+                if kind == "entity":
+                    attempt["nodes"][dp["entity_name"]].append(dp)
+                else:
+                    attempt["edges"][(dp["src_id"], dp["tgt_id"])].append(dp)
+            if records:
+                attempt["streamed"] += len(records)
+                already_streamed += len(records)
+                _print_progress()
+
+        def _on_piece(piece: str):
+            attempt["pieces"].append(piece)
+            _add_records(attempt["parser"].feed(piece, chunk_key))
+
+        _restart()
+        _on_piece.restart = _restart
+        with span(span_name):
+            result = await use_llm_func(prompt, stream_handler=_on_piece, **kwargs)
+        if isinstance(result, list):
+            result = result[0]["text"]
+        if "".join(attempt["pieces"]) != result:
+            return (result, *record_parser.parse(result, chunk_key))
+        _add_records(attempt["parser"].close(chunk_key))
+        return result, attempt["nodes"], attempt["edges"]
+
+    async def _extract_single_content(chunk_key: str, chunk_dp: TextChunkSchema):
+        hint_prompt = entity_extract_prompt.format(
+            **context_base, input_text=chunk_dp["content"]
+        )
+        final_result, maybe_nodes, maybe_edges = await _extract_round(
+            "extraction", chunk_key, hint_prompt
+        )
 
         history = pack_user_ass_to_openai_messages(hint_prompt, final_result, using_amazon_bedrock)
+        if gleaning_policy is not None:
+            first_records = len(maybe_nodes) + len(maybe_edges)
+            sampled = gleaning_policy.should_sample(chunk_key)
+            gains = []
+            for now_glean_index in range(gleaning_policy.max_rounds):
+                if not sampled and (
+                    (gains and not sum(gains[-1]))
+                    or not gleaning_policy.should_glean(
+                        now_glean_index,
+                        chunk_dp["tokens"],
+                        first_records + sum(map(sum, gains)),
+                    )
+                ):
+                    break
+                glean_result, glean_nodes, glean_edges = await _extract_round(
+                    f"gleaning_{now_glean_index + 1}",
+                    chunk_key,
+                    continue_prompt,
+                    history_messages=history,
+                )
+                history += pack_user_ass_to_openai_messages(continue_prompt, glean_result, using_amazon_bedrock)
+                gains.append(
+                    (
+                        len(glean_nodes.keys() - maybe_nodes.keys()),
+                        len(glean_edges.keys() - maybe_edges.keys()),
+                    )
+                )
+                for k, v in glean_nodes.items():
+                    maybe_nodes[k].extend(v)
+                for k, v in glean_edges.items():
+                    maybe_edges[k].extend(v)
+            gleaning_policy.observe(
+                chunk_dp["tokens"],
+                first_records,
+                gains,
+                sampled,
+                fixed_schedule_calls=max(2 * entity_extract_max_gleaning - 1, 0),
+            )
+            return maybe_nodes, maybe_edges
+
         for now_glean_index in range(entity_extract_max_gleaning):
-            glean_result = await use_llm_func(continue_prompt, history_messages=history)
+            glean_result, glean_nodes, glean_edges = await _extract_round(
+                f"gleaning_{now_glean_index + 1}",
+                chunk_key,
+                continue_prompt,
+                history_messages=history,
+            )
 
             history += pack_user_ass_to_openai_messages(continue_prompt, glean_result, using_amazon_bedrock)
-            final_result += glean_result
+            for k, v in glean_nodes.items():
+                maybe_nodes[k].extend(v)
+            for k, v in glean_edges.items():
+                maybe_edges[k].extend(v)
             if now_glean_index == entity_extract_max_gleaning - 1:
                 break
 
-            if_loop_result: str = await use_llm_func(
-                if_loop_prompt, history_messages=history
-            )
+            with span(f"gleaning_{now_glean_index + 1}"):
+                if_loop_result: str = await use_llm_func(
+                    if_loop_prompt, history_messages=history
+                )
             if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
             if if_loop_result != "yes":
                 break
+        return maybe_nodes, maybe_edges
 
-        records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
-        )
-
-        maybe_nodes = defaultdict(list)
-        maybe_edges = defaultdict(list)
-        for record in records:
-            record = re.search(r"\((.*)\)", record)
-            if record is None:
-                continue
-            record = record.group(1)
-            record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]]
-            )
-            if_entities = await _handle_single_entity_extraction(
-                record_attributes, chunk_key
-            )
-            if if_entities is not None:
-                maybe_nodes[if_entities["entity_name"]].append(if_entities)
-                continue
-
-            if_relation = await _handle_single_relationship_extraction(
-                record_attributes, chunk_key
-            )
-            if if_relation is not None:
-                maybe_edges[(if_relation["src_id"], if_relation["tgt_id"])].append(
-                    if_relation
+    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]):
+        nonlocal already_processed, already_entities, already_relations, already_cached
+        nonlocal already_pending
+        chunk_key = chunk_key_dp[0]
+        chunk_dp = chunk_key_dp[1]
+        cached = None
+        if extraction_cache is not None:
+            cached = await extraction_cache.get_by_id(chunk_key)
+        if cached is not None and cached["version"] == extraction_version:
+            maybe_nodes = defaultdict(list)
+            maybe_edges = defaultdict(list)
+            for dp in cached["nodes"]:
+                maybe_nodes[dp["entity_name"]].append(dp)
+            for dp in cached["edges"]:
+                maybe_edges[(dp["src_id"], dp["tgt_id"])].append(dp)
+            already_cached += 1
+        else:
+            try:
+                maybe_nodes, maybe_edges = await _extract_single_content(
+                    chunk_key, chunk_dp
+                )
+            except BatchPending:
+                already_pending += 1
+                return None
+            if extraction_cache is not None:
+                await extraction_cache.upsert(
+                    {
+                        chunk_key: {
+                            "version": extraction_version,
+                            "nodes": list(itertools.chain(*maybe_nodes.values())),
+                            "edges": list(itertools.chain(*maybe_edges.values())),
+                        }
+                    }
                 )
         already_processed += 1
         already_entities += len(maybe_nodes)
         already_relations += len(maybe_edges)
-        now_ticks = PROMPTS["process_tickers"][
-            already_processed % len(PROMPTS["process_tickers"])
-        ]
-        print(
-            f"{now_ticks} Processed {already_processed}({already_processed*100//len(ordered_chunks)}%) chunks,  {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
-            end="",
-            flush=True,
-        )
+        _print_progress()
         return dict(maybe_nodes), dict(maybe_edges)
 
-    results = await asyncio.gather(
-        *[_process_single_content(c) for c in ordered_chunks]
-    )
+    with llm_priority("extraction"):
+        results = await asyncio.gather(
+            *[_process_single_content(c) for c in ordered_chunks]
+        )
     print()
+    if already_cached:
+        logger.info(f"Reused cached extractions of {already_cached} chunks")
+    if already_pending:
+        logger.info(f"{already_pending} chunks are waiting for batched extraction calls")
+        return None
+    if gleaning_policy is not None:
+        logger.info(gleaning_policy.summary())
     maybe_nodes = defaultdict(list)
     maybe_edges = defaultdict(list)
     for m_nodes, m_edges in results:
@@ -388,18 +848,10 @@ async def extract_entities(
             maybe_nodes[k].extend(v)
         for k, v in m_edges.items():
             maybe_edges[tuple(sorted(k))].extend(v)
-    all_entities_data = await asyncio.gather(
-        *[
-            _merge_nodes_then_upsert(k, v, knwoledge_graph_inst, global_config)
-            for k, v in maybe_nodes.items()
-        ]
-    )
-    await asyncio.gather(
-        *[
-            _merge_edges_then_upsert(k[0], k[1], v, knwoledge_graph_inst, global_config)
-            for k, v in maybe_edges.items()
-        ]
-    )
+    with span("merge"):
+        all_entities_data = await _merge_nodes_and_edges_then_upsert(
+            maybe_nodes, maybe_edges, knwoledge_graph_inst, global_config
+        )
     if not len(all_entities_data):
         logger.warning("Didn't extract any entities, maybe your LLM is not working")
         return None
@@ -411,7 +863,8 @@ async def extract_entities(
             }
             for dp in all_entities_data
         }
-        await entity_vdb.upsert(data_for_vdb)
+        with span("entity_vdb_upsert"):
+            await entity_vdb.upsert(data_for_vdb)
     return knwoledge_graph_inst
 
 
@@ -430,6 +883,7 @@ def _pack_single_community_by_sub_communities(
         all_sub_communities,
         key=lambda x: x["report_string"],
         max_token_size=max_token_size,
+        token_key=_stored_report_tokens,
     )
     sub_fields = ["id", "report", "rating", "importance"]
     sub_communities_describe = list_of_list_to_csv(
@@ -451,12 +905,21 @@ def _pack_single_community_by_sub_communities(
         already_edges.extend([tuple(e) for e in c["edges"]])
     return (
         sub_communities_describe,
-        len(encode_string_by_tiktoken(sub_communities_describe)),
+        count_tokens_by_tiktoken(sub_communities_describe),
         set(already_nodes),
         set(already_edges),
     )
 
 
+def _stored_report_tokens(report: dict) -> Union[int, None]:
+    """The token count stored with a report, None if the report string was
+    rewritten since (e.g. by the deletion scripts)
+    """
+    if report.get("report_tokens_hash") != compute_args_hash(report["report_string"]):
+        return None
+    return report.get("report_tokens")
+
+
 async def _pack_single_community_describe(
     knwoledge_graph_inst: BaseGraphStorage,
     community: SingleCommunitySchema,
@@ -590,7 +1053,20 @@ async def generate_community_report(
     community_report_kv: BaseKVStorage[CommunitySchema],
     knwoledge_graph_inst: BaseGraphStorage,
     global_config: dict,
+    community_index_kv: BaseKVStorage[CommunityLevelIndexSchema] = None,
+    community_reports_vdb: BaseVectorStorage = None,
+    reuse_stored_reports: bool = False,
+    on_level_done: Callable[[int, dict[str, CommunitySchema]], Awaitable] = None,
 ):
+    """Write a report for every community, deepest level first.
+
+    Stored reports of unchanged communities are kept with
+    `enable_incremental_community_report` or `reuse_stored_reports` (e.g. the
+    levels an interrupted run finished). `on_level_done` is awaited with the
+    reports of each level once it is complete, e.g. to persist them.
+    `community_reports_vdb` is expected to hold the stored reports: only new
+    reports are embedded, and the vectors of vanished communities deleted.
+    """
     llm_extra_kwargs = global_config["special_community_report_llm_kwargs"]
     use_llm_func: callable = global_config["best_model_func"]
     use_string_json_convert_func: callable = global_config[
@@ -604,20 +1080,27 @@ async def generate_community_report(
         communities_schema.values()
     )
     already_processed = 0
+    already_pending = 0
 
     async def _form_single_community_report(
         community: SingleCommunitySchema, already_reports: dict[str, CommunitySchema]
     ):
-        nonlocal already_processed
-        describe = await _pack_single_community_describe(
-            knwoledge_graph_inst,
-            community,
-            max_token_size=global_config["best_model_max_token_size"],
-            already_reports=already_reports,
-            global_config=global_config,
-        )
+        nonlocal already_processed, already_pending
+        with span("report_packing"):
+            describe = await _pack_single_community_describe(
+                knwoledge_graph_inst,
+                community,
+                max_token_size=global_config["best_model_max_token_size"],
+                already_reports=already_reports,
+                global_config=global_config,
+            )
         prompt = community_report_prompt.format(input_text=describe)
-        response = await use_llm_func(prompt, **llm_extra_kwargs)
+        try:
+            with span("report_generation"), llm_priority("community_report"):
+                response = await use_llm_func(prompt, **llm_extra_kwargs)
+        except BatchPending:
+            already_pending += 1
+            return None
 
         data = use_string_json_convert_func(response)
         already_processed += 1
@@ -631,23 +1114,44 @@ async def generate_community_report(
         )
         return data
 
+    incremental = global_config.get("enable_incremental_community_report", False)
+    stored_keys = set()
+    if community_reports_vdb is not None:
+        stored_keys = set(await community_report_kv.all_keys())
+    reusable_reports = {}
+    if incremental or reuse_stored_reports:
+        reusable_reports = await _find_reusable_community_reports(
+            community_report_kv, communities_schema
+        )
+        logger.info(
+            f"Reusing {len(reusable_reports)} of {len(communities_schema)} community reports"
+        )
+
     levels = sorted(set([c["level"] for c in community_values]), reverse=True)
     logger.info(f"Generating by levels: {levels}")
     community_datas = {}
     for level in levels:
-        this_level_community_keys, this_level_community_values = zip(
-            *[
-                (k, v)
-                for k, v in zip(community_keys, community_values)
-                if v["level"] == level
-            ]
-        )
+        this_level_communities = [
+            (k, v)
+            for k, v in zip(community_keys, community_values)
+            if v["level"] == level and k not in reusable_reports
+        ]
+        this_level_community_keys = [k for k, _ in this_level_communities]
+        this_level_community_values = [v for _, v in this_level_communities]
         this_level_communities_reports = await asyncio.gather(
             *[
                 _form_single_community_report(c, community_datas)
                 for c in this_level_community_values
             ]
         )
+        if already_pending:
+            # the next level is packed from these reports, and nothing is stored
+            # until every level is done
+            print()
+            logger.info(
+                f"{already_pending} level {level} communities are waiting for batched report calls"
+            )
+            return
         community_datas.update(
             {
                 k: {
@@ -662,8 +1166,171 @@ async def generate_community_report(
                 )
             }
         )
+        community_datas.update(
+            {
+                k: {
+                    "report_string": reusable_reports[k]["report_string"],
+                    "report_json": reusable_reports[k]["report_json"],
+                    **v,
+                }
+                for k, v in zip(community_keys, community_values)
+                if v["level"] == level and k in reusable_reports
+            }
+        )
+        this_level_keys = [
+            k for k, v in zip(community_keys, community_values) if v["level"] == level
+        ]
+        for k, n in zip(
+            this_level_keys,
+            count_tokens_batch_by_tiktoken(
+                [community_datas[k]["report_string"] for k in this_level_keys]
+            ),
+        ):
+            community_datas[k]["report_tokens"] = n
+            community_datas[k]["report_tokens_hash"] = compute_args_hash(
+                community_datas[k]["report_string"]
+            )
+        if community_reports_vdb is not None and this_level_community_keys:
+            await community_reports_vdb.upsert(
+                {
+                    k: {"content": _community_report_summary(community_datas[k])}
+                    for k in this_level_community_keys
+                }
+            )
+        if on_level_done is not None:
+            await on_level_done(level, {k: community_datas[k] for k in this_level_keys})
     print()
+    if incremental:
+        # communities that disappeared after re-clustering must not linger
+        await community_report_kv.drop()
     await community_report_kv.upsert(community_datas)
+    if community_index_kv is not None:
+        await community_index_kv.drop()
+        await community_index_kv.upsert(_build_community_level_index(community_datas))
+    vanished_keys = stored_keys - set(community_datas)
+    if community_reports_vdb is not None and vanished_keys:
+        await community_reports_vdb.delete(list(vanished_keys))
+
+
+def _community_report_summary(community: CommunitySchema) -> str:
+    report_json = community["report_json"]
+    title = report_json.get("title", community["title"])
+    return f"{title}\n\n{report_json.get('summary', '')}".strip()
+
+
+def _community_rank(community: dict):
+    return (community["occurrence"], community["rating"])
+
+
+def _build_community_level_index(
+    community_datas: dict[str, CommunitySchema]
+) -> dict[str, CommunityLevelIndexSchema]:
+    """Group the communities by level, best first, so `global_query` can pick
+    its candidates without rebuilding the community schema from the graph.
+    """
+    by_level = defaultdict(list)
+    for k, c in community_datas.items():
+        by_level[c["level"]].append(
+            {
+                "id": k,
+                "title": c["title"],
+                "occurrence": c["occurrence"],
+                "rating": c["report_json"].get("rating", 0),
+                "sub_communities": c["sub_communities"],
+                # what `community_reports_vdb` embedded for it
+                "summary_hash": compute_args_hash(_community_report_summary(c)),
+            }
+        )
+    return {
+        str(level): {
+            "level": level,
+            "communities": sorted(communities, key=_community_rank, reverse=True),
+        }
+        for level, communities in by_level.items()
+    }
+
+
+async def rebuild_community_index(
+    community_report_kv: BaseKVStorage[CommunitySchema],
+    community_index_kv: BaseKVStorage[CommunityLevelIndexSchema],
+    community_reports_vdb: BaseVectorStorage = None,
+):
+    """Rebuild the per-level index from the stored reports. With
+    `community_reports_vdb`, the reports whose summary changed since the old
+    index are embedded again and the vanished ones deleted.
+    """
+    keys = await community_report_kv.all_keys()
+    reports = await community_report_kv.get_by_ids(keys)
+    community_datas = {k: v for k, v in zip(keys, reports) if v is not None}
+    old_levels = await community_index_kv.get_by_ids(
+        await community_index_kv.all_keys()
+    )
+    old_hashes = {
+        c["id"]: c.get("summary_hash")
+        for level in old_levels
+        if level is not None
+        for c in level["communities"]
+    }
+    new_index = _build_community_level_index(community_datas)
+    await community_index_kv.drop()
+    await community_index_kv.upsert(new_index)
+    if community_reports_vdb is None:
+        return
+    changed_keys = [
+        c["id"]
+        for level in new_index.values()
+        for c in level["communities"]
+        if old_hashes.get(c["id"]) != c["summary_hash"]
+    ]
+    if changed_keys:
+        logger.info(f"Embedding {len(changed_keys)} changed community reports again")
+        await community_reports_vdb.upsert(
+            {
+                k: {"content": _community_report_summary(community_datas[k])}
+                for k in changed_keys
+            }
+        )
+    vanished_keys = set(old_hashes) - set(community_datas)
+    if vanished_keys:
+        await community_reports_vdb.delete(list(vanished_keys))
+
+
+def _is_same_community(old: CommunitySchema, new: SingleCommunitySchema) -> bool:
+    return (
+        old["level"] == new["level"]
+        and set(old["nodes"]) == set(new["nodes"])
+        and set(map(tuple, old["edges"])) == set(map(tuple, new["edges"]))
+        and set(old["chunk_ids"]) == set(new["chunk_ids"])
+    )
+
+
+async def _find_reusable_community_reports(
+    community_report_kv: BaseKVStorage[CommunitySchema],
+    communities_schema: dict[str, SingleCommunitySchema],
+) -> dict[str, CommunitySchema]:
+    """Return the stored reports whose community is unchanged after re-clustering.
+
+    A community is unchanged when its level, nodes, edges and source chunks are
+    the same as when its report was written, and none of its sub-communities
+    changed, since a parent report may have been built from its children.
+    """
+    community_keys = list(communities_schema.keys())
+    old_reports = await community_report_kv.get_by_ids(community_keys)
+    reusable = {
+        k: old
+        for k, old in zip(community_keys, old_reports)
+        if old is not None and _is_same_community(old, communities_schema[k])
+    }
+    levels = sorted(set([c["level"] for c in communities_schema.values()]), reverse=True)
+    for level in levels:
+        for k, v in communities_schema.items():
+            if v["level"] != level or k not in reusable:
+                continue
+            if sorted(reusable[k]["sub_communities"]) != sorted(
+                v["sub_communities"]
+            ) or any(sub not in reusable for sub in v["sub_communities"]):
+                reusable.pop(k)
+    return reusable
 
 
 async def _find_most_related_community_from_entities(
@@ -706,6 +1373,7 @@ async def _find_most_related_community_from_entities(
         sorted_community_datas,
         key=lambda x: x["report_string"],
         max_token_size=query_param.local_max_token_for_community_report,
+        token_key=_stored_report_tokens,
     )
     if query_param.local_community_single_one:
         use_community_reports = use_community_reports[:1]
@@ -764,6 +1432,7 @@ async def _find_most_related_text_unit_from_entities(
         all_text_units,
         key=lambda x: x["data"]["content"],
         max_token_size=query_param.local_max_token_for_text_unit,
+        token_key=lambda x: x["data"].get("tokens"),
     )
     all_text_units: list[TextChunkSchema] = [t["data"] for t in all_text_units]
     return all_text_units
@@ -812,7 +1481,8 @@ async def _build_local_query_context(
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
 ):
-    results = await entities_vdb.query(query, top_k=query_param.top_k)
+    with span("vector_query"):
+        results = await entities_vdb.query(query, top_k=query_param.top_k)
     if not len(results):
         return None
     node_datas = await knowledge_graph_inst.get_nodes_batch([r["entity_name"] for r in results])
@@ -904,14 +1574,15 @@ async def local_query(
     global_config: dict,
 ) -> str:
     use_model_func = global_config["best_model_func"]
-    context = await _build_local_query_context(
-        query,
-        knowledge_graph_inst,
-        entities_vdb,
-        community_reports,
-        text_chunks_db,
-        query_param,
-    )
+    with span("context_assembly"):
+        context = await _build_local_query_context(
+            query,
+            knowledge_graph_inst,
+            entities_vdb,
+            community_reports,
+            text_chunks_db,
+            query_param,
+        )
     if query_param.only_need_context:
         return context
     if context is None:
@@ -920,30 +1591,84 @@ async def local_query(
     sys_prompt = sys_prompt_temp.format(
         context_data=context, response_type=query_param.response_type
     )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
+    with span("completion"):
+        response = await use_model_func(
+            query,
+            system_prompt=sys_prompt,
+        )
     return response
 
 
-async def _map_global_communities(
-    query: str,
-    communities_data: list[CommunitySchema],
-    query_param: QueryParam,
-    global_config: dict,
-):
-    use_string_json_convert_func = global_config["convert_response_to_json_func"]
-    use_model_func = global_config["best_model_func"]
+def _group_communities_by_token_size(
+    communities_data: list[CommunitySchema], query_param: QueryParam
+) -> list[list[CommunitySchema]]:
+    """Split the reports into groups that each fit one map-stage prompt"""
     community_groups = []
     while len(communities_data):
         this_group = truncate_list_by_token_size(
             communities_data,
             key=lambda x: x["report_string"],
             max_token_size=query_param.global_max_token_for_community_report,
+            token_key=_stored_report_tokens,
         )
         community_groups.append(this_group)
         communities_data = communities_data[len(this_group) :]
+    return community_groups
+
+
+async def _prune_communities_by_similarity(
+    query: str,
+    communities_data: dict[str, CommunitySchema],
+    community_reports_vdb: BaseVectorStorage,
+    query_param: QueryParam,
+) -> dict[str, CommunitySchema]:
+    """Keep the `global_max_semantic_communities` communities that score best on
+    a mix of report similarity to the query and report rating.
+    """
+    max_communities = query_param.global_max_semantic_communities
+    if len(communities_data) <= max_communities:
+        return communities_data
+    with span("vector_query"):
+        # the vdb holds the reports of every level, only score the candidates
+        results = await community_reports_vdb.query(
+            query, top_k=len(communities_data), ids=list(communities_data)
+        )
+    # nano-vectordb returns the cosine similarity as "distance", hnswlib a real
+    # distance plus "similarity"
+    similarities = {r["id"]: r.get("similarity", r["distance"]) for r in results}
+    weight = query_param.global_semantic_rating_weight
+
+    def _score(k: str) -> float:
+        try:
+            rating = float(communities_data[k]["report_json"].get("rating", 0)) / 10
+        except (TypeError, ValueError):
+            rating = 0.0
+        return (1 - weight) * similarities.get(k, 0) + weight * rating
+
+    pruned = {
+        k: communities_data[k]
+        for k in sorted(communities_data, key=_score, reverse=True)[:max_communities]
+    }
+    groups_before = len(
+        _group_communities_by_token_size(list(communities_data.values()), query_param)
+    )
+    groups_after = len(_group_communities_by_token_size(list(pruned.values()), query_param))
+    logger.info(
+        f"Semantic pruning kept {len(pruned)} of {len(communities_data)} communities, "
+        f"{groups_after} map calls instead of {groups_before} ({groups_before - groups_after} saved)"
+    )
+    return pruned
+
+
+async def _map_global_communities(
+    query: str,
+    communities_data: list[CommunitySchema],
+    query_param: QueryParam,
+    global_config: dict,
+):
+    use_string_json_convert_func = global_config["convert_response_to_json_func"]
+    use_model_func = global_config["best_model_func"]
+    community_groups = _group_communities_by_token_size(communities_data, query_param)
 
     async def _process(community_truncated_datas: list[CommunitySchema]) -> dict:
         communities_section_list = [["id", "content", "rating", "importance"]]
@@ -972,6 +1697,45 @@ async def _map_global_communities(
     return responses
 
 
+async def _find_global_candidate_communities(
+    knowledge_graph_inst: BaseGraphStorage,
+    community_index: BaseKVStorage[CommunityLevelIndexSchema],
+    query_param: QueryParam,
+) -> list[str]:
+    """Keys of the most frequent communities up to `query_param.level`.
+
+    Reads the per-level index written with the community reports, and only
+    falls back to walking the graph for stores indexed before it existed.
+    """
+    if community_index is not None:
+        level_indexes = await community_index.get_by_ids(
+            [str(level) for level in range(query_param.level + 1)]
+        )
+        level_indexes = [i for i in level_indexes if i is not None]
+        if len(level_indexes) or len(await community_index.all_keys()):
+            merged = heapq.merge(
+                *[i["communities"] for i in level_indexes],
+                key=_community_rank,
+                reverse=True,
+            )
+            return [
+                c["id"]
+                for c in itertools.islice(
+                    merged, query_param.global_max_consider_community
+                )
+            ]
+        logger.info("No community index found, building the schema from the graph")
+    community_schema = await knowledge_graph_inst.community_schema()
+    sorted_community_schemas = sorted(
+        [(k, v) for k, v in community_schema.items() if v["level"] <= query_param.level],
+        key=lambda x: x[1]["occurrence"],
+        reverse=True,
+    )
+    return [k for k, _ in sorted_community_schemas][
+        : query_param.global_max_consider_community
+    ]
+
+
 async def global_query(
     query,
     knowledge_graph_inst: BaseGraphStorage,
@@ -980,42 +1744,44 @@ async def global_query(
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
     global_config: dict,
+    community_index: BaseKVStorage[CommunityLevelIndexSchema] = None,
+    community_reports_vdb: BaseVectorStorage = None,
 ) -> str:
-    community_schema = await knowledge_graph_inst.community_schema()
-    community_schema = {
-        k: v for k, v in community_schema.items() if v["level"] <= query_param.level
-    }
-    if not len(community_schema):
-        return PROMPTS["fail_response"]
     use_model_func = global_config["best_model_func"]
+    with span("context_assembly"):
+        candidate_keys = await _find_global_candidate_communities(
+            knowledge_graph_inst, community_index, query_param
+        )
+        community_datas = await community_reports.get_by_ids(candidate_keys)
+    if not len(candidate_keys):
+        return PROMPTS["fail_response"]
 
-    sorted_community_schemas = sorted(
-        community_schema.items(),
-        key=lambda x: x[1]["occurrence"],
-        reverse=True,
-    )
-    sorted_community_schemas = sorted_community_schemas[
-        : query_param.global_max_consider_community
-    ]
-    community_datas = await community_reports.get_by_ids(
-        [k[0] for k in sorted_community_schemas]
-    )
-    community_datas = [c for c in community_datas if c is not None]
-    community_datas = [
-        c
-        for c in community_datas
-        if c["report_json"].get("rating", 0) >= query_param.global_min_community_rating
-    ]
+    community_datas = {
+        k: c
+        for k, c in zip(candidate_keys, community_datas)
+        if c is not None
+        and c["report_json"].get("rating", 0) >= query_param.global_min_community_rating
+    }
+    if query_param.global_max_semantic_communities > 0:
+        if community_reports_vdb is None:
+            logger.warning(
+                "global_max_semantic_communities is set but enable_community_report_vdb is False, skipping pruning"
+            )
+        else:
+            community_datas = await _prune_communities_by_similarity(
+                query, community_datas, community_reports_vdb, query_param
+            )
     community_datas = sorted(
-        community_datas,
+        community_datas.values(),
         key=lambda x: (x["occurrence"], x["report_json"].get("rating", 0)),
         reverse=True,
     )
     logger.info(f"Revtrieved {len(community_datas)} communities")
 
-    map_communities_points = await _map_global_communities(
-        query, community_datas, query_param, global_config
-    )
+    with span("global_map"):
+        map_communities_points = await _map_global_communities(
+            query, community_datas, query_param, global_config
+        )
     final_support_points = []
     for i, mc in enumerate(map_communities_points):
         for point in mc:
@@ -1051,12 +1817,13 @@ Importance Score: {dp['score']}
     if query_param.only_need_context:
         return points_context
     sys_prompt_temp = PROMPTS["global_reduce_rag_response"]
-    response = await use_model_func(
-        query,
-        sys_prompt_temp.format(
-            report_data=points_context, response_type=query_param.response_type
-        ),
-    )
+    with span("completion"):
+        response = await use_model_func(
+            query,
+            sys_prompt_temp.format(
+                report_data=points_context, response_type=query_param.response_type
+            ),
+        )
     return response
 
 
@@ -1068,7 +1835,8 @@ async def naive_query(
     global_config: dict,
 ):
     use_model_func = global_config["best_model_func"]
-    results = await chunks_vdb.query(query, top_k=query_param.top_k)
+    with span("vector_query"):
+        results = await chunks_vdb.query(query, top_k=query_param.top_k)
     if not len(results):
         return PROMPTS["fail_response"]
     chunks_ids = [r["id"] for r in results]
@@ -1078,6 +1846,7 @@ async def naive_query(
         chunks,
         key=lambda x: x["content"],
         max_token_size=query_param.naive_max_token_for_text_unit,
+        token_key=lambda x: x.get("tokens"),
     )
     logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
     section = "--New Chunk--\n".join([c["content"] for c in maybe_trun_chunks])
@@ -1087,8 +1856,9 @@ async def naive_query(
     sys_prompt = sys_prompt_temp.format(
         content_data=section, response_type=query_param.response_type
     )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
+    with span("completion"):
+        response = await use_model_func(
+            query,
+            system_prompt=sys_prompt,
+        )
     return response
@@ -2,6 +2,9 @@ from .gdb_networkx import NetworkXStorage
 from .vdb_hnswlib import HNSWVectorStorage
 from .vdb_nanovectordb import NanoVectorDBStorage
 from .kv_json import JsonKVStorage
+from .kv_sqlite import SQLiteKVStorage
+from .kv_write_behind import WriteBehindKVStorage
+from .kv_query_cache import QueryResultCache
 
 
 def __getattr__(name):
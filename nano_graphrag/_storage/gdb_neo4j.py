@@ -246,7 +246,8 @@ class Neo4jStorage(BaseGraphStorage):
             return [result_dict[tuple(edge_pair)] for edge_pair in edge_pairs]
         except Exception as e:
             logger.error(f"Error in batch edge retrieval: {e}")
-            return [None] * len(edge_pairs)
+            # an edge read as missing would be overwritten by the merge
+            raise e
 
     async def get_node_edges(
         self, source_node_id: str
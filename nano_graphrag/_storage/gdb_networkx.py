@@ -1,12 +1,12 @@
 import html
 import json
 import os
+import pickle
 from collections import defaultdict
 from dataclasses import dataclass
 from typing import Any, Union, cast, List
 import networkx as nx
 import numpy as np
-import asyncio
 
 from .._utils import logger
 from ..base import (
@@ -15,6 +15,54 @@ from ..base import (
 )
 from ..prompt import GRAPH_FIELD_SEP
 
+GRAPH_SNAPSHOT_VERSION = 1
+# attributes of the GraphML keys d0..d7, whose ids the deletion scripts hardcode;
+# any other attribute gets a key after them
+GRAPHML_NODE_KEYS = ["entity_type", "description", "source_id", "clusters"]
+GRAPHML_EDGE_KEYS = ["weight", "description", "source_id", "order"]
+
+
+class _AdjacencySnapshot:
+    """CSR view of a graph for vectorized batch lookups.
+
+    `indptr`/`indices` follow the scipy.sparse layout: the neighbours of node
+    `i` are `indices[indptr[i]:indptr[i + 1]]`, in the graph's adjacency order.
+    """
+
+    def __init__(self, graph: nx.Graph):
+        self.node_ids = np.empty(graph.number_of_nodes(), dtype=object)
+        self.node_ids[:] = list(graph.nodes())
+        self.node_index = {n: i for i, n in enumerate(self.node_ids)}
+        self.degrees = np.fromiter(
+            (d for _, d in graph.degree()), dtype=np.int64, count=len(self.node_ids)
+        )
+        neighbour_counts = np.fromiter(
+            (len(graph.adj[n]) for n in self.node_ids),
+            dtype=np.int64,
+            count=len(self.node_ids),
+        )
+        self.indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(neighbour_counts, out=self.indptr[1:])
+        self.indices = np.fromiter(
+            (self.node_index[m] for n in self.node_ids for m in graph.adj[n]),
+            dtype=np.int64,
+            count=int(self.indptr[-1]),
+        )
+
+    def lookup(self, node_ids: list[str]) -> np.ndarray:
+        """Row index of each node, -1 for unknown nodes"""
+        return np.fromiter(
+            (self.node_index.get(n, -1) for n in node_ids),
+            dtype=np.int64,
+            count=len(node_ids),
+        )
+
+    def degrees_of(self, rows: np.ndarray) -> np.ndarray:
+        degrees = np.zeros(len(rows), dtype=np.int64)
+        known = rows >= 0
+        degrees[known] = self.degrees[rows[known]]
+        return degrees
+
 
 @dataclass
 class NetworkXStorage(BaseGraphStorage):
@@ -29,7 +77,88 @@ class NetworkXStorage(BaseGraphStorage):
         logger.info(
             f"Writing graph with {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges"
         )
-        nx.write_graphml(graph, file_name)
+        writer = nx.readwrite.graphml.GraphMLWriter()
+        for scope, names, items in [
+            ("node", GRAPHML_NODE_KEYS, graph.nodes(data=True)),
+            ("edge", GRAPHML_EDGE_KEYS, graph.edges(data=True)),
+        ]:
+            for name in names:
+                value = next((d[name] for *_, d in items if name in d), None)
+                if value is not None:
+                    writer.get_key(name, writer.get_xml_type(type(value)), scope, None)
+        writer.add_graph_element(graph)
+        with open(file_name, "wb") as f:
+            writer.dump(f)
+
+    @staticmethod
+    def load_nx_snapshot(file_name) -> nx.Graph:
+        """Load a graph written by `write_nx_snapshot`"""
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, "rb") as f:
+            snapshot = pickle.load(f)
+        if snapshot.get("version") != GRAPH_SNAPSHOT_VERSION:
+            logger.warning(
+                f"Ignoring graph snapshot {file_name} with version {snapshot.get('version')}"
+            )
+            return None
+        graph = nx.DiGraph() if snapshot["directed"] else nx.Graph()
+        graph.graph.update(snapshot["graph_attrs"])
+        nodes = snapshot["nodes"]
+        node_attrs = snapshot["node_attrs"]
+        graph.add_nodes_from(
+            (
+                n,
+                {k: column[i] for k, column in node_attrs.items() if column[i] is not None},
+            )
+            for i, n in enumerate(nodes)
+        )
+        edge_attrs = snapshot["edge_attrs"]
+        graph.add_edges_from(
+            (
+                nodes[src],
+                nodes[tgt],
+                {k: column[i] for k, column in edge_attrs.items() if column[i] is not None},
+            )
+            for i, (src, tgt) in enumerate(
+                zip(snapshot["edge_src"].tolist(), snapshot["edge_tgt"].tolist())
+            )
+        )
+        return graph
+
+    @staticmethod
+    def write_nx_snapshot(graph: nx.Graph, file_name):
+        """Write the graph as node/edge tables with one column per attribute.
+        Much faster to load than GraphML; written atomically.
+        """
+        logger.info(
+            f"Writing graph snapshot with {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges"
+        )
+        nodes = list(graph.nodes())
+        node_index = {n: i for i, n in enumerate(nodes)}
+        node_attr_keys = sorted(set(k for _, d in graph.nodes(data=True) for k in d))
+        edges = list(graph.edges(data=True))
+        edge_attr_keys = sorted(set(k for _, _, d in edges for k in d))
+        snapshot = {
+            "version": GRAPH_SNAPSHOT_VERSION,
+            "directed": graph.is_directed(),
+            "graph_attrs": dict(graph.graph),
+            "nodes": nodes,
+            "node_attrs": {
+                k: [d.get(k) for _, d in graph.nodes(data=True)] for k in node_attr_keys
+            },
+            "edge_src": np.fromiter(
+                (node_index[u] for u, _, _ in edges), dtype=np.int64, count=len(edges)
+            ),
+            "edge_tgt": np.fromiter(
+                (node_index[v] for _, v, _ in edges), dtype=np.int64, count=len(edges)
+            ),
+            "edge_attrs": {k: [d.get(k) for _, _, d in edges] for k in edge_attr_keys},
+        }
+        tmp_file_name = f"{file_name}.tmp"
+        with open(tmp_file_name, "wb") as f:
+            pickle.dump(snapshot, f, protocol=5)
+        os.replace(tmp_file_name, file_name)
 
     @staticmethod
     def stable_largest_connected_component(graph: nx.Graph) -> nx.Graph:
@@ -81,12 +210,30 @@ class NetworkXStorage(BaseGraphStorage):
         self._graphml_xml_file = os.path.join(
             self.global_config["working_dir"], f"graph_{self.namespace}.graphml"
         )
-        preloaded_graph = NetworkXStorage.load_nx_graph(self._graphml_xml_file)
+        self._snapshot_file = os.path.join(
+            self.global_config["working_dir"], f"graph_{self.namespace}.snapshot.pkl"
+        )
+        # "graphml" (default), "binary", or "both" to keep GraphML in sync
+        # for tools that read it directly
+        self._storage_format = self.global_config.get("addon_params", {}).get(
+            "networkx_storage_format", "graphml"
+        )
+        if self._storage_format not in ("graphml", "binary", "both"):
+            raise ValueError(
+                f"Unknown networkx_storage_format {self._storage_format}"
+            )
+        preloaded_file = self._graphml_xml_file
+        if self._storage_format != "graphml" and self._snapshot_is_fresh():
+            preloaded_file = self._snapshot_file
+            preloaded_graph = NetworkXStorage.load_nx_snapshot(self._snapshot_file)
+        else:
+            preloaded_graph = NetworkXStorage.load_nx_graph(self._graphml_xml_file)
         if preloaded_graph is not None:
             logger.info(
-                f"Loaded graph from {self._graphml_xml_file} with {preloaded_graph.number_of_nodes()} nodes, {preloaded_graph.number_of_edges()} edges"
+                f"Loaded graph from {preloaded_file} with {preloaded_graph.number_of_nodes()} nodes, {preloaded_graph.number_of_edges()} edges"
             )
         self._graph = preloaded_graph or nx.Graph()
+        self._adjacency = None
         self._clustering_algorithms = {
             "leiden": self._leiden_clustering,
         }
@@ -94,8 +241,22 @@ class NetworkXStorage(BaseGraphStorage):
             "node2vec": self._node2vec_embed,
         }
 
+    def _snapshot_is_fresh(self) -> bool:
+        """The snapshot is only trusted if no one rewrote the GraphML after it"""
+        if not os.path.exists(self._snapshot_file):
+            return False
+        if not os.path.exists(self._graphml_xml_file):
+            return True
+        return os.path.getmtime(self._snapshot_file) >= os.path.getmtime(
+            self._graphml_xml_file
+        )
+
     async def index_done_callback(self):
-        NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+        # GraphML first: the snapshot is only loaded if it is the newer file
+        if self._storage_format in ("graphml", "both"):
+            NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+        if self._storage_format in ("binary", "both"):
+            NetworkXStorage.write_nx_snapshot(self._graph, self._snapshot_file)
 
     async def has_node(self, node_id: str) -> bool:
         return self._graph.has_node(node_id)
@@ -107,13 +268,15 @@ class NetworkXStorage(BaseGraphStorage):
         return self._graph.nodes.get(node_id)
     
     async def get_nodes_batch(self, node_ids: list[str]) -> dict[str, Union[dict, None]]:
-        return await asyncio.gather(*[self.get_node(node_id) for node_id in node_ids])
+        nodes = self._graph.nodes
+        return [nodes.get(node_id) for node_id in node_ids]
 
     async def node_degree(self, node_id: str) -> int:
         return self._graph.degree(node_id) if self._graph.has_node(node_id) else 0
 
     async def node_degrees_batch(self, node_ids: List[str]) -> List[str]:
-        return await asyncio.gather(*[self.node_degree(node_id) for node_id in node_ids])
+        adjacency = self._get_adjacency()
+        return adjacency.degrees_of(adjacency.lookup(node_ids)).tolist()
 
     async def edge_degree(self, src_id: str, tgt_id: str) -> int:
         return (self._graph.degree(src_id) if self._graph.has_node(src_id) else 0) + (
@@ -121,7 +284,10 @@ class NetworkXStorage(BaseGraphStorage):
         )
 
     async def edge_degrees_batch(self, edge_pairs: list[tuple[str, str]]) -> list[int]:
-        return await asyncio.gather(*[self.edge_degree(src_id, tgt_id) for src_id, tgt_id in edge_pairs])
+        adjacency = self._get_adjacency()
+        src_rows = adjacency.lookup([src_id for src_id, _ in edge_pairs])
+        tgt_rows = adjacency.lookup([tgt_id for _, tgt_id in edge_pairs])
+        return (adjacency.degrees_of(src_rows) + adjacency.degrees_of(tgt_rows)).tolist()
 
     async def get_edge(
         self, source_node_id: str, target_node_id: str
@@ -131,7 +297,11 @@ class NetworkXStorage(BaseGraphStorage):
     async def get_edges_batch(
         self, edge_pairs: list[tuple[str, str]]
     ) -> list[Union[dict, None]]:
-        return await asyncio.gather(*[self.get_edge(source_node_id, target_node_id) for source_node_id, target_node_id in edge_pairs])
+        edges = self._graph.edges
+        return [
+            edges.get((source_node_id, target_node_id))
+            for source_node_id, target_node_id in edge_pairs
+        ]
 
     async def get_node_edges(self, source_node_id: str):
         if self._graph.has_node(source_node_id):
@@ -141,26 +311,53 @@ class NetworkXStorage(BaseGraphStorage):
     async def get_nodes_edges_batch(
         self, node_ids: list[str]
     ) -> list[list[tuple[str, str]]]:
-        return await asyncio.gather(*[self.get_node_edges(node_id) for node_id
-        in node_ids])
+        adjacency = self._get_adjacency()
+        rows = adjacency.lookup(node_ids)
+        starts = adjacency.indptr[rows]
+        ends = adjacency.indptr[rows + 1]
+        results = []
+        for node_id, row, start, end in zip(node_ids, rows, starts, ends):
+            if row < 0:
+                results.append(None)
+                continue
+            neighbours = adjacency.node_ids[adjacency.indices[start:end]]
+            results.append([(node_id, n) for n in neighbours])
+        return results
 
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
+        if not self._graph.has_node(node_id):
+            self._adjacency = None
         self._graph.add_node(node_id, **node_data)
 
     async def upsert_nodes_batch(self, nodes_data: list[tuple[str, dict[str, str]]]):
-        await asyncio.gather(*[self.upsert_node(node_id, node_data) for node_id, node_data in nodes_data])
+        for node_id, node_data in nodes_data:
+            await self.upsert_node(node_id, node_data)
 
     async def upsert_edge(
         self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
     ):
+        if not self._graph.has_edge(source_node_id, target_node_id):
+            self._adjacency = None
         self._graph.add_edge(source_node_id, target_node_id, **edge_data)
 
     async def upsert_edges_batch(
         self, edges_data: list[tuple[str, str, dict[str, str]]]
     ):
-        await asyncio.gather(*[self.upsert_edge(source_node_id, target_node_id, edge_data) 
-                for source_node_id, target_node_id, edge_data in edges_data])
-        
+        for source_node_id, target_node_id, edge_data in edges_data:
+            await self.upsert_edge(source_node_id, target_node_id, edge_data)
+
+    def _get_adjacency(self) -> _AdjacencySnapshot:
+        """Return the CSR snapshot, rebuilding it if the graph structure changed.
+        The (O(1)) node count check also catches nodes added or removed directly
+        on `_graph`; set `_adjacency = None` after editing edges that way.
+        """
+        if (
+            self._adjacency is None
+            or len(self._adjacency.node_ids) != self._graph.number_of_nodes()
+        ):
+            self._adjacency = _AdjacencySnapshot(self._graph)
+        return self._adjacency
+
     async def clustering(self, algorithm: str):
         if algorithm not in self._clustering_algorithms:
             raise ValueError(f"Clustering algorithm {algorithm} not supported")
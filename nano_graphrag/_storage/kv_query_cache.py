@@ -0,0 +1,200 @@
+import json
+import re
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Union
+
+import numpy as np
+
+from .._utils import EmbeddingFunc, compute_args_hash, logger
+from ..base import BaseKVStorage, QueryParam
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+@dataclass
+class QueryResultCache:
+    """Cache `GraphRAG.aquery` answers in a KV storage.
+
+    Answers are keyed on the mode, normalized query, the rest of the
+    QueryParam and an index version, so any change to the index makes older
+    answers unreachable; they are dropped the next time the cache sees a new
+    version. With an `embedding_func` and a `similarity_threshold` above 0, a
+    miss falls back to the most similar cached query with the same mode,
+    QueryParam and version. Entries expire after `ttl` seconds and the least
+    recently used ones are evicted beyond `max_entries`.
+
+    Changes are written behind: `index_done_callback` persists them once
+    `flush_every` entries changed or `flush_interval` seconds after the first
+    change, and only the changed entries unless some were removed. `flush`
+    persists them right away.
+    """
+
+    storage: BaseKVStorage
+    embedding_func: EmbeddingFunc = None
+    ttl: float = 24 * 3600
+    max_entries: int = 1024
+    similarity_threshold: float = 0.0
+    flush_every: int = 64
+    flush_interval: float = 30.0
+
+    def __post_init__(self):
+        self._entries: OrderedDict[str, dict] = None
+        self._version = None
+        # keys of the entries changed since the last flush
+        self._changed: set[str] = set()
+        # an entry was removed, the storage is rewritten on the next flush
+        self._removed = False
+        self._first_change_time = None
+        self._miss_embeddings = {}
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def semantic(self) -> bool:
+        return self.embedding_func is not None and self.similarity_threshold > 0
+
+    async def _load(self):
+        if self._entries is not None:
+            return
+        keys = await self.storage.all_keys()
+        values = await self.storage.get_by_ids(keys)
+        entries = [(k, v) for k, v in zip(keys, values) if v is not None]
+        self._entries = OrderedDict(
+            sorted(entries, key=lambda kv: kv[1]["last_used"])
+        )
+
+    async def _sync_version(self, version: str):
+        await self._load()
+        if self._version == version:
+            return
+        self._version = version
+        stale = [k for k, v in self._entries.items() if v["version"] != version]
+        for k in stale:
+            self._entries.pop(k)
+        if stale:
+            self._mark_removed()
+            logger.info(f"Dropped {len(stale)} query cache entries of an older index")
+
+    def _scope(self, param: QueryParam) -> str:
+        return compute_args_hash(json.dumps(asdict(param), sort_keys=True, default=str))
+
+    async def get(
+        self, query: str, param: QueryParam, version: str
+    ) -> Union[str, None]:
+        await self._sync_version(version)
+        scope = self._scope(param)
+        key = compute_args_hash(scope, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._entries.pop(key)
+            self._mark_removed()
+            entry = None
+        if entry is None and self.semantic:
+            entry = await self._get_similar(key, query, scope)
+            if entry is not None:
+                self.stats["semantic_hits"] += 1
+        elif entry is not None:
+            self.stats["hits"] += 1
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        entry["last_used"] = time.time()
+        self._entries.move_to_end(entry["key"])
+        self._mark_changed(entry["key"])
+        return entry["response"]
+
+    async def _get_similar(self, key: str, query: str, scope: str) -> Union[dict, None]:
+        embedding = (await self.embedding_func([query]))[0]
+        self._miss_embeddings[key] = embedding
+        candidates = [
+            v
+            for v in self._entries.values()
+            if v["scope"] == scope
+            and v.get("embedding") is not None
+            and not self._expired(v)
+        ]
+        if not candidates:
+            return None
+        matrix = np.array([c["embedding"] for c in candidates], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(embedding)
+        similarities = matrix @ embedding / np.maximum(norms, 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        logger.info(
+            f"Query cache reused the answer of a query with similarity {similarities[best]:.3f}"
+        )
+        return candidates[best]
+
+    async def upsert(self, query: str, param: QueryParam, version: str, response: str):
+        await self._sync_version(version)
+        scope = self._scope(param)
+        key = compute_args_hash(scope, normalize_query(query))
+        embedding = self._miss_embeddings.pop(key, None)
+        if embedding is None and self.semantic:
+            embedding = (await self.embedding_func([query]))[0]
+        now = time.time()
+        self._entries[key] = {
+            "key": key,
+            "scope": scope,
+            "version": version,
+            "query": query,
+            "response": response,
+            "embedding": None if embedding is None else np.asarray(embedding).tolist(),
+            "created_at": now,
+            "last_used": now,
+        }
+        self._entries.move_to_end(key)
+        self._mark_changed(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+            self._mark_removed()
+
+    async def invalidate(self):
+        await self._load()
+        if self._entries:
+            self._mark_removed()
+        self._entries.clear()
+        self._miss_embeddings.clear()
+
+    async def index_done_callback(self):
+        if self._first_change_time is None:
+            return
+        if (
+            len(self._changed) < self.flush_every
+            and time.monotonic() - self._first_change_time < self.flush_interval
+        ):
+            return
+        await self.flush()
+
+    async def flush(self):
+        if self._first_change_time is None:
+            return
+        if self._removed:
+            await self.storage.drop()
+            await self.storage.upsert(dict(self._entries))
+        else:
+            await self.storage.upsert(
+                {k: self._entries[k] for k in self._changed if k in self._entries}
+            )
+        await self.storage.index_done_callback()
+        self._changed = set()
+        self._removed = False
+        self._first_change_time = None
+
+    def _mark_changed(self, key: str):
+        self._changed.add(key)
+        if self._first_change_time is None:
+            self._first_change_time = time.monotonic()
+
+    def _mark_removed(self):
+        self._removed = True
+        if self._first_change_time is None:
+            self._first_change_time = time.monotonic()
+
+    def _expired(self, entry: dict) -> bool:
+        return time.time() - entry["created_at"] > self.ttl
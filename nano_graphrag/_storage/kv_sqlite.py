@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+
+from .._utils import load_json, logger
+from ..base import (
+    BaseKVStorage,
+)
+
+# SQLite caps the number of host parameters per statement (999 on old builds)
+_SQLITE_MAX_VARIABLES = 900
+
+
+@dataclass
+class SQLiteKVStorage(BaseKVStorage):
+    """KV storage backed by a single SQLite file with a primary-key index.
+
+    The file is opened on first use and values are read on demand, so startup
+    does not depend on the store size. Upserts stay in memory until
+    `index_done_callback`, which writes only the keys changed since the last
+    flush. An existing `kv_store_{namespace}.json` is imported on first open.
+    """
+
+    def __post_init__(self):
+        working_dir = self.global_config["working_dir"]
+        self._file_name = os.path.join(
+            working_dir, f"kv_store_{self.namespace}.sqlite"
+        )
+        self._json_file_name = os.path.join(
+            working_dir, f"kv_store_{self.namespace}.json"
+        )
+        self._mmap_size = self.global_config.get("addon_params", {}).get(
+            "sqlite_kv_mmap_size", 256 * 1024 * 1024
+        )
+        self._conn = None
+        self._dirty = {}
+        self._dropped = False
+        self.last_flush_bytes = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+        is_new_file = not os.path.exists(self._file_name)
+        self._conn = sqlite3.connect(self._file_name, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA mmap_size={int(self._mmap_size)}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        if is_new_file:
+            self._import_json_store()
+        return self._conn
+
+    def _import_json_store(self):
+        data = load_json(self._json_file_name)
+        if not data:
+            return
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+            (
+                (k, json.dumps(v, ensure_ascii=False))
+                for k, v in data.items()
+            ),
+        )
+        self._conn.commit()
+        logger.info(
+            f"Imported {len(data)} entries of KV {self.namespace} from {self._json_file_name}"
+        )
+
+    def _select_in(self, columns: str, ids: list[str]):
+        if self._dropped or not ids:
+            return
+        conn = self._get_conn()
+        for i in range(0, len(ids), _SQLITE_MAX_VARIABLES):
+            batch = ids[i : i + _SQLITE_MAX_VARIABLES]
+            yield from conn.execute(
+                f"SELECT {columns} FROM kv WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+
+    def _fetch(self, ids: list[str]) -> dict[str, dict]:
+        return {k: json.loads(v) for k, v in self._select_in("key, value", ids)}
+
+    def _get_many(self, ids: list[str]) -> dict[str, dict]:
+        missing = list(set(id for id in ids if id not in self._dirty))
+        found = self._fetch(missing)
+        found.update({id: self._dirty[id] for id in ids if id in self._dirty})
+        return found
+
+    async def all_keys(self) -> list[str]:
+        keys = []
+        if not self._dropped:
+            keys = [
+                row[0]
+                for row in self._get_conn().execute("SELECT key FROM kv")
+                if row[0] not in self._dirty
+            ]
+        return keys + list(self._dirty.keys())
+
+    async def index_done_callback(self):
+        if not self._dirty and not self._dropped:
+            return
+        conn = self._get_conn()
+        rows = [
+            (k, json.dumps(v, ensure_ascii=False)) for k, v in self._dirty.items()
+        ]
+        with conn:
+            if self._dropped:
+                conn.execute("DELETE FROM kv")
+            conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", rows)
+        self.last_flush_bytes = sum(len(k) + len(v.encode("utf-8")) for k, v in rows)
+        logger.info(f"Flushed {len(self._dirty)} dirty keys of KV {self.namespace}")
+        self._dirty = {}
+        self._dropped = False
+
+    async def get_by_id(self, id):
+        if id in self._dirty:
+            return self._dirty[id]
+        return self._fetch([id]).get(id, None)
+
+    async def get_by_ids(self, ids, fields=None):
+        found = self._get_many(ids)
+        if fields is None:
+            return [found.get(id, None) for id in ids]
+        return [
+            (
+                {k: v for k, v in found[id].items() if k in fields}
+                if found.get(id, None)
+                else None
+            )
+            for id in ids
+        ]
+
+    async def filter_keys(self, data: list[str]) -> set[str]:
+        unknown = list(set(s for s in data if s not in self._dirty))
+        existing = set(row[0] for row in self._select_in("key", unknown))
+        return set([s for s in data if s not in self._dirty and s not in existing])
+
+    async def upsert(self, data: dict[str, dict]):
+        self._dirty.update(data)
+
+    async def drop(self):
+        self._dirty = {}
+        self._dropped = True
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from .._utils import logger
+from ..base import (
+    BaseKVStorage,
+)
+
+
+@dataclass
+class WriteBehindKVStorage(BaseKVStorage):
+    """Coalesce upserts to another KV storage and persist them in batches.
+
+    Reads and writes go to the wrapped storage immediately, but its
+    `index_done_callback` (the expensive part for JSON stores) only runs once
+    `flush_every` upserts are pending, `flush_interval` seconds after the first
+    pending upsert, or when `index_done_callback`/`flush` is called on the
+    wrapper, e.g. at the end of an insert or query.
+    """
+
+    storage: BaseKVStorage = None
+    flush_every: int = 64
+    flush_interval: float = 30.0
+    stats: dict = field(
+        default_factory=lambda: {
+            "flushes": 0,
+            "bytes_written": 0,
+            "upserts": 0,
+            "pending_upserts": 0,
+        }
+    )
+
+    def __post_init__(self):
+        if self.storage is None:
+            raise ValueError("WriteBehindKVStorage needs a storage to wrap")
+        self._first_pending_time = None
+        self._timer_handle = None
+        self._timer_task = None
+
+    async def all_keys(self) -> list[str]:
+        return await self.storage.all_keys()
+
+    async def get_by_id(self, id):
+        return await self.storage.get_by_id(id)
+
+    async def get_by_ids(self, ids, fields=None):
+        return await self.storage.get_by_ids(ids, fields)
+
+    async def filter_keys(self, data: list[str]) -> set[str]:
+        return await self.storage.filter_keys(data)
+
+    async def upsert(self, data: dict[str, dict]):
+        await self.storage.upsert(data)
+        self.stats["upserts"] += 1
+        self.stats["pending_upserts"] += 1
+        if self._first_pending_time is None:
+            self._first_pending_time = time.monotonic()
+            self._schedule_timer()
+        if self.stats["pending_upserts"] >= self.flush_every:
+            await self.flush()
+
+    async def drop(self):
+        await self.storage.drop()
+        self.stats["pending_upserts"] += 1
+
+    async def index_done_callback(self):
+        await self.flush()
+
+    async def flush(self):
+        self._cancel_timer()
+        if not self.stats["pending_upserts"]:
+            return
+        pending = self.stats["pending_upserts"]
+        self.stats["pending_upserts"] = 0
+        self._first_pending_time = None
+        await self.storage.index_done_callback()
+        self.stats["flushes"] += 1
+        self.stats["bytes_written"] += getattr(self.storage, "last_flush_bytes", 0)
+        logger.debug(
+            f"Flushed {pending} pending upserts of KV {self.namespace}, {self.stats}"
+        )
+
+    def _schedule_timer(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timer_handle = loop.call_later(self.flush_interval, self._on_timer)
+
+    def _on_timer(self):
+        self._timer_handle = None
+        self._timer_task = asyncio.ensure_future(self.flush())
+
+    def _cancel_timer(self):
+        if self._timer_handle is not None:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+
@@ -109,10 +109,51 @@ class HNSWVectorStorage(BaseVectorStorage):
         self._current_elements = self._index.get_current_count()
         return ids
 
-    async def query(self, query: str, top_k: int = 5) -> list[dict]:
+    async def delete(self, ids: list[str]):
+        """hnswlib only marks deletions, and an id re-added after it was marked
+        can't be reached anymore, so the index is rebuilt from the kept vectors.
+        """
+        deleted = {xxhash.xxh32_intdigest(i.encode()) for i in ids} & set(
+            self._metadata
+        )
+        if not deleted:
+            return
+        for id_int in deleted:
+            self._metadata.pop(id_int)
+        kept_ids = np.fromiter(
+            self._metadata, dtype=np.uint32, count=len(self._metadata)
+        )
+        kept_embeddings = self._index.get_items(kept_ids) if len(kept_ids) else None
+        self._index = hnswlib.Index(
+            space="cosine", dim=self.embedding_func.embedding_dim
+        )
+        self._index.init_index(
+            max_elements=self.max_elements,
+            ef_construction=self.ef_construction,
+            M=self.M,
+        )
+        self._index.set_ef(self.ef_search)
+        if len(kept_ids):
+            self._index.add_items(
+                data=kept_embeddings, ids=kept_ids, num_threads=self.num_threads
+            )
+        self._current_elements = self._index.get_current_count()
+
+    async def query(
+        self, query: str, top_k: int = 5, ids: list[str] = None
+    ) -> list[dict]:
         if self._current_elements == 0:
             return []
 
+        id_filter = None
+        if ids is not None:
+            labels = {xxhash.xxh32_intdigest(i.encode()) for i in ids} & set(
+                self._metadata
+            )
+            if not labels:
+                return []
+            top_k = min(top_k, len(labels))
+            id_filter = labels.__contains__
         top_k = min(top_k, self._current_elements)
 
         if top_k > self.ef_search:
@@ -123,7 +164,7 @@ class HNSWVectorStorage(BaseVectorStorage):
 
         embedding = await self.embedding_func([query])
         labels, distances = self._index.knn_query(
-            data=embedding[0], k=top_k, num_threads=self.num_threads
+            data=embedding[0], k=top_k, num_threads=self.num_threads, filter=id_filter
         )
 
         return [
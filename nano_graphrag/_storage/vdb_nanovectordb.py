@@ -51,18 +51,23 @@ class NanoVectorDBStorage(BaseVectorStorage):
         results = self._client.upsert(datas=list_data)
         return results
 
-    async def query(self, query: str, top_k=5):
+    async def query(self, query: str, top_k=5, ids: list[str] = None):
         embedding = await self.embedding_func([query])
         embedding = embedding[0]
+        id_set = None if ids is None else set(ids)
         results = self._client.query(
             query=embedding,
             top_k=top_k,
             better_than_threshold=self.cosine_better_than_threshold,
+            filter_lambda=None if id_set is None else lambda dp: dp["__id__"] in id_set,
         )
         results = [
             {**dp, "id": dp["__id__"], "distance": dp["__metrics__"]} for dp in results
         ]
         return results
 
+    async def delete(self, ids: list[str]):
+        self._client.delete(ids)
+
     async def index_done_callback(self):
         self._client.save()
@@ -1,14 +1,20 @@
 import asyncio
+import heapq
 import html
+import itertools
 import json
 import logging
 import os
 import re
 import numbers
-from dataclasses import dataclass
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from functools import wraps
 from hashlib import md5
-from typing import Any, Union
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Iterable, Optional, Union
 
 import numpy as np
 import tiktoken
@@ -126,15 +132,70 @@ def decode_tokens_by_tiktoken(tokens: list[int], model_name: str = "gpt-4o"):
     return content
 
 
-def truncate_list_by_token_size(list_data: list, key: callable, max_token_size: int):
-    """Truncate a list of data by token size"""
+TOKEN_COUNT_CACHE_SIZE = 32768
+# longer contents (prompts, whole reports) are counted every time, not kept as keys
+TOKEN_COUNT_CACHE_MAX_CHARS = 2048
+_TOKEN_COUNT_CACHE: "OrderedDict[str, int]" = OrderedDict()
+
+
+def count_tokens_batch_by_tiktoken(
+    contents: list[str], model_name: str = "gpt-4o", cache: bool = True
+) -> list[int]:
+    """Token lengths of `contents`, served from an LRU cache when possible.
+    Cache misses are encoded together with `encode_batch`. Only contents up to
+    `TOKEN_COUNT_CACHE_MAX_CHARS` long are cached, none with `cache=False`.
+    """
+    global ENCODER
+    counts = [_TOKEN_COUNT_CACHE.get(c) if cache else None for c in contents]
+    missing = list(set(c for c, n in zip(contents, counts) if n is None))
+    counted = {}
+    if missing:
+        if ENCODER is None:
+            ENCODER = tiktoken.encoding_for_model(model_name)
+        for content, tokens in zip(missing, ENCODER.encode_batch(missing)):
+            counted[content] = len(tokens)
+            if cache and len(content) <= TOKEN_COUNT_CACHE_MAX_CHARS:
+                _TOKEN_COUNT_CACHE[content] = len(tokens)
+    for c in contents:
+        if c in _TOKEN_COUNT_CACHE:
+            _TOKEN_COUNT_CACHE.move_to_end(c)
+    # a batch may hold more new contents than the cache, keep the answers in `counted`
+    for _ in range(len(_TOKEN_COUNT_CACHE) - TOKEN_COUNT_CACHE_SIZE):
+        _TOKEN_COUNT_CACHE.popitem(last=False)
+    return [n if n is not None else counted[c] for c, n in zip(contents, counts)]
+
+
+def count_tokens_by_tiktoken(content: str, model_name: str = "gpt-4o") -> int:
+    return count_tokens_batch_by_tiktoken([content], model_name=model_name)[0]
+
+
+def truncate_list_by_token_size(
+    list_data: list,
+    key: callable,
+    max_token_size: int,
+    token_key: callable = None,
+    batch_size: int = 32,
+):
+    """Truncate a list of data by token size.
+    `token_key` may return a precomputed token length for an item (or None),
+    items without one are counted `batch_size` at a time.
+    """
     if max_token_size <= 0:
         return []
     tokens = 0
-    for i, data in enumerate(list_data):
-        tokens += len(encode_string_by_tiktoken(key(data)))
-        if tokens > max_token_size:
-            return list_data[:i]
+    for start in range(0, len(list_data), batch_size):
+        window = list_data[start : start + batch_size]
+        lengths = [token_key(data) if token_key is not None else None for data in window]
+        unknown = [i for i, n in enumerate(lengths) if n is None]
+        if unknown:
+            counted = count_tokens_batch_by_tiktoken([key(window[i]) for i in unknown])
+            for i, n in zip(unknown, counted):
+                lengths[i] = n
+        prefix_tokens = tokens + np.cumsum(lengths)
+        over = int(np.searchsorted(prefix_tokens, max_token_size, side="right"))
+        if over < len(window):
+            return list_data[: start + over]
+        tokens = int(prefix_tokens[-1])
     return list_data
 
 
@@ -142,9 +203,18 @@ def compute_mdhash_id(content, prefix: str = ""):
     return prefix + md5(content.encode()).hexdigest()
 
 
-def write_json(json_obj, file_name):
-    with open(file_name, "w", encoding="utf-8") as f:
-        json.dump(json_obj, f, indent=2, ensure_ascii=False)
+def write_json(json_obj, file_name) -> int:
+    """Atomically replace `file_name` with the JSON dump, return bytes written.
+    A crash mid-write leaves the previous file intact instead of a torn one.
+    """
+    content = json.dumps(json_obj, indent=2, ensure_ascii=False).encode("utf-8")
+    tmp_file_name = f"{file_name}.tmp"
+    with open(tmp_file_name, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file_name, file_name)
+    return len(content)
 
 
 def load_json(file_name):
@@ -167,8 +237,11 @@ def pack_user_ass_to_openai_messages(prompt: str, generated_content: str, using_
         ]
 
 
+_FLOAT_PATTERN = re.compile(r"^[-+]?[0-9]*\.?[0-9]+$")
+
+
 def is_float_regex(value):
-    return bool(re.match(r"^[-+]?[0-9]*\.?[0-9]+$", value))
+    return bool(_FLOAT_PATTERN.match(value))
 
 
 def compute_args_hash(*args):
@@ -201,13 +274,16 @@ def list_of_list_to_csv(data: list[list]):
     )
 
 
+_CONTROL_CHARS = re.compile(r"[\x00-\x1f\x7f-\x9f]")
+
+
 def clean_str(input: Any) -> str:
     """Clean an input string by removing HTML escapes, control characters, and other unwanted characters."""
     if not isinstance(input, str):
         return input
 
     result = html.unescape(input.strip())
-    return re.sub(r"[\x00-\x1f\x7f-\x9f]", "", result)
+    return _CONTROL_CHARS.sub("", result)
 
 
 @dataclass
@@ -220,28 +296,405 @@ class EmbeddingFunc:
         return await self.func(*args, **kwargs)
 
 
-def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
-    """Add restriction of maximum async calling times for a async func"""
+def _is_rate_limit_error(e: BaseException) -> bool:
+    # tenacity.RetryError keeps the error of the last attempt
+    last_attempt = getattr(e, "last_attempt", None)
+    if last_attempt is not None and last_attempt.failed:
+        e = last_attempt.exception()
+    name = type(e).__name__
+    return (
+        getattr(e, "status_code", None) == 429
+        or "RateLimit" in name
+        or "Throttling" in name
+        or "ThrottlingException" in str(e)
+    )
 
-    def final_decro(func):
-        """Not using async.Semaphore to aovid use nest-asyncio"""
-        __current_size = 0
 
+def count_llm_call_tokens(prompt, system_prompt=None, history_messages=[], **kwargs):
+    """Prompt tokens of a `*_complete` call, for tokens-per-minute budgeting"""
+    contents = [prompt, system_prompt or ""] + [
+        m["content"] for m in history_messages if isinstance(m.get("content"), str)
+    ]
+    return sum(count_tokens_batch_by_tiktoken(contents, cache=False))
+
+
+def count_embedding_call_tokens(texts, *args, **kwargs):
+    return sum(count_tokens_batch_by_tiktoken(list(texts), cache=False))
+
+
+# lower is served first; calls made outside `llm_priority` are "default"
+LLM_PRIORITY_CLASSES = {
+    "query": 0,
+    "community_report": 1,
+    "default": 2,
+    "extraction": 2,
+    "summarization": 3,
+}
+_llm_priority: ContextVar[tuple[str, Optional[float]]] = ContextVar(
+    "_llm_priority", default=("default", None)
+)
+
+
+@contextmanager
+def llm_priority(priority_class: str, deadline: Optional[float] = None):
+    """Schedule the limited calls made inside the block as `priority_class`.
+    `deadline` is in seconds from now; the enclosing deadline is kept if None.
+    """
+    if priority_class not in LLM_PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class {priority_class!r}")
+    _, outer_deadline = _llm_priority.get()
+    token = _llm_priority.set(
+        (
+            priority_class,
+            outer_deadline if deadline is None else time.monotonic() + deadline,
+        )
+    )
+    try:
+        yield
+    finally:
+        _llm_priority.reset(token)
+
+
+@dataclass
+class _TokenReservation:
+    limiter: "AsyncLimiter"
+    tokens: int
+    # "pending" until the model function reserves or skips it
+    state: str = "pending"
+
+
+_call_token_reservation: ContextVar[Optional[_TokenReservation]] = ContextVar(
+    "_call_token_reservation", default=None
+)
+
+
+async def reserve_call_tokens():
+    """Called by a model function after its response cache missed, right
+    before calling the model: waits for the tokens-per-minute reservation of
+    the `AsyncLimiter` call it runs in, if that limiter has
+    `reserve_on_cache_miss` set.
+    """
+    reservation = _call_token_reservation.get()
+    if reservation is not None and reservation.state == "pending":
+        reservation.state = "reserved"
+        await reservation.limiter._reserve_tokens(reservation.tokens)
+
+
+def skip_call_tokens():
+    """Called when a model call is answered without calling the model (a
+    cache hit, or a request deferred to a batch): it reserves no tokens.
+    """
+    reservation = _call_token_reservation.get()
+    if reservation is not None and reservation.state == "pending":
+        reservation.state = "skipped"
+
+
+def _is_deferred_call(e: BaseException) -> bool:
+    # `_batch.BatchPending`, not imported since `_batch` imports this module
+    return type(e).__name__ == "BatchPending"
+
+
+@dataclass
+class AsyncLimiter:
+    """Bound the concurrency of async calls, serving waiters by priority.
+
+    Waiters are queued per `llm_priority` class. A freed slot goes to the
+    head of the class with the lowest rank in `LLM_PRIORITY_CLASSES`, where a
+    head loses one rank per `aging_interval` seconds of waiting (so bulk work
+    is never starved) and a head past its deadline goes first. Within a class,
+    waiters with a deadline are served earliest deadline first, then FIFO.
+    `class_limits` caps the slots a class may hold at once, which keeps room
+    for interactive calls during bulk indexing.
+
+    A slot is handed directly to the chosen waiter when released, so nothing
+    polls, and it is always released even if the call raises or is cancelled.
+    With `adaptive=True` the limit follows AIMD: it halves (down to
+    `min_concurrency`) when a call is rate limited or slower than
+    `latency_target`, and grows by one after a limit's worth of fast successes,
+    up to `max_concurrency`. With `tokens_per_minute` set, calls also reserve
+    `token_counter(*args, **kwargs)` tokens from a budget refilled
+    continuously, and wait until the reservation is covered. With
+    `reserve_on_cache_miss`, the reservation waits for the model function to
+    call `reserve_call_tokens` on a cache miss, so cache hits and calls deferred
+    to a batch take no budget; a function that never calls it is charged
+    after it returns.
+    """
+
+    max_concurrency: int
+    min_concurrency: int = 1
+    adaptive: bool = False
+    latency_target: float = 0.0
+    backoff_factor: float = 0.5
+    decrease_cooldown: float = 5.0
+    tokens_per_minute: int = 0
+    token_counter: Callable[..., int] = None
+    reserve_on_cache_miss: bool = False
+    class_limits: dict[str, int] = field(default_factory=dict)
+    aging_interval: float = 30.0
+
+    def __post_init__(self):
+        if self.max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be positive, got {self.max_concurrency}")
+        self.min_concurrency = max(1, min(self.min_concurrency, self.max_concurrency))
+        self.limit = self.max_concurrency
+        self._active = 0
+        self._active_by_class = Counter()
+        # class -> heap of (deadline, seq, enqueued_at, future)
+        self._queues: dict[str, list] = {}
+        self._queued = 0
+        self._seq = itertools.count()
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._token_balance = float(self.tokens_per_minute)
+        self._token_refill_time = time.monotonic()
+        self._stats = {
+            "calls": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "max_queue_depth": 0,
+            "total_wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "token_wait_time": 0.0,
+            "tokens_reserved": 0,
+            "wait_time_by_class": Counter(),
+            "max_wait_time_by_class": {},
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    @property
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "limit": self.limit,
+            "active": self._active,
+            "queue_depth": self.queue_depth,
+        }
+
+    def _under_class_limit(self, priority_class: str) -> bool:
+        class_limit = self.class_limits.get(priority_class)
+        return class_limit is None or self._active_by_class[priority_class] < class_limit
+
+    def _grant(self, priority_class: str):
+        self._active += 1
+        self._active_by_class[priority_class] += 1
+
+    async def acquire(self) -> str:
+        """Wait for a slot; returns the priority class to `release` it with"""
+        priority_class, deadline = _llm_priority.get()
+        start = time.monotonic()
+        if (
+            self._active < self.limit
+            and not self._queued
+            and self._under_class_limit(priority_class)
+        ):
+            self._grant(priority_class)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self._queues.setdefault(priority_class, []),
+                (
+                    float("inf") if deadline is None else deadline,
+                    next(self._seq),
+                    start,
+                    waiter,
+                ),
+            )
+            self._queued += 1
+            self._stats["max_queue_depth"] = max(
+                self._stats["max_queue_depth"], self._queued
+            )
+            self._wake()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # the slot was handed over just before the cancellation
+                    self.release(priority_class)
+                else:
+                    # left in its heap, skipped when it reaches the head
+                    waiter.cancel()
+                    self._queued -= 1
+                raise
+        waited = time.monotonic() - start
+        self._stats["total_wait_time"] += waited
+        self._stats["max_wait_time"] = max(self._stats["max_wait_time"], waited)
+        self._stats["wait_time_by_class"][priority_class] += waited
+        self._stats["max_wait_time_by_class"][priority_class] = max(
+            self._stats["max_wait_time_by_class"].get(priority_class, 0.0), waited
+        )
+        return priority_class
+
+    def release(self, priority_class: str = "default"):
+        self._active -= 1
+        self._active_by_class[priority_class] -= 1
+        self._wake()
+
+    def _next_waiter(self) -> Union[tuple[str, list], None]:
+        now = time.monotonic()
+        best, best_key = None, None
+        for priority_class, queue in self._queues.items():
+            while queue and queue[0][3].done():
+                heapq.heappop(queue)
+            if not queue or not self._under_class_limit(priority_class):
+                continue
+            deadline, seq, enqueued_at, _ = queue[0]
+            rank = LLM_PRIORITY_CLASSES.get(priority_class, LLM_PRIORITY_CLASSES["default"])
+            if deadline <= now:
+                rank = float("-inf")
+            elif self.aging_interval:
+                rank -= (now - enqueued_at) / self.aging_interval
+            key = (rank, seq)
+            if best_key is None or key < best_key:
+                best, best_key = (priority_class, queue), key
+        return best
+
+    def _wake(self):
+        while self._queued and self._active < self.limit:
+            chosen = self._next_waiter()
+            if chosen is None:
+                # everything queued belongs to classes at their cap
+                return
+            priority_class, queue = chosen
+            waiter = heapq.heappop(queue)[3]
+            self._queued -= 1
+            self._grant(priority_class)
+            waiter.set_result(None)
+
+    async def _reserve_tokens(self, tokens: int):
+        if not self.tokens_per_minute or tokens <= 0:
+            return
+        self._charge_tokens(tokens)
+        if self._token_balance < 0:
+            delay = -self._token_balance / (self.tokens_per_minute / 60)
+            self._stats["token_wait_time"] += delay
+            await asyncio.sleep(delay)
+
+    def _charge_tokens(self, tokens: int):
+        rate = self.tokens_per_minute / 60
+        now = time.monotonic()
+        self._token_balance = min(
+            self.tokens_per_minute,
+            self._token_balance + (now - self._token_refill_time) * rate,
+        )
+        self._token_refill_time = now
+        # reservations may overdraw the budget; later callers wait for the debt
+        self._token_balance -= tokens
+        self._stats["tokens_reserved"] += tokens
+
+    def _on_success(self, latency: float):
+        if not self.adaptive:
+            return
+        if self.latency_target and latency > self.latency_target:
+            self._decrease(f"latency {latency:.2f}s")
+            return
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_concurrency:
+            self._successes = 0
+            self.limit += 1
+            self._wake()
+
+    def _on_rate_limited(self):
+        self._stats["rate_limited"] += 1
+        if self.adaptive:
+            self._decrease("rate limited")
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        self._successes = 0
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        new_limit = max(self.min_concurrency, int(self.limit * self.backoff_factor))
+        if new_limit < self.limit:
+            logger.info(f"Concurrency limit {self.limit} -> {new_limit}, {reason}")
+            self.limit = new_limit
+
+    async def call(self, func, *args, **kwargs):
+        tokens = (
+            self.token_counter(*args, **kwargs)
+            if self.tokens_per_minute and self.token_counter is not None
+            else 0
+        )
+        priority_class = await self.acquire()
+        try:
+            reservation = None
+            if self.reserve_on_cache_miss and tokens > 0:
+                reservation = _TokenReservation(self, tokens)
+            else:
+                await self._reserve_tokens(tokens)
+            self._stats["calls"] += 1
+            start = time.monotonic()
+            context_token = _call_token_reservation.set(reservation)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if _is_deferred_call(e):
+                    raise
+                self._stats["errors"] += 1
+                if _is_rate_limit_error(e):
+                    self._on_rate_limited()
+                raise
+            finally:
+                _call_token_reservation.reset(context_token)
+                if reservation is not None and reservation.state == "pending":
+                    self._charge_tokens(tokens)
+            self._on_success(time.monotonic() - start)
+            return result
+        finally:
+            self.release(priority_class)
+
+    def __call__(self, func):
         @wraps(func)
         async def wait_func(*args, **kwargs):
-            nonlocal __current_size
-            while __current_size >= max_size:
-                await asyncio.sleep(waitting_time)
-            __current_size += 1
-            result = await func(*args, **kwargs)
-            __current_size -= 1
-            return result
+            return await self.call(func, *args, **kwargs)
 
+        wait_func.limiter = self
         return wait_func
 
+
+def limit_async_func_call(
+    max_size: int, waitting_time: float = 0.0001, limiter: AsyncLimiter = None
+):
+    """Add restriction of maximum async calling times for a async func.
+    `waitting_time` is unused since waiters no longer poll, kept for callers.
+    The returned function exposes its `AsyncLimiter` as `.limiter`.
+    """
+
+    def final_decro(func):
+        return (limiter or AsyncLimiter(max_concurrency=max_size))(func)
+
     return final_decro
 
 
+async def iterate_in_windows(
+    items: Union[Iterable, AsyncIterable], window: int
+) -> AsyncIterator[list]:
+    """Yield lists of at most `window` items from a sync or async iterable.
+    The source is only pulled when the consumer asks for the next window, so a
+    slow consumer naturally applies backpressure to the producer.
+    """
+    if window <= 0:
+        raise ValueError(f"window must be positive, got {window}")
+    buffer = []
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            buffer.append(item)
+            if len(buffer) >= window:
+                yield buffer
+                buffer = []
+    else:
+        for item in items:
+            buffer.append(item)
+            if len(buffer) >= window:
+                yield buffer
+                buffer = []
+    if buffer:
+        yield buffer
+
+
 def wrap_embedding_func_with_attrs(**kwargs):
     """Wrap a function with attributes"""
 
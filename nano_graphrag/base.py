@@ -21,6 +21,10 @@ class QueryParam:
     global_min_community_rating: float = 0
     global_max_consider_community: float = 512
     global_max_token_for_community_report: int = 16384
+    # keep only the N communities closest to the query before the map stage, 0 to disable
+    global_max_semantic_communities: int = 0
+    # share of the pruning score given to the report rating instead of similarity
+    global_semantic_rating_weight: float = 0.2
     global_special_community_map_llm_kwargs: dict = field(
         default_factory=lambda: {"response_format": {"type": "json_object"}}
     )
@@ -50,6 +54,16 @@ class CommunitySchema(SingleCommunitySchema):
     report_json: dict
 
 
+CommunityLevelIndexSchema = TypedDict(
+    "CommunityLevelIndexSchema",
+    {
+        "level": int,
+        # {id, title, occurrence, rating, sub_communities}, best first
+        "communities": list[dict],
+    },
+)
+
+
 T = TypeVar("T")
 
 
@@ -76,7 +90,8 @@ class BaseVectorStorage(StorageNameSpace):
     embedding_func: EmbeddingFunc
     meta_fields: set = field(default_factory=set)
 
-    async def query(self, query: str, top_k: int) -> list[dict]:
+    async def query(self, query: str, top_k: int, ids: list[str] = None) -> list[dict]:
+        """The `top_k` closest entries, only among `ids` if given"""
         raise NotImplementedError
 
     async def upsert(self, data: dict[str, dict]):
@@ -85,6 +100,9 @@ class BaseVectorStorage(StorageNameSpace):
         """
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
 
 @dataclass
 class BaseKVStorage(Generic[T], StorageNameSpace):
@@ -2,23 +2,53 @@ import asyncio
 import os
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
-from functools import partial
-from typing import Callable, Dict, List, Optional, Type, Union, cast
+from functools import partial, wraps
+from typing import (
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Type,
+    Union,
+    cast,
+)
 
 import tiktoken
 
 
 from ._llm import (
     amazon_bedrock_embedding,
+    close_async_clients,
     create_amazon_bedrock_complete_function,
     gpt_4o_complete,
     gpt_4o_mini_complete,
     openai_embedding,
     azure_gpt_4o_complete,
     deepseek_v3_complete,
+    get_llm_provider,
     azure_openai_embedding,
     azure_gpt_4o_mini_complete,
 )
+from ._batch import (
+    BaseBatchBackend,
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+    clear_batch_state,
+    collect_batch_requests,
+    run_batch,
+)
+from ._checkpoint import IngestCheckpoint
+from ._gleaning import AdaptiveGleaning
+from ._instrument import (
+    RunStats,
+    instrument_embedding_func,
+    instrument_model_func,
+    span,
+    track_run,
+)
 from ._op import (
     chunking_by_token_size,
     extract_entities,
@@ -27,18 +57,26 @@ from ._op import (
     local_query,
     global_query,
     naive_query,
+    rebuild_community_index,
 )
 from ._storage import (
     JsonKVStorage,
     NanoVectorDBStorage,
     NetworkXStorage,
+    QueryResultCache,
+    WriteBehindKVStorage,
 )
 from ._utils import (
+    AsyncLimiter,
     EmbeddingFunc,
+    compute_args_hash,
     compute_mdhash_id,
-    limit_async_func_call,
+    count_embedding_call_tokens,
+    count_llm_call_tokens,
     convert_response_to_json,
     always_get_an_event_loop,
+    iterate_in_windows,
+    llm_priority,
     logger,
 )
 from .base import (
@@ -50,6 +88,23 @@ from .base import (
 )
 
 
+def _tracked_run(kind: str):
+    """Collect a RunStats for every call of the decorated GraphRAG method"""
+
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(self: "GraphRAG", *args, **kwargs):
+            callbacks = [self._set_last_stats]
+            if self.stats_callback is not None:
+                callbacks.append(lambda stats: self.stats_callback(stats.to_dict()))
+            async with track_run(kind, callbacks, self.stats_jsonl_path):
+                return await method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 @dataclass
 class GraphRAG:
     working_dir: str = field(
@@ -73,11 +128,31 @@ class GraphRAG:
     tiktoken_model_name: str = "gpt-4o"
 
     entity_extract_max_gleaning: int = 1
+    # stream extraction completions and parse records as they arrive; the model
+    # function must accept a `stream_handler` (openai, azure and fake providers)
+    enable_llm_streaming: bool = False
+    # decide the gleaning rounds of every chunk from a yield curve learned on the
+    # corpus (up to adaptive_gleaning_max_rounds) instead of asking the LLM
+    enable_adaptive_gleaning: bool = False
+    adaptive_gleaning_max_rounds: int = 2
+    adaptive_gleaning_min_expected_records: float = 1.0
+    # share of chunks that run every round, to keep learning and measure losses
+    adaptive_gleaning_sample_rate: float = 0.1
     entity_summary_to_max_tokens: int = 500
+    # descriptions summarized per cheap model call, 1 for one call each
+    entity_summary_batch_size: int = 10
+    # new description tokens to collect before re-summarizing a summarized node or edge
+    entity_summary_delta_max_tokens: int = 250
+    # nodes/edges per upsert_*_batch call when merging extracted entities
+    graph_upsert_batch_size: int = 1000
 
     graph_cluster_algorithm: str = "leiden"
     max_graph_cluster_size: int = 10
     graph_cluster_seed: int = 0xDEADBEEF
+    # only regenerate reports for communities whose membership changed
+    enable_incremental_community_report: bool = False
+    # embed report summaries so global queries can prune communities by similarity
+    enable_community_report_vdb: bool = False
 
     node_embedding_algorithm: str = "node2vec"
     node2vec_params: dict = field(
@@ -99,8 +174,14 @@ class GraphRAG:
     embedding_func: EmbeddingFunc = field(default_factory=lambda: openai_embedding)
     embedding_batch_num: int = 32
     embedding_func_max_async: int = 16
+    # tokens-per-minute budget of the embedding calls, 0 for unlimited
+    embedding_max_tokens_per_minute: int = 0
     query_better_than_threshold: float = 0.2
 
+    # a registered provider ("openai", "deepseek", "azure", "bedrock", "fake", ...)
+    # overriding best_model_func, cheap_model_func and embedding_func
+    llm_provider: Optional[str] = None
+    llm_provider_kwargs: dict = field(default_factory=dict)
     using_azure_openai: bool = False
     using_amazon_bedrock: bool = False
     best_model_id: str = "us.anthropic.claude-3-sonnet-20240229-v1:0"
@@ -111,6 +192,25 @@ class GraphRAG:
     cheap_model_func: callable = deepseek_v3_complete
     cheap_model_max_token_size: int = 32768
     cheap_model_max_async: int = 16
+    best_model_max_tokens_per_minute: int = 0
+    cheap_model_max_tokens_per_minute: int = 0
+    # halve the concurrency of model/embedding calls when rate limited or slower
+    # than llm_latency_target seconds (0 to ignore latency), grow it back on success
+    enable_adaptive_concurrency: bool = False
+    llm_latency_target: float = 0.0
+    # queued model/embedding calls are served query > community_report >
+    # extraction > summarization; a waiter gains one class per aging interval.
+    # Caps are per class, e.g. {"extraction": 12} keeps 4 of 16 slots for the rest
+    llm_priority_class_limits: dict = field(default_factory=dict)
+    llm_priority_aging_interval: float = 30.0
+    # seconds after which a query's queued calls jump ahead of all others, 0 for none
+    query_llm_deadline: float = 0.0
+    # index offline through a provider batch API: the uncached extraction and
+    # community report calls of a round are sent as one batch and awaited, then
+    # the stage resumes from the LLM cache. Needs the openai or fake provider
+    enable_batch_mode: bool = False
+    # defaults to OpenAIBatchBackend, or LocalBatchBackend with the fake provider
+    batch_backend: Optional[BaseBatchBackend] = None
 
     entity_extraction_func: callable = extract_entities
 
@@ -119,6 +219,26 @@ class GraphRAG:
     vector_db_storage_cls_kwargs: dict = field(default_factory=dict)
     graph_storage_cls: Type[BaseGraphStorage] = NetworkXStorage
     enable_llm_cache: bool = True
+    # keep the parsed extraction of every chunk, keyed on chunk id and prompt version
+    enable_extraction_cache: bool = True
+    # the llm and query caches are persisted every N changes, or N seconds after a write
+    llm_cache_flush_every: int = 64
+    llm_cache_flush_interval: float = 30.0
+    # cache aquery answers until the index changes
+    enable_query_cache: bool = False
+    query_cache_ttl: float = 24 * 3600
+    query_cache_max_entries: int = 1024
+    # also reuse the answer of a paraphrased query above this similarity, 0 to disable
+    query_cache_similarity_threshold: float = 0.0
+    # persist each insert stage (merge, clustering, every report level) and note it
+    # in ingest_checkpoint.json, so a rerun after a crash skips the finished ones;
+    # costs extra flushes of the storages during every insert
+    enable_insert_checkpoint: bool = False
+
+    # after every insert/query, RunStats.to_dict() goes to the callback and/or
+    # is appended to the JSONL file; the latest RunStats is kept in last_stats
+    stats_callback: Optional[Callable[[dict], None]] = None
+    stats_jsonl_path: Optional[str] = None
 
     always_create_working_dir: bool = True
     addon_params: dict = field(default_factory=dict)
@@ -147,6 +267,36 @@ class GraphRAG:
                 "Switched the default openai funcs to Amazon Bedrock"
             )
 
+        if self.llm_provider is not None:
+            if self.llm_provider == "bedrock":
+                # gleaning histories are packed in the Bedrock message format
+                self.using_amazon_bedrock = True
+            provider = get_llm_provider(
+                self.llm_provider, asdict(self), **self.llm_provider_kwargs
+            )
+            self.best_model_func = provider.best_model_func
+            self.cheap_model_func = provider.cheap_model_func
+            self.embedding_func = provider.embedding_func
+            logger.info(f"Using the model and embedding funcs of provider {self.llm_provider}")
+
+        if self.enable_llm_streaming and self.using_amazon_bedrock:
+            logger.warning(
+                "enable_llm_streaming has no effect with Amazon Bedrock, "
+                "extraction records are parsed once each call returns"
+            )
+
+        if self.enable_batch_mode:
+            if not self.enable_llm_cache:
+                raise ValueError(
+                    "enable_batch_mode needs enable_llm_cache, batch results are read from it"
+                )
+            if self.batch_backend is None:
+                self.batch_backend = (
+                    LocalBatchBackend(complete_func=self.best_model_func)
+                    if self.llm_provider == "fake"
+                    else OpenAIBatchBackend()
+                )
+
         if not os.path.exists(self.working_dir) and self.always_create_working_dir:
             logger.info(f"Creating working directory {self.working_dir}")
             os.makedirs(self.working_dir)
@@ -160,23 +310,93 @@ class GraphRAG:
         )
 
         self.llm_response_cache = (
-            self.key_string_value_json_storage_cls(
-                namespace="llm_response_cache", global_config=asdict(self)
+            WriteBehindKVStorage(
+                namespace="llm_response_cache",
+                global_config=asdict(self),
+                storage=self.key_string_value_json_storage_cls(
+                    namespace="llm_response_cache", global_config=asdict(self)
+                ),
+                flush_every=self.llm_cache_flush_every,
+                flush_interval=self.llm_cache_flush_interval,
             )
             if self.enable_llm_cache
             else None
         )
 
+        self.extraction_cache = (
+            WriteBehindKVStorage(
+                namespace="extraction_cache",
+                global_config=asdict(self),
+                storage=self.key_string_value_json_storage_cls(
+                    namespace="extraction_cache", global_config=asdict(self)
+                ),
+                flush_every=self.llm_cache_flush_every,
+                flush_interval=self.llm_cache_flush_interval,
+            )
+            if self.enable_extraction_cache
+            else None
+        )
+
+        self.gleaning_policy = (
+            AdaptiveGleaning(
+                storage=self.key_string_value_json_storage_cls(
+                    namespace="gleaning_policy", global_config=asdict(self)
+                ),
+                max_rounds=self.adaptive_gleaning_max_rounds,
+                min_expected_records=self.adaptive_gleaning_min_expected_records,
+                sample_rate=self.adaptive_gleaning_sample_rate,
+            )
+            if self.enable_adaptive_gleaning
+            else None
+        )
+
+        self.query_cache = (
+            QueryResultCache(
+                storage=self.key_string_value_json_storage_cls(
+                    namespace="query_cache", global_config=asdict(self)
+                ),
+                ttl=self.query_cache_ttl,
+                max_entries=self.query_cache_max_entries,
+                similarity_threshold=self.query_cache_similarity_threshold,
+                flush_every=self.llm_cache_flush_every,
+                flush_interval=self.llm_cache_flush_interval,
+            )
+            if self.enable_query_cache
+            else None
+        )
+
+        if self.enable_insert_checkpoint and not os.path.isdir(self.working_dir):
+            logger.warning(
+                f"Insert checkpoints disabled, working directory {self.working_dir} "
+                "doesn't exist and always_create_working_dir is False"
+            )
+        self.insert_checkpoint = (
+            IngestCheckpoint(os.path.join(self.working_dir, "ingest_checkpoint.json"))
+            if self.enable_insert_checkpoint and os.path.isdir(self.working_dir)
+            else None
+        )
+
         self.community_reports = self.key_string_value_json_storage_cls(
             namespace="community_reports", global_config=asdict(self)
         )
+        self.community_index = self.key_string_value_json_storage_cls(
+            namespace="community_index", global_config=asdict(self)
+        )
+        self._community_index_checked = False
         self.chunk_entity_relation_graph = self.graph_storage_cls(
             namespace="chunk_entity_relation", global_config=asdict(self)
         )
 
-        self.embedding_func = limit_async_func_call(self.embedding_func_max_async)(
-            self.embedding_func
-        )
+        self.embedding_func = AsyncLimiter(
+            max_concurrency=self.embedding_func_max_async,
+            adaptive=self.enable_adaptive_concurrency,
+            tokens_per_minute=self.embedding_max_tokens_per_minute,
+            token_counter=count_embedding_call_tokens,
+            class_limits=self.llm_priority_class_limits,
+            aging_interval=self.llm_priority_aging_interval,
+        )(instrument_embedding_func(self.embedding_func))
+        if self.query_cache is not None:
+            self.query_cache.embedding_func = self.embedding_func
         self.entities_vdb = (
             self.vector_db_storage_cls(
                 namespace="entities",
@@ -187,6 +407,15 @@ class GraphRAG:
             if self.enable_local
             else None
         )
+        self.community_reports_vdb = (
+            self.vector_db_storage_cls(
+                namespace="community_reports",
+                global_config=asdict(self),
+                embedding_func=self.embedding_func,
+            )
+            if self.enable_community_report_vdb
+            else None
+        )
         self.chunks_vdb = (
             self.vector_db_storage_cls(
                 namespace="chunks",
@@ -197,26 +426,80 @@ class GraphRAG:
             else None
         )
 
-        self.best_model_func = limit_async_func_call(self.best_model_max_async)(
-            partial(self.best_model_func, hashing_kv=self.llm_response_cache)
+        self.best_model_func = self._model_limiter(
+            self.best_model_max_async, self.best_model_max_tokens_per_minute
+        )(
+            instrument_model_func(
+                partial(self.best_model_func, hashing_kv=self.llm_response_cache)
+            )
+        )
+        self.cheap_model_func = self._model_limiter(
+            self.cheap_model_max_async, self.cheap_model_max_tokens_per_minute
+        )(
+            instrument_model_func(
+                partial(self.cheap_model_func, hashing_kv=self.llm_response_cache)
+            )
         )
-        self.cheap_model_func = limit_async_func_call(self.cheap_model_max_async)(
-            partial(self.cheap_model_func, hashing_kv=self.llm_response_cache)
+        self.last_stats: Optional[RunStats] = None
+
+    def _model_limiter(self, max_async: int, tokens_per_minute: int) -> AsyncLimiter:
+        return AsyncLimiter(
+            max_concurrency=max_async,
+            adaptive=self.enable_adaptive_concurrency,
+            latency_target=self.llm_latency_target,
+            tokens_per_minute=tokens_per_minute,
+            token_counter=count_llm_call_tokens,
+            reserve_on_cache_miss=True,
+            class_limits=self.llm_priority_class_limits,
+            aging_interval=self.llm_priority_aging_interval,
         )
 
     def insert(self, string_or_strings):
         loop = always_get_an_event_loop()
         return loop.run_until_complete(self.ainsert(string_or_strings))
 
+    def insert_stream(self, docs, window: int = 16):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.ainsert_stream(docs, window=window))
+
     def query(self, query: str, param: QueryParam = QueryParam()):
         loop = always_get_an_event_loop()
         return loop.run_until_complete(self.aquery(query, param))
 
+    def close(self):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aclose())
+
+    async def aclose(self):
+        """Flush pending cache writes and close the pooled LLM clients.
+        Clients are reopened lazily if the instance is used again.
+        """
+        await self._query_done()
+        if self.query_cache is not None:
+            await self.query_cache.flush()
+        await close_async_clients()
+
+    def _set_last_stats(self, stats: RunStats):
+        self.last_stats = stats
+
+    @_tracked_run("query")
     async def aquery(self, query: str, param: QueryParam = QueryParam()):
+        with llm_priority("query", deadline=self.query_llm_deadline or None):
+            return await self._aquery(query, param)
+
+    async def _aquery(self, query: str, param: QueryParam):
         if param.mode == "local" and not self.enable_local:
             raise ValueError("enable_local is False, cannot query in local mode")
         if param.mode == "naive" and not self.enable_naive_rag:
             raise ValueError("enable_naive_rag is False, cannot query in naive mode")
+        if param.mode == "global":
+            await self._check_community_index()
+        if self.query_cache is not None:
+            index_version = self._index_version()
+            response = await self.query_cache.get(query, param, index_version)
+            if response is not None:
+                await self._query_done()
+                return response
         if param.mode == "local":
             response = await local_query(
                 query,
@@ -236,6 +519,8 @@ class GraphRAG:
                 self.text_chunks,
                 param,
                 asdict(self),
+                community_index=self.community_index,
+                community_reports_vdb=self.community_reports_vdb,
             )
         elif param.mode == "naive":
             response = await naive_query(
@@ -247,25 +532,145 @@ class GraphRAG:
             )
         else:
             raise ValueError(f"Unknown mode {param.mode}")
+        if self.query_cache is not None:
+            await self.query_cache.upsert(query, param, index_version, response)
         await self._query_done()
         return response
 
+    @_tracked_run("insert")
     async def ainsert(self, string_or_strings):
         await self._insert_start()
+        finished = False
         try:
             if isinstance(string_or_strings, str):
                 string_or_strings = [string_or_strings]
-            new_docs = {
-                compute_mdhash_id(c.strip(), prefix="doc-"): {"content": c.strip()}
-                for c in string_or_strings
-            }
-            _add_doc_keys = await self.full_docs.filter_keys(list(new_docs.keys()))
-            new_docs = {k: v for k, v in new_docs.items() if k in _add_doc_keys}
-            if not len(new_docs):
-                logger.warning(f"All docs are already in the storage")
+            inserted = await self._extract_documents(
+                string_or_strings,
+                drop_community_reports=not self.enable_incremental_community_report,
+            )
+            if inserted is None:
+                await self._resume_community_reports()
+                finished = True
                 return
-            logger.info(f"[New Docs] inserting {len(new_docs)} docs")
+            new_docs, inserting_chunks = inserted
+            await self.full_docs.upsert(new_docs)
+            await self.text_chunks.upsert(inserting_chunks)
+            await self._checkpoint("merged", self._merged_storages())
+
+            await self._generate_community_reports()
+            finished = True
+        finally:
+            await self._insert_done()
+            if finished and self.insert_checkpoint is not None:
+                self.insert_checkpoint.finish()
+
+    @_tracked_run("insert")
+    async def ainsert_stream(
+        self,
+        docs: Union[Iterable[str], AsyncIterable[str]],
+        window: int = 16,
+    ):
+        """Insert documents from a (possibly unbounded) sync or async iterable.
+
+        Documents are pulled `window` at a time and flow through chunking,
+        extraction, merging and upserting before the next window is read, so
+        memory is bounded by the window instead of the corpus. A window that
+        fails is logged and skipped: the graph and vector DBs are reloaded from
+        the flush of the previous window, so nothing it merged is persisted
+        (except by a graph storage that writes through, like Neo4j), and its
+        documents are not marked as inserted, so a later run retries them.
+        Communities are clustered and reported once, after the last window.
+        Returns the ids of the documents of the failed windows.
+        """
+        if isinstance(docs, str):
+            docs = [docs]
+        await self._insert_start()
+        finished = False
+        try:
+            inserted_windows = 0
+            failed_windows = 0
+            failed_doc_ids = []
+            async for docs_window in iterate_in_windows(docs, window):
+                try:
+                    inserted = await self._extract_documents(
+                        docs_window, drop_community_reports=False
+                    )
+                except Exception as e:
+                    failed_windows += 1
+                    failed_doc_ids.extend(
+                        compute_mdhash_id(c.strip(), prefix="doc-") for c in docs_window
+                    )
+                    logger.error(
+                        f"[Stream Insert] window of {len(docs_window)} docs failed, skipping: {e!r}"
+                    )
+                    self._reload_merged_storages()
+                    continue
+                if inserted is None:
+                    continue
+                new_docs, inserting_chunks = inserted
+                await self.full_docs.upsert(new_docs)
+                await self.text_chunks.upsert(inserting_chunks)
+                await self._insert_window_done()
+                await self._checkpoint("merged", [])
+                inserted_windows += 1
+            logger.info(
+                f"[Stream Insert] {inserted_windows} windows inserted, {failed_windows} failed"
+            )
+            if not inserted_windows:
+                await self._resume_community_reports()
+                finished = True
+                return failed_doc_ids
+            if not self.enable_incremental_community_report:
+                await self._drop_community_reports()
+            await self._checkpoint(
+                "merged",
+                [self.community_reports, self.community_index, self.community_reports_vdb],
+            )
+            await self._generate_community_reports()
+            finished = True
+            return failed_doc_ids
+        finally:
+            await self._insert_done()
+            if finished and self.insert_checkpoint is not None:
+                self.insert_checkpoint.finish()
+
+    def _reload_merged_storages(self):
+        """Drop what was merged since the last flush of the graph and vector DBs"""
+        self.chunk_entity_relation_graph = self.graph_storage_cls(
+            namespace="chunk_entity_relation", global_config=asdict(self)
+        )
+        if self.entities_vdb is not None:
+            self.entities_vdb = self.vector_db_storage_cls(
+                namespace="entities",
+                global_config=asdict(self),
+                embedding_func=self.embedding_func,
+                meta_fields={"entity_name"},
+            )
+        if self.chunks_vdb is not None:
+            self.chunks_vdb = self.vector_db_storage_cls(
+                namespace="chunks",
+                global_config=asdict(self),
+                embedding_func=self.embedding_func,
+            )
 
+    async def _extract_documents(
+        self, string_or_strings: list[str], drop_community_reports: bool
+    ) -> Union[tuple[dict, dict], None]:
+        """Chunk new documents and merge their entities into the graph.
+        Returns the new docs and chunks, or None if nothing new was extracted.
+        """
+        new_docs = {
+            compute_mdhash_id(c.strip(), prefix="doc-"): {"content": c.strip()}
+            for c in string_or_strings
+        }
+        _add_doc_keys = await self.full_docs.filter_keys(list(new_docs.keys()))
+        new_docs = {k: v for k, v in new_docs.items() if k in _add_doc_keys}
+        if not len(new_docs):
+            logger.warning(f"All docs are already in the storage")
+            return None
+        logger.info(f"[New Docs] inserting {len(new_docs)} docs")
+
+        with span("chunking"):
             inserting_chunks = get_chunks(
                 new_docs=new_docs,
                 chunk_func=self.chunk_func,
@@ -273,46 +678,214 @@ class GraphRAG:
                 max_token_size=self.chunk_token_size,
             )
 
-            _add_chunk_keys = await self.text_chunks.filter_keys(
-                list(inserting_chunks.keys())
-            )
-            inserting_chunks = {
-                k: v for k, v in inserting_chunks.items() if k in _add_chunk_keys
-            }
-            if not len(inserting_chunks):
-                logger.warning(f"All chunks are already in the storage")
-                return
-            logger.info(f"[New Chunks] inserting {len(inserting_chunks)} chunks")
-            if self.enable_naive_rag:
-                logger.info("Insert chunks for naive RAG")
+        _add_chunk_keys = await self.text_chunks.filter_keys(
+            list(inserting_chunks.keys())
+        )
+        inserting_chunks = {
+            k: v for k, v in inserting_chunks.items() if k in _add_chunk_keys
+        }
+        if not len(inserting_chunks):
+            logger.warning(f"All chunks are already in the storage")
+            return None
+        logger.info(f"[New Chunks] inserting {len(inserting_chunks)} chunks")
+        if self.enable_naive_rag:
+            logger.info("Insert chunks for naive RAG")
+            with span("chunks_vdb_upsert"):
                 await self.chunks_vdb.upsert(inserting_chunks)
 
-            await self.community_reports.drop()
+        if drop_community_reports:
+            await self._drop_community_reports()
+        if self.insert_checkpoint is not None:
+            self.insert_checkpoint.start(list(inserting_chunks.keys()))
 
-            logger.info("[Entity Extraction]...")
-            maybe_new_kg = await self.entity_extraction_func(
+        logger.info("[Entity Extraction]...")
+        maybe_new_kg = await self._run_in_batch_rounds(
+            lambda: self.entity_extraction_func(
                 inserting_chunks,
                 knwoledge_graph_inst=self.chunk_entity_relation_graph,
                 entity_vdb=self.entities_vdb,
                 global_config=asdict(self),
                 using_amazon_bedrock=self.using_amazon_bedrock,
+                extraction_cache=self.extraction_cache,
+                gleaning_policy=self.gleaning_policy,
             )
-            if maybe_new_kg is None:
-                logger.warning("No new entities found")
-                return
-            self.chunk_entity_relation_graph = maybe_new_kg
-            logger.info("[Community Report]...")
-            await self.chunk_entity_relation_graph.clustering(
-                self.graph_cluster_algorithm
+        )
+        if maybe_new_kg is None:
+            logger.warning("No new entities found")
+            return None
+        self.chunk_entity_relation_graph = maybe_new_kg
+        return new_docs, inserting_chunks
+
+    async def _drop_community_reports(self):
+        if self.community_reports_vdb is not None:
+            await self.community_reports_vdb.delete(
+                await self.community_reports.all_keys()
             )
-            await generate_community_report(
-                self.community_reports, self.chunk_entity_relation_graph, asdict(self)
+        await self.community_reports.drop()
+        await self.community_index.drop()
+
+    async def _generate_community_reports(self):
+        logger.info("[Community Report]...")
+        checkpoint = self.insert_checkpoint
+        if checkpoint is not None and checkpoint.reached("clustered"):
+            logger.info("[Resume] keeping the clustering of the interrupted insert")
+        else:
+            with span("clustering"):
+                await self.chunk_entity_relation_graph.clustering(
+                    self.graph_cluster_algorithm
+                )
+            await self._checkpoint("clustered", [self.chunk_entity_relation_graph])
+        resume_reports = checkpoint is not None and checkpoint.reached("reporting")
+        if resume_reports:
+            logger.info(
+                f"[Resume] keeping the reports of levels {checkpoint.state['report_levels_done']}"
             )
+        await self._checkpoint("reporting", [])
+        await self._run_in_batch_rounds(
+            lambda: generate_community_report(
+                self.community_reports,
+                self.chunk_entity_relation_graph,
+                asdict(self),
+                community_index_kv=self.community_index,
+                community_reports_vdb=self.community_reports_vdb,
+                reuse_stored_reports=resume_reports,
+                on_level_done=(
+                    self._community_level_done if checkpoint is not None else None
+                ),
+            )
+        )
 
-            await self.full_docs.upsert(new_docs)
-            await self.text_chunks.upsert(inserting_chunks)
-        finally:
-            await self._insert_done()
+    async def _resume_community_reports(self):
+        """Finish an insert that was interrupted after its merge was persisted"""
+        if self.insert_checkpoint is None or not self.insert_checkpoint.reports_pending:
+            return
+        logger.info("[Resume] finishing the community reports of the interrupted insert")
+        await self._generate_community_reports()
+
+    async def _community_level_done(self, level: int, reports: dict):
+        await self.community_reports.upsert(reports)
+        await self.community_reports.index_done_callback()
+        if self.community_reports_vdb is not None:
+            await self.community_reports_vdb.index_done_callback()
+        self.insert_checkpoint.report_level_done(level)
+
+    async def _checkpoint(self, stage: str, storages: list):
+        """Persist `storages`, then record that the insert reached `stage`"""
+        if self.insert_checkpoint is None:
+            return
+        await asyncio.gather(
+            *[
+                cast(StorageNameSpace, s).index_done_callback()
+                for s in storages
+                if s is not None
+            ]
+        )
+        self.insert_checkpoint.advance(stage)
+
+    def _merged_storages(self) -> list:
+        return [
+            self.full_docs,
+            self.text_chunks,
+            self.llm_response_cache,
+            self.extraction_cache,
+            self.gleaning_policy,
+            self.community_reports,
+            self.community_index,
+            self.community_reports_vdb,
+            self.entities_vdb,
+            self.chunks_vdb,
+            self.chunk_entity_relation_graph,
+        ]
+
+    async def _run_in_batch_rounds(self, stage: Callable[[], Awaitable]):
+        """Await `stage()`. In batch mode, the stage is run again after every
+        batch of the calls it deferred, until it finishes without deferring any.
+        """
+        if not self.enable_batch_mode:
+            return await stage()
+        batch_round = 0
+        while True:
+            with collect_batch_requests() as collector:
+                result = await stage()
+            if not collector.requests:
+                return result
+            batch_round += 1
+            logger.info(
+                f"[Batch] round {batch_round}: waiting for {len(collector.requests)} requests"
+            )
+            with span("batch_wait"):
+                responses = await run_batch(
+                    self.batch_backend,
+                    list(collector.requests.values()),
+                    self.working_dir,
+                )
+            if not responses:
+                raise RuntimeError(f"Every request of batch round {batch_round} failed")
+            await self.llm_response_cache.upsert(
+                {
+                    k: {"return": v, "model": collector.requests[k]["body"]["model"]}
+                    for k, v in responses.items()
+                }
+            )
+            await self.llm_response_cache.index_done_callback()
+            clear_batch_state(self.working_dir)
+
+    async def _check_community_index(self):
+        """Rebuild the community index, once per instance, if the reports file
+        was written after it: the deletion scripts rewrite reports but not the
+        index, which would rank candidates by stale ratings and ids, nor the
+        report embeddings, which are refreshed along with it.
+        """
+        if self._community_index_checked:
+            return
+        self._community_index_checked = True
+        reports_file = getattr(self.community_reports, "_file_name", None)
+        index_file = getattr(self.community_index, "_file_name", None)
+        if not (
+            reports_file
+            and index_file
+            and os.path.exists(reports_file)
+            and os.path.exists(index_file)
+        ):
+            return
+        if os.path.getmtime(reports_file) <= os.path.getmtime(index_file):
+            return
+        logger.info("Community reports changed after the community index, rebuilding it")
+        await rebuild_community_index(
+            self.community_reports, self.community_index, self.community_reports_vdb
+        )
+        await self.community_index.index_done_callback()
+        if self.community_reports_vdb is not None:
+            await self.community_reports_vdb.index_done_callback()
+
+    def _index_version(self) -> str:
+        """Fingerprint the stored index files, so edits made outside this
+        instance (e.g. the deletion scripts rewriting GraphML or report files)
+        invalidate cached answers too. Inserts invalidate the cache directly.
+        """
+        files = []
+        if os.path.isdir(self.working_dir):
+            for name in sorted(os.listdir(self.working_dir)):
+                if not (
+                    name.startswith(("kv_store_", "vdb_", "graph_"))
+                    # HNSWVectorStorage files
+                    or name.endswith(("_hnsw.index", "_hnsw_metadata.pkl"))
+                ) or (
+                    "llm_response_cache" in name
+                    or "extraction_cache" in name
+                    or "gleaning_policy" in name
+                    or "query_cache" in name
+                ):
+                    continue
+                stat = os.stat(os.path.join(self.working_dir, name))
+                files.append((name, stat.st_mtime_ns, stat.st_size))
+        return compute_args_hash(files)
+
+    async def invalidate_query_cache(self):
+        if self.query_cache is None:
+            return
+        await self.query_cache.invalidate()
+        await self.query_cache.flush()
 
     async def _insert_start(self):
         tasks = []
@@ -330,7 +903,30 @@ class GraphRAG:
             self.full_docs,
             self.text_chunks,
             self.llm_response_cache,
+            self.extraction_cache,
+            self.gleaning_policy,
             self.community_reports,
+            self.community_index,
+            self.community_reports_vdb,
+            self.entities_vdb,
+            self.chunks_vdb,
+            self.chunk_entity_relation_graph,
+        ]:
+            if storage_inst is None:
+                continue
+            tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
+        await asyncio.gather(*tasks)
+        await self.invalidate_query_cache()
+
+    async def _insert_window_done(self):
+        """Persist one streamed window so a later failure can't roll it back"""
+        tasks = []
+        for storage_inst in [
+            self.full_docs,
+            self.text_chunks,
+            self.llm_response_cache,
+            self.extraction_cache,
+            self.gleaning_policy,
             self.entities_vdb,
             self.chunks_vdb,
             self.chunk_entity_relation_graph,
@@ -342,7 +938,7 @@ class GraphRAG:
 
     async def _query_done(self):
         tasks = []
-        for storage_inst in [self.llm_response_cache]:
+        for storage_inst in [self.llm_response_cache, self.query_cache]:
             if storage_inst is None:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
@@ -311,6 +311,30 @@ Output:
 """
 
 
+PROMPTS[
+    "summarize_entity_descriptions_batch"
+] = """You are a helpful assistant responsible for summarizing the descriptions of several entities, or groups of entities, at once.
+Every item below has an id, one or two entities and a list of descriptions, all related to those entities.
+For each item, concatenate its descriptions into a single, comprehensive description. Make sure to include information collected from all of its descriptions, and never mix information between items.
+If the descriptions of an item are contradictory, please resolve the contradictions and provide a single, coherent summary.
+Make sure every summary is written in third person, and include the entity names so we the have full context.
+
+Return a JSON object that maps every item id to its summary, for example:
+{{"1": "<summary of item 1>", "2": "<summary of item 2>"}}
+
+#######
+-Data-
+{items}
+#######
+Output:
+"""
+
+PROMPTS["summarize_entity_descriptions_batch_item"] = """Item {item_id}
+Entities: {entity_name}
+Description List: {description_list}
+"""
+
+
 PROMPTS[
     "entiti_continue_extraction"
 ] = """MANY entities were missed in the last extraction.  Add them below using the same format:
@@ -0,0 +1,25 @@
+import random
+
+import pytest
+
+NAMES = [
+    "Alaric", "Brenna", "Cedric", "Dorian", "Elowen", "Fenwick", "Gwendolyn",
+    "Hadrian", "Isolde", "Jareth", "Kestrel", "Lysander", "Morwenna", "Nerys",
+]
+VERBS = ["meets", "betrays", "helps", "follows", "writes to", "argues with"]
+
+
+@pytest.fixture
+def corpus():
+    """Documents for the offline "fake" provider, which extracts capitalized names"""
+    rng = random.Random(0)
+    docs = []
+    for i in range(8):
+        cast = rng.sample(NAMES, 6)
+        docs.append(
+            " ".join(
+                f"{rng.choice(cast)} {rng.choice(VERBS)} {rng.choice(cast)} in chapter {i}."
+                for _ in range(30)
+            )
+        )
+    return docs
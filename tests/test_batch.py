@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+
+import pytest
+
+from nano_graphrag import GraphRAG
+from nano_graphrag._batch import (
+    BATCH_STATE_FILE,
+    BatchPending,
+    LocalBatchBackend,
+    clear_batch_state,
+    collect_batch_requests,
+    defer_to_batch,
+    run_batch,
+)
+from nano_graphrag._llm import fake_complete
+from nano_graphrag._utils import llm_priority
+
+
+@dataclass
+class CountingBackend(LocalBatchBackend):
+    submitted: int = 0
+
+    async def submit(self, requests_path: str) -> str:
+        self.submitted += 1
+        return await super().submit(requests_path)
+
+
+class CrashingBackend(LocalBatchBackend):
+    async def poll(self, batch_id: str, results_path: str) -> bool:
+        raise RuntimeError("crashed while waiting")
+
+
+def test_defer_to_batch_collects_only_its_classes():
+    messages = [{"role": "user", "content": "hi"}]
+    # outside a collector the call is made
+    defer_to_batch("a", "model", messages)
+    with collect_batch_requests(("extraction",)) as collector:
+        with llm_priority("query"):
+            defer_to_batch("b", "model", messages)
+        with llm_priority("extraction"):
+            with pytest.raises(BatchPending):
+                defer_to_batch("c", "model", messages, temperature=0)
+    assert list(collector.requests) == ["c"]
+    assert collector.requests["c"]["body"] == {
+        "model": "model",
+        "messages": messages,
+        "temperature": 0,
+    }
+
+
+def _request(custom_id, content):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": "fake", "messages": [{"role": "user", "content": content}]},
+    }
+
+
+def test_run_batch_resumes_the_submitted_batch(tmp_path):
+    working_dir = str(tmp_path)
+    requests = [_request("a", "hello"), _request("b", "world")]
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await run_batch(
+                CrashingBackend(complete_func=fake_complete), requests, working_dir
+            )
+        with open(os.path.join(working_dir, BATCH_STATE_FILE)) as f:
+            assert json.load(f)["status"] == "submitted"
+
+        backend = CountingBackend(complete_func=fake_complete)
+        responses = await run_batch(backend, requests[::-1], working_dir)
+        assert backend.submitted == 0
+        assert sorted(responses) == ["a", "b"]
+
+        # other requests are submitted as a new batch
+        responses = await run_batch(backend, [_request("c", "again")], working_dir)
+        assert backend.submitted == 1
+        assert list(responses) == ["c"]
+
+    asyncio.run(main())
+    clear_batch_state(working_dir)
+    assert os.listdir(working_dir) == []
+
+
+def _graph(rag):
+    graph = rag.chunk_entity_relation_graph._graph
+    return sorted(graph.nodes), sorted(tuple(sorted(e)) for e in graph.edges)
+
+
+def _reports(working_dir):
+    with open(os.path.join(working_dir, "kv_store_community_reports.json")) as f:
+        return {k: v["report_string"] for k, v in json.load(f).items()}
+
+
+def test_batch_mode_matches_online_insert(tmp_path, corpus):
+    online_dir, batch_dir = str(tmp_path / "online"), str(tmp_path / "batch")
+
+    async def main():
+        online = GraphRAG(
+            working_dir=online_dir, llm_provider="fake", entity_extract_max_gleaning=1
+        )
+        await online.ainsert(corpus)
+
+        crashed = GraphRAG(
+            working_dir=batch_dir,
+            llm_provider="fake",
+            entity_extract_max_gleaning=1,
+            enable_batch_mode=True,
+            batch_backend=CrashingBackend(complete_func=fake_complete),
+        )
+        with pytest.raises(RuntimeError):
+            await crashed.ainsert(corpus)
+
+        backend = CountingBackend(complete_func=fake_complete)
+        batch = GraphRAG(
+            working_dir=batch_dir,
+            llm_provider="fake",
+            entity_extract_max_gleaning=1,
+            enable_batch_mode=True,
+            batch_backend=backend,
+        )
+        await batch.ainsert(corpus)
+        # the first round is the batch submitted before the crash
+        rounds = batch.last_stats.spans["batch_wait"].count
+        assert rounds > 1
+        assert backend.submitted == rounds - 1
+        assert _graph(batch) == _graph(online)
+
+    asyncio.run(main())
+    assert _reports(batch_dir) == _reports(online_dir)
+    assert not [f for f in os.listdir(batch_dir) if f.startswith("batch_")]
+
+
+def test_batch_mode_needs_llm_cache(tmp_path):
+    with pytest.raises(ValueError):
+        GraphRAG(
+            working_dir=str(tmp_path),
+            llm_provider="fake",
+            enable_batch_mode=True,
+            enable_llm_cache=False,
+        )
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from nano_graphrag import GraphRAG
+from nano_graphrag._checkpoint import IngestCheckpoint
+
+
+def test_checkpoint_stages(tmp_path):
+    file_name = str(tmp_path / "ingest_checkpoint.json")
+    checkpoint = IngestCheckpoint(file_name)
+    assert checkpoint.stage is None
+    assert not checkpoint.reports_pending
+
+    checkpoint.start(["chunk-b", "chunk-a"])
+    assert checkpoint.stage == "extracting"
+    assert checkpoint.reached("extracting")
+    assert not checkpoint.reached("merged")
+    checkpoint.advance("merged")
+    checkpoint.advance("reporting")
+    checkpoint.report_level_done(0)
+
+    # a new process finds the interrupted insert
+    resumed = IngestCheckpoint(file_name)
+    assert resumed.stage == "reporting"
+    assert resumed.reached("clustered")
+    assert resumed.reports_pending
+    assert resumed.state["report_levels_done"] == [0]
+    assert resumed.state["chunks"] == 2
+
+    resumed.finish()
+    assert resumed.stage is None
+    assert not os.path.exists(file_name)
+
+
+def test_checkpoint_remembers_earlier_merge(tmp_path):
+    checkpoint = IngestCheckpoint(str(tmp_path / "ingest_checkpoint.json"))
+    checkpoint.start(["chunk-a"])
+    checkpoint.advance("merged")
+    # the next window starts before the reports of the first were made
+    checkpoint.start(["chunk-b"])
+    assert checkpoint.stage == "extracting"
+    assert checkpoint.reports_pending
+
+
+def _crash_after(rag, marker, calls):
+    inner = rag.best_model_func
+    seen = 0
+
+    async def crashing(prompt, *args, **kwargs):
+        nonlocal seen
+        if marker in prompt:
+            seen += 1
+            if seen > calls:
+                raise RuntimeError("crashed")
+        return await inner(prompt, *args, **kwargs)
+
+    rag.best_model_func = crashing
+
+
+def _reports(working_dir):
+    with open(os.path.join(working_dir, "kv_store_community_reports.json")) as f:
+        reports = json.load(f)
+    for report in reports.values():
+        # collected from a set, the order depends on how the graph was built
+        report["edges"] = sorted(map(tuple, report["edges"]))
+    return reports
+
+
+@pytest.mark.parametrize("marker,calls", [("-Real Data-", 4), ("# Real Data", 2)])
+def test_interrupted_insert_resumes(tmp_path, corpus, marker, calls):
+    """Crash during extraction or during the community reports, then rerun"""
+    ref_dir, dir_ = str(tmp_path / "ref"), str(tmp_path / "resumed")
+    for d in (ref_dir, dir_):
+        os.makedirs(d)
+
+    def make(working_dir):
+        return GraphRAG(
+            working_dir=working_dir,
+            llm_provider="fake",
+            enable_llm_cache=False,
+            enable_insert_checkpoint=True,
+        )
+
+    async def main():
+        await make(ref_dir).ainsert(corpus)
+        assert not os.path.exists(os.path.join(ref_dir, "ingest_checkpoint.json"))
+
+        rag = make(dir_)
+        _crash_after(rag, marker, calls)
+        with pytest.raises(RuntimeError):
+            await rag.ainsert(corpus)
+        assert os.path.exists(os.path.join(dir_, "ingest_checkpoint.json"))
+
+        await make(dir_).ainsert(corpus)
+        assert not os.path.exists(os.path.join(dir_, "ingest_checkpoint.json"))
+
+    asyncio.run(main())
+    assert _reports(dir_) == _reports(ref_dir)
+
+
+def test_checkpoint_needs_working_dir(tmp_path):
+    rag = GraphRAG(
+        working_dir=str(tmp_path / "missing"),
+        llm_provider="fake",
+        always_create_working_dir=False,
+        enable_insert_checkpoint=True,
+    )
+    assert rag.insert_checkpoint is None
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from nano_graphrag._storage import (
+    JsonKVStorage,
+    SQLiteKVStorage,
+    WriteBehindKVStorage,
+)
+
+
+def _open(storage_cls, working_dir, namespace="test"):
+    return storage_cls(namespace=namespace, global_config={"working_dir": str(working_dir)})
+
+
+@pytest.mark.parametrize("storage_cls", [JsonKVStorage, SQLiteKVStorage])
+def test_kv_roundtrip(tmp_path, storage_cls):
+    async def main():
+        kv = _open(storage_cls, tmp_path)
+        await kv.upsert({"a": {"x": 1, "y": "ü"}, "b": {"x": 2, "y": "b"}})
+        assert await kv.get_by_id("a") == {"x": 1, "y": "ü"}
+        assert await kv.get_by_id("missing") is None
+        assert await kv.get_by_ids(["b", "missing", "a"], fields={"x"}) == [
+            {"x": 2},
+            None,
+            {"x": 1},
+        ]
+        assert await kv.filter_keys(["a", "c"]) == {"c"}
+        await kv.index_done_callback()
+        assert kv.last_flush_bytes > 0
+
+        reopened = _open(storage_cls, tmp_path)
+        assert sorted(await reopened.all_keys()) == ["a", "b"]
+        assert await reopened.get_by_ids(["a", "b"]) == [
+            {"x": 1, "y": "ü"},
+            {"x": 2, "y": "b"},
+        ]
+
+        await reopened.upsert({"a": {"x": 3}})
+        assert await reopened.get_by_id("a") == {"x": 3}
+        await reopened.drop()
+        assert await reopened.all_keys() == []
+        await reopened.upsert({"c": {"x": 4}})
+        await reopened.index_done_callback()
+        assert await _open(storage_cls, tmp_path).all_keys() == ["c"]
+
+    asyncio.run(main())
+
+
+def test_sqlite_kv_imports_json_store(tmp_path):
+    with open(tmp_path / "kv_store_test.json", "w", encoding="utf-8") as f:
+        json.dump({"a": {"x": 1}, "b": {"x": 2}}, f)
+
+    async def main():
+        kv = _open(SQLiteKVStorage, tmp_path)
+        assert sorted(await kv.all_keys()) == ["a", "b"]
+        assert await kv.get_by_id("b") == {"x": 2}
+
+    asyncio.run(main())
+    assert os.path.exists(tmp_path / "kv_store_test.sqlite")
+
+
+def test_sqlite_kv_batches_large_reads(tmp_path):
+    async def main():
+        kv = _open(SQLiteKVStorage, tmp_path)
+        await kv.upsert({str(i): {"i": i} for i in range(2500)})
+        await kv.index_done_callback()
+        ids = [str(i) for i in range(2500)]
+        assert await kv.get_by_ids(ids) == [{"i": i} for i in range(2500)]
+        assert await kv.filter_keys(ids + ["new"]) == {"new"}
+
+    asyncio.run(main())
+
+
+def test_write_behind_flushes_every_n_upserts(tmp_path):
+    async def main():
+        inner = _open(JsonKVStorage, tmp_path)
+        kv = WriteBehindKVStorage(
+            namespace="test",
+            global_config={"working_dir": str(tmp_path)},
+            storage=inner,
+            flush_every=3,
+            flush_interval=3600,
+        )
+        for i in range(7):
+            await kv.upsert({str(i): {"i": i}})
+            # reads see the upsert before it is flushed
+            assert await kv.get_by_id(str(i)) == {"i": i}
+        assert kv.stats["flushes"] == 2
+        assert kv.stats["pending_upserts"] == 1
+        assert sorted(await _open(JsonKVStorage, tmp_path).all_keys()) == [
+            str(i) for i in range(6)
+        ]
+
+        await kv.index_done_callback()
+        assert kv.stats["flushes"] == 3
+        assert kv.stats["pending_upserts"] == 0
+        assert kv.stats["bytes_written"] > 0
+        assert len(await _open(JsonKVStorage, tmp_path).all_keys()) == 7
+        # nothing pending, nothing written
+        await kv.flush()
+        assert kv.stats["flushes"] == 3
+
+    asyncio.run(main())
+
+
+def test_write_behind_flushes_after_interval(tmp_path):
+    async def main():
+        kv = WriteBehindKVStorage(
+            namespace="test",
+            global_config={"working_dir": str(tmp_path)},
+            storage=_open(JsonKVStorage, tmp_path),
+            flush_every=100,
+            flush_interval=0.05,
+        )
+        await kv.upsert({"a": {"x": 1}})
+        assert kv.stats["flushes"] == 0
+        await asyncio.sleep(0.2)
+        assert kv.stats["flushes"] == 1
+        assert await _open(JsonKVStorage, tmp_path).get_by_id("a") == {"x": 1}
+
+    asyncio.run(main())
+
+
+def test_write_behind_needs_a_storage(tmp_path):
+    with pytest.raises(ValueError):
+        WriteBehindKVStorage(namespace="test", global_config={"working_dir": str(tmp_path)})
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from nano_graphrag._utils import (
+    AsyncLimiter,
+    llm_priority,
+    reserve_call_tokens,
+    skip_call_tokens,
+)
+
+
+def test_concurrency_is_bounded():
+    limiter = AsyncLimiter(max_concurrency=2)
+    active, peak = 0, 0
+
+    @limiter
+    async def work():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+
+    async def main():
+        await asyncio.gather(*[work() for _ in range(8)])
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.stats["calls"] == 8
+    assert limiter.stats["active"] == 0
+    assert limiter.stats["max_queue_depth"] == 6
+
+
+def test_slot_is_released_on_error():
+    limiter = AsyncLimiter(max_concurrency=1)
+
+    @limiter
+    async def fail():
+        raise ValueError("boom")
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                await fail()
+
+    asyncio.run(main())
+    assert limiter.stats["errors"] == 3
+    assert limiter.stats["active"] == 0
+
+
+def test_waiters_are_served_by_priority():
+    limiter = AsyncLimiter(max_concurrency=1, aging_interval=0)
+    order = []
+
+    @limiter
+    async def work(name):
+        order.append(name)
+        await asyncio.sleep(0.01)
+
+    async def run(name, priority_class):
+        with llm_priority(priority_class):
+            await work(name)
+
+    async def main():
+        # the first call takes the only slot, the rest queue in this order
+        tasks = [asyncio.ensure_future(run("first", "extraction"))]
+        await asyncio.sleep(0)
+        for name, priority_class in [
+            ("summary", "summarization"),
+            ("extraction", "extraction"),
+            ("query", "query"),
+        ]:
+            tasks.append(asyncio.ensure_future(run(name, priority_class)))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["first", "query", "extraction", "summary"]
+
+
+def test_unknown_priority_class_is_rejected():
+    with pytest.raises(ValueError):
+        with llm_priority("urgent"):
+            pass
+
+
+def test_tokens_are_reserved_on_cache_miss_only():
+    limiter = AsyncLimiter(
+        max_concurrency=4,
+        tokens_per_minute=600_000,
+        token_counter=lambda prompt: len(prompt),
+        reserve_on_cache_miss=True,
+    )
+
+    @limiter
+    async def cached(prompt):
+        skip_call_tokens()
+        return prompt
+
+    @limiter
+    async def missed(prompt):
+        await reserve_call_tokens()
+        return prompt
+
+    @limiter
+    async def unaware(prompt):
+        return prompt
+
+    async def main():
+        await cached("x" * 100)
+        assert limiter.stats["tokens_reserved"] == 0
+        await missed("x" * 100)
+        assert limiter.stats["tokens_reserved"] == 100
+        # a function that never reserves is charged after it returns
+        await unaware("x" * 50)
+        assert limiter.stats["tokens_reserved"] == 150
+
+    asyncio.run(main())
+
+
+def test_tokens_per_minute_delays_calls():
+    limiter = AsyncLimiter(
+        max_concurrency=4, tokens_per_minute=6000, token_counter=lambda n: n
+    )
+
+    @limiter
+    async def call(n):
+        return n
+
+    async def main():
+        # the budget starts full, the overdraft of 50 tokens takes 0.5s
+        await call(6000)
+        await call(50)
+
+    asyncio.run(main())
+    assert limiter.stats["tokens_reserved"] == 6050
+    assert limiter.stats["token_wait_time"] == pytest.approx(0.5, abs=0.05)
@@ -0,0 +1,86 @@
+import random
+
+from nano_graphrag._op import ExtractionRecordParser
+from nano_graphrag.prompt import PROMPTS
+
+TUPLE = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+RECORD = PROMPTS["DEFAULT_RECORD_DELIMITER"]
+COMPLETE = PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+
+
+def _entity(name, type_, description):
+    return f'("entity"{TUPLE}"{name}"{TUPLE}"{type_}"{TUPLE}"{description}")'
+
+
+def _relationship(src, tgt, description, weight):
+    return (
+        f'("relationship"{TUPLE}"{src}"{TUPLE}"{tgt}"{TUPLE}"{description}"'
+        f"{TUPLE}{weight})"
+    )
+
+
+RESPONSE = RECORD.join(
+    [
+        _entity("Alice", "person", "A &amp; B's friend"),
+        _entity("bob", "person", "Alice's colleague"),
+        _relationship("Alice", "Bob", "work together", 7),
+        _relationship("alice", "carol", "met once", "unknown"),
+        _entity("Alice", "person", "Seen again"),
+    ]
+) + COMPLETE
+
+
+def test_parse_groups_records():
+    nodes, edges = ExtractionRecordParser().parse(RESPONSE, "chunk-1")
+    assert sorted(nodes) == ['"ALICE"', '"BOB"']
+    assert [dp["description"] for dp in nodes['"ALICE"']] == [
+        "\"A & B's friend\"",
+        '"Seen again"',
+    ]
+    assert nodes['"BOB"'][0]["entity_type"] == '"PERSON"'
+    assert nodes['"BOB"'][0]["source_id"] == "chunk-1"
+    assert edges[('"ALICE"', '"BOB"')][0]["weight"] == 7.0
+    # a weight that is not a number defaults to 1
+    assert edges[('"ALICE"', '"CAROL"')][0]["weight"] == 1.0
+
+
+def test_parse_skips_malformed_records():
+    response = RECORD.join(
+        [
+            "no parentheses here",
+            f'("entity"{TUPLE}"Alice")',
+            f'("relationship"{TUPLE}"A"{TUPLE}"B"{TUPLE}"too short")',
+            f'("unknown"{TUPLE}"A"{TUPLE}"B"{TUPLE}"C"{TUPLE}1)',
+            _entity("Dave", "person", "the only valid one"),
+        ]
+    )
+    nodes, edges = ExtractionRecordParser().parse(response, "chunk-1")
+    assert list(nodes) == ['"DAVE"']
+    assert not edges
+    assert ExtractionRecordParser().parse("", "chunk-1") == ({}, {})
+
+
+def test_feed_in_pieces_matches_parse():
+    rng = random.Random(0)
+    expected = list(ExtractionRecordParser().iter_records(RESPONSE, "chunk-1"))
+    for _ in range(50):
+        parser = ExtractionRecordParser()
+        records = []
+        i = 0
+        while i < len(RESPONSE):
+            step = rng.randint(1, 16)
+            records.extend(parser.feed(RESPONSE[i : i + step], "chunk-1"))
+            i += step
+        records.extend(parser.close("chunk-1"))
+        assert records == expected
+
+
+def test_feed_keeps_unterminated_tail():
+    parser = ExtractionRecordParser()
+    first = _entity("Alice", "person", "first")
+    assert parser.feed(first, "chunk-1") == []
+    records = parser.feed(RECORD + _entity("Bob", "person", "second"), "chunk-1")
+    assert [dp["entity_name"] for _, dp in records] == ['"ALICE"']
+    records = parser.close("chunk-1")
+    assert [dp["entity_name"] for _, dp in records] == ['"BOB"']
+    assert parser.close("chunk-1") == []